@@ -13,6 +13,20 @@ let resolvedHistoryChart;
 let trafficSignalLayer;
 let trafficSignalMarkers = {}; // Efficient object for updating
 
+// --- PUSH STREAM STATE (applied from /admin/stream deltas) ---
+const MAX_LOG_LINES = 50; // Same as the backend LOG_TAIL_LINES
+let dashboardStream = null;
+let heatmapEtag = null; // ETag of the last /admin/heatmap response
+let heatmapInfo = null; // { levels, extent } from the last /admin/heatmap response
+let activeIncidents = new Map(); // edge_id -> incident
+let logLines = [];
+let logCursor = null; // Last admin log seq seen; /admin/get_logs?since= returns only newer entries
+let dashboardStatic = null; // Static tables of the columnar /admin/dashboard_data (signal positions etc.)
+let dashboardStaticKey = '';
+// Bucketed history: { buckets: [[bucket_start, count], ...], count_before, bucket_s, cursor }
+let incidentHistory = null;
+let resolvedHistory = null;
+
 // --- NEW: Custom Icons for Traffic Lights ---
 const createTrafficLightIcon = (state) => {
     // Determine which color is "on" and which are "off"
@@ -146,6 +160,7 @@ document.addEventListener('DOMContentLoaded', () => {
     heatmapToggle.addEventListener('change', () => {
         if (heatmapToggle.checked) {
             map.addLayer(heatmapLayer);
+            fetchHeatmapTiles();
             console.log('Heatmap layer ADDED');
         } else {
             map.removeLayer(heatmapLayer);
@@ -198,7 +213,92 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
     
-    // 5. Start fetching data
+    // Heatmap cells are fetched per zoom level + visible bounds
+    map.on('moveend', fetchHeatmapTiles);
+
+    // 5. Start receiving data (push stream; polling only without EventSource)
+    if (window.EventSource) {
+        startDashboardStream();
+    } else {
+        startPolling();
+    }
+});
+
+
+/**
+ * Opens the server-sent-events stream. The server sends one full "snapshot"
+ * event, then only deltas. EventSource reconnects on its own and every
+ * reconnect starts with a fresh snapshot.
+ */
+function startDashboardStream() {
+    dashboardStream = new EventSource(`${BACKEND_URL}/admin/stream`);
+
+    dashboardStream.addEventListener('snapshot', (event) => {
+        const data = JSON.parse(event.data);
+
+        activeIncidents = new Map(data.incidents.map(incident => [incident.edge_id, incident]));
+        logLines = data.logs.slice(-MAX_LOG_LINES);
+        logCursor = data.log_cursor;
+        incidentHistory = data.incident_history;
+        resolvedHistory = data.resolved_history;
+
+        updateTrafficSignals(data.signals);
+        fetchHeatmapTiles();
+        updateMap(Array.from(activeIncidents.values()));
+        updateLogBox(logLines);
+        updateHistoryChart(incidentHistory, incidentHistoryChart);
+        updateHistoryChart(resolvedHistory, resolvedHistoryChart);
+        updateLatencyStat(data.traci_latency_ms);
+    });
+
+    dashboardStream.addEventListener('signals', (event) => {
+        applySignalDelta(JSON.parse(event.data));
+    });
+
+    dashboardStream.addEventListener('heatmap', () => {
+        fetchHeatmapTiles(); // Revalidates with the ETag; unchanged cells cost a 304
+    });
+
+    dashboardStream.addEventListener('incidents', (event) => {
+        const delta = JSON.parse(event.data);
+        delta.add.forEach(incident => activeIncidents.set(incident.edge_id, incident));
+        delta.remove.forEach(edge_id => activeIncidents.delete(edge_id));
+        updateMap(Array.from(activeIncidents.values()));
+    });
+
+    dashboardStream.addEventListener('history', (event) => {
+        const entry = JSON.parse(event.data);
+        if (entry.kind === 'reported') {
+            addHistoryEvents(incidentHistory, [entry.ts]);
+            updateHistoryChart(incidentHistory, incidentHistoryChart);
+        } else {
+            addHistoryEvents(resolvedHistory, [entry.ts]);
+            updateHistoryChart(resolvedHistory, resolvedHistoryChart);
+        }
+    });
+
+    dashboardStream.addEventListener('log', (event) => {
+        logLines.push(...JSON.parse(event.data).lines);
+        if (logLines.length > MAX_LOG_LINES) {
+            logLines.splice(0, logLines.length - MAX_LOG_LINES);
+        }
+        updateLogBox(logLines);
+    });
+
+    dashboardStream.addEventListener('latency', (event) => {
+        updateLatencyStat(JSON.parse(event.data).traci_latency_ms);
+    });
+
+    dashboardStream.onerror = () => {
+        console.error('Dashboard stream disconnected, retrying...');
+        updateLatencyStat(null);
+    };
+}
+
+/**
+ * Fallback for browsers without EventSource: the old polling loops.
+ */
+function startPolling() {
     fetchDashboardData();
     fetchLogs();
     fetchIncidentHistory();
@@ -207,11 +307,12 @@ document.addEventListener('DOMContentLoaded', () => {
     
     // --- Data fetch interval is 2s for signals ---
     setInterval(fetchDashboardData, 2000);
+    setInterval(fetchHeatmapTiles, 2000);
     setInterval(fetchLogs, 3000); 
     setInterval(fetchIncidentHistory, 5000);
     setInterval(fetchResolvedHistory, 5000);
     setInterval(fetchStatusData, 2000);
-});
+}
 
 
 /**
@@ -219,15 +320,25 @@ document.addEventListener('DOMContentLoaded', () => {
  */
 async function fetchDashboardData() {
     try {
-        const response = await fetch(`${BACKEND_URL}/admin/dashboard_data`);
+        // Columnar format: signal positions are only re-sent when the static key changes
+        const response = await fetch(`${BACKEND_URL}/admin/dashboard_data?format=columnar&static=${dashboardStaticKey}`);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         const data = await response.json();
+        if (data.static) {
+            dashboardStatic = data.static;
+            dashboardStaticKey = data.static_key;
+        }
 
-        updateMap(data.incidents); 
-        updateHeatmap(data.edge_heatmap_data);
-        updateTrafficSignals(data.traffic_light_states);
+        const incidents = data.incidents.edge_id.map((edge_id, i) => ({
+            edge_id, lat: data.incidents.lat[i], lon: data.incidents.lon[i]
+        }));
+        const signals = dashboardStatic.signals;
+        updateMap(incidents);
+        updateTrafficSignals(data.signal_codes.map((code, i) => ({
+            id: signals.id[i], lat: signals.lat[i], lon: signals.lon[i], state: dashboardStatic.signal_states[code]
+        })));
 
     } catch (error) {
         console.error('Failed to fetch dashboard data:', error);
@@ -252,45 +363,83 @@ function updateTrafficSignals(signals) {
 
     // 2. Add or Update markers
     signals.forEach(signal => {
-        let icon;
-        if (signal.state === 'green') {
-            icon = greenTrafficIcon;
-        } else if (signal.state === 'yellow') {
-            icon = yellowTrafficIcon;
-        } else {
-            icon = redTrafficIcon;
-        }
-
         if (trafficSignalMarkers[signal.id]) {
             // Marker exists, just update its icon
-            trafficSignalMarkers[signal.id].setIcon(icon);
+            trafficSignalMarkers[signal.id].setIcon(trafficIconFor(signal.state));
         } else {
-            // New marker, create it
-            const marker = L.marker([signal.lat, signal.lon], { 
-                icon: icon,
-                pane: 'markerPane' // Renders on top of map tiles
-            });
-            
-            marker.bindPopup(`<b>Traffic Light</b><br>ID: ${signal.id}`);
-            trafficSignalLayer.addLayer(marker);
-            trafficSignalMarkers[signal.id] = marker;
+            addTrafficSignalMarker(signal);
         }
     });
 }
 
+/**
+ * Applies a "signals" stream delta: only changed lights are touched.
+ */
+function applySignalDelta(delta) {
+    delta.add.forEach(addTrafficSignalMarker);
+    delta.update.forEach(([id, state]) => {
+        if (trafficSignalMarkers[id]) {
+            trafficSignalMarkers[id].setIcon(trafficIconFor(state));
+        }
+    });
+    delta.remove.forEach(id => {
+        if (trafficSignalMarkers[id]) {
+            trafficSignalLayer.removeLayer(trafficSignalMarkers[id]);
+            delete trafficSignalMarkers[id];
+        }
+    });
+}
+
+function trafficIconFor(state) {
+    if (state === 'green') {
+        return greenTrafficIcon;
+    } else if (state === 'yellow') {
+        return yellowTrafficIcon;
+    }
+    return redTrafficIcon;
+}
+
+function addTrafficSignalMarker(signal) {
+    const marker = L.marker([signal.lat, signal.lon], { 
+        icon: trafficIconFor(signal.state),
+        pane: 'markerPane' // Renders on top of map tiles
+    });
+    
+    marker.bindPopup(`<b>Traffic Light</b><br>ID: ${signal.id}`);
+    trafficSignalLayer.addLayer(marker);
+    trafficSignalMarkers[signal.id] = marker;
+}
+
+
+/**
+ * Polls one history endpoint: per-minute buckets the first time, then only
+ * the events after the last cursor. Returns the updated history object.
+ */
+async function pollHistory(endpoint, history, chartInstance) {
+    const incremental = history && history.cursor !== undefined;
+    const query = incremental ? `since=${history.cursor}` : 'bucket=minute';
+    const response = await fetch(`${BACKEND_URL}/admin/${endpoint}?${query}`);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const histData = await response.json();
+    if (!incremental || histData.truncated) {
+        if (incremental) return pollHistory(endpoint, null, chartInstance); // Fell behind: start over
+        history = histData;
+    } else {
+        addHistoryEvents(history, histData.history);
+        history.cursor = histData.cursor;
+    }
+    updateHistoryChart(history, chartInstance);
+    return history;
+}
 
 /**
  * Fetches the incident history from the backend.
  */
 async function fetchIncidentHistory() {
     try {
-        const response = await fetch(`${BACKEND_URL}/admin/incident_history`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const histData = await response.json();
-        updateHistoryChart(histData.history, incidentHistoryChart);
-
+        incidentHistory = await pollHistory('incident_history', incidentHistory, incidentHistoryChart);
     } catch (error) {
         console.error('Failed to fetch incident history:', error);
     }
@@ -301,29 +450,41 @@ async function fetchIncidentHistory() {
  */
 async function fetchResolvedHistory() {
     try {
-        const response = await fetch(`${BACKEND_URL}/admin/resolved_history`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const histData = await response.json();
-        updateHistoryChart(histData.history, resolvedHistoryChart);
-
+        resolvedHistory = await pollHistory('resolved_history', resolvedHistory, resolvedHistoryChart);
     } catch (error) {
         console.error('Failed to fetch resolved incident history:', error);
     }
 }
 
+/**
+ * Adds raw event timestamps to a bucketed history (events arrive in time order).
+ */
+function addHistoryEvents(history, timestamps) {
+    if (!history) return;
+    timestamps.forEach(ts => {
+        const key = Math.floor(ts / history.bucket_s) * history.bucket_s;
+        const last = history.buckets[history.buckets.length - 1];
+        if (last && last[0] === key) {
+            last[1] += 1;
+        } else {
+            history.buckets.push([key, 1]);
+        }
+    });
+}
+
 
 /**
- * Reusable function to update any time-series chart.
+ * Reusable function to update any time-series chart from bucketed counts.
  */
-function updateHistoryChart(timestamps, chartInstance) {
-    if (!chartInstance) return;
+function updateHistoryChart(history, chartInstance) {
+    if (!chartInstance || !history) return;
 
-    const chartData = timestamps.map((ts, index) => {
+    let total = history.count_before;
+    const chartData = history.buckets.map(([bucketStart, count]) => {
+        total += count;
         return {
-            x: ts * 1000, // Chart.js needs timestamps in milliseconds
-            y: index + 1  // Cumulative count (1, 2, 3...)
+            x: bucketStart * 1000, // Chart.js needs timestamps in milliseconds
+            y: total  // Cumulative count at the end of the bucket
         };
     });
 
@@ -370,16 +531,23 @@ function updateLatencyStat(latency) {
 
 
 /**
- * Fetches the latest logs from the backend.
+ * Fetches the log entries added since the last poll (the newest ones on the first poll).
  */
 async function fetchLogs() {
     try {
-        const response = await fetch(`${BACKEND_URL}/admin/get_logs`);
+        const query = logCursor === null ? '' : `?since=${logCursor}`;
+        const response = await fetch(`${BACKEND_URL}/admin/get_logs${query}`);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         const logData = await response.json();
-        updateLogBox(logData.logs);
+        logCursor = logData.cursor;
+        if (logData.logs.length === 0) return;
+        logLines.push(...logData.logs.map(entry => entry.line));
+        if (logLines.length > MAX_LOG_LINES) {
+            logLines.splice(0, logLines.length - MAX_LOG_LINES);
+        }
+        updateLogBox(logLines);
 
     } catch (error) {
         console.error('Failed to fetch logs:', error);
@@ -469,6 +637,44 @@ function updateHeatmap(heatmapData) {
     heatmapLayer.setLatLngs(heatPoints);
 }
 
+/**
+ * Picks the pyramid level whose cells are roughly a few pixels wide at the current map zoom.
+ */
+function heatmapLevelForZoom(zoom) {
+    if (!heatmapInfo) return null; // Server default (finest level)
+    const spanLon = heatmapInfo.extent[2] - heatmapInfo.extent[0];
+    const level = Math.round(Math.log2(spanLon * Math.pow(2, zoom + 1) / 360));
+    return Math.min(Math.max(level, 0), heatmapInfo.levels - 1);
+}
+
+/**
+ * Fetches heatmap cells for the visible bounds only. Sends the last ETag so
+ * an unchanged view costs a 304 with no body.
+ */
+async function fetchHeatmapTiles() {
+    if (!map || !map.hasLayer(heatmapLayer)) return;
+    const bounds = map.getBounds();
+    const params = new URLSearchParams({
+        bbox: [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()].join(',')
+    });
+    const level = heatmapLevelForZoom(map.getZoom());
+    if (level !== null) params.set('z', level);
+    try {
+        const headers = heatmapEtag ? { 'If-None-Match': heatmapEtag } : {};
+        const response = await fetch(`${BACKEND_URL}/admin/heatmap?${params}`, { headers });
+        if (response.status === 304) return;
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        heatmapEtag = response.headers.get('ETag');
+        heatmapInfo = { levels: data.levels, extent: data.extent };
+        updateHeatmap(data.cells.map(([lat, lon, intensity]) => ({ lat, lon, intensity })));
+    } catch (error) {
+        console.error('Failed to fetch heatmap tiles:', error);
+    }
+}
+
 
 /**
  * Public function to be called by marker popups to unblock an edge.
@@ -487,9 +693,11 @@ async function unblockEdge(edge_id) {
         if (response.ok && result.status === 'success') {
             alert('Edge unblocked successfully! Refreshing data.');
             map.closePopup(); 
-            fetchDashboardData(); 
-            fetchIncidentHistory(); 
-            fetchResolvedHistory();
+            if (!dashboardStream) { // The stream pushes the change itself
+                fetchDashboardData(); 
+                fetchIncidentHistory(); 
+                fetchResolvedHistory();
+            }
         } else {
             alert(`Failed to unblock edge: ${result.message}`);
         }
@@ -519,8 +727,10 @@ async function createIncident(location_name) {
 
         if (response.ok && result.status === 'success') {
             alert('Incident created successfully! Refreshing data.');
-            fetchDashboardData();
-            fetchIncidentHistory();
+            if (!dashboardStream) { // The stream pushes the change itself
+                fetchDashboardData();
+                fetchIncidentHistory();
+            }
         } else {
             alert(`Failed to create incident: ${result.message}`);
         }
@@ -1,22 +1,218 @@
+import math
 import os
 import sys
 import subprocess
 import time
-from flask import Flask, jsonify, request, send_from_directory
+APP_START_T = time.perf_counter() # Start of backend boot, for the startup timings
+from flask import Flask, Response, has_request_context, jsonify, request, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS 
 from geopy.geocoders import Nominatim 
 import threading # <-- BUGFIX: IMPORT THREADING
-import networkx as nx
-import traci
 import sumolib 
 import atexit
+import queue
 import logging 
-from collections import deque 
+from contextlib import contextmanager
+from spatial_index import EdgeSpatialIndex, IncidentIndex, NodeSpatialIndex
+from net_snapshot import load_or_build
+from cch import CustomizableCH, CCHCustomizer
+from geocoding import GeocodeCache, Gazetteer, normalize_place_name
+from route_cache import RouteCache
+from dashboard_stream import STREAM_CLOSED, DashboardBroadcaster
+from heatmap_tiles import HeatmapPyramid
+from timeseries import EventSeries, BUCKET_SECONDS
+from log_pipeline import LOG_LEVELS, LogPipeline, LogRing
+import wire_format
+from shared_state import SharedEngineState, SIGNAL_CODES, SIGNAL_STATES
+from engine_rpc import EngineRPCClient, EngineRPCError, EngineRPCServer
+from incident_store import IncidentStore
+import sim_backend
+from jam_detector import JamDetector, inverse_edge_id as get_inverse_edge_id
+from sim_scheduler import HIGH, LOW, RateLimiter, SimScheduler
+from whatif import StateSnapshots, WhatIfService, WorkerPool
+from trip_subscriptions import TripError, TripFollower, TripRegistry
+from metrics import Registry, TimedLock, SIZE_BUCKETS
+from profiler import SamplingProfiler
+import numpy as np
+
+# --- METRICS (served as Prometheus text on /metrics) ---
+metrics = Registry()
+SIM_STEP_SECONDS = metrics.histogram("pathsync_sim_step_seconds", "Wall time of one simulation step")
+HEARTBEAT_PHASE_SECONDS = metrics.histogram(
+    "pathsync_heartbeat_phase_seconds", "Wall time per engine loop task or phase", ["phase"])
+G_LOCK_WAIT_SECONDS = metrics.histogram("pathsync_g_lock_wait_seconds", "Time writers waited for g_lock")
+G_LOCK_HOLD_SECONDS = metrics.histogram("pathsync_g_lock_hold_seconds", "Time writers held g_lock")
+ROUTE_STAGE_SECONDS = metrics.histogram("pathsync_route_stage_seconds", "Time per /route stage", ["stage"])
+HTTP_REQUEST_SECONDS = metrics.histogram("pathsync_http_request_seconds", "Request handling time", ["endpoint"])
+HTTP_REQUESTS = metrics.counter("pathsync_http_requests_total", "Requests by endpoint and status", ["endpoint", "status"])
+JSON_ENCODE_SECONDS = metrics.histogram("pathsync_json_encode_seconds", "JSON response serialization time", ["endpoint"])
+JSON_RESPONSE_BYTES = metrics.histogram(
+    "pathsync_json_response_bytes", "JSON response body size", ["endpoint"], buckets=SIZE_BUCKETS)
+COMPRESS_SECONDS = metrics.histogram("pathsync_response_compress_seconds", "Response compression time", ["encoding"])
+COMPRESSED_RESPONSE_BYTES = metrics.histogram(
+    "pathsync_compressed_response_bytes", "Compressed response body size", ["endpoint"], buckets=SIZE_BUCKETS)
+TRIP_REROUTE_SECONDS = metrics.histogram(
+    "pathsync_trip_reroute_seconds", "Weight update to active-trip updates pushed, per re-route pass")
+TRIP_REROUTES_PER_UPDATE = metrics.histogram(
+    "pathsync_trip_reroutes_per_update", "Active trips switched to a new route per re-route pass",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 1000))
+profiler = SamplingProfiler() # Off until started via /admin/profiler
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify() that records serialization time and body size per endpoint."""
+    def response(self, *args, **kwargs):
+        start_t = time.perf_counter()
+        response = super().response(*args, **kwargs)
+        endpoint = (request.endpoint if has_request_context() else None) or "none"
+        JSON_ENCODE_SECONDS.observe(time.perf_counter() - start_t, endpoint=endpoint)
+        JSON_RESPONSE_BYTES.observe(response.content_length or 0, endpoint=endpoint)
+        return response
 
 # --- 1. CONFIGURE FLASK APP ---
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 CORS(app) 
+
+@app.before_request
+def start_request_timer():
+    request.environ["pathsync.start_t"] = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start_t = request.environ.get("pathsync.start_t")
+    endpoint = request.endpoint or "none"
+    if start_t is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start_t, endpoint=endpoint)
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip / brotli by Accept-Encoding for bodies of at least COMPRESS_MIN_BYTES (streams are left alone)."""
+    if (COMPRESS_MIN_BYTES <= 0 or response.direct_passthrough or response.is_streamed
+            or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in wire_format.COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = wire_format.choose_encoding(request.accept_encodings)
+    body = response.get_data()
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    start_t = time.perf_counter()
+    compressed = wire_format.compress(body, encoding)
+    COMPRESS_SECONDS.observe(time.perf_counter() - start_t, encoding=encoding)
+    COMPRESSED_RESPONSE_BYTES.observe(len(compressed), endpoint=request.endpoint or "none")
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True) # Same content, different bytes
+    return response
 geolocator = Nominatim(user_agent="pathsync-v3-router")
+# --- GEOCODING CACHE + OFFLINE GAZETTEER ---
+GEOCODE_CACHE_FILE = os.environ.get("PATHSYNC_GEOCODE_CACHE", "cache/geocode_cache.json")
+GAZETTEER_FILE = os.environ.get("PATHSYNC_GAZETTEER_FILE", "simulation/gazetteer.json")
+GEOCODE_TIMEOUT_S = float(os.environ.get("PATHSYNC_GEOCODE_TIMEOUT", "10"))
+gazetteer = Gazetteer()
+g_geocoder_calls = 0
+# --- ROUTE RESULT CACHE ---
+ROUTE_CACHE_SIZE = int(os.environ.get("PATHSYNC_ROUTE_CACHE_SIZE", "10000"))
+ROUTE_CACHE_STALENESS_S = float(os.environ.get("PATHSYNC_ROUTE_CACHE_STALENESS_S", "30"))
+route_cache = RouteCache(max_entries=ROUTE_CACHE_SIZE, staleness_s=ROUTE_CACHE_STALENESS_S)
+# --- BATCH / MATRIX LIMITS ---
+MAX_BATCH_PAIRS = int(os.environ.get("PATHSYNC_MAX_BATCH_PAIRS", "500"))
+MAX_MATRIX_SIDE = int(os.environ.get("PATHSYNC_MAX_MATRIX_SIDE", "200"))
+MAX_ALTERNATIVES = int(os.environ.get("PATHSYNC_MAX_ALTERNATIVES", "5"))
+# --- ACTIVE TRIPS (trip_subscriptions.py): re-routed on weight changes, pushed over SSE ---
+TRIP_MAX = int(os.environ.get("PATHSYNC_TRIP_MAX", "10000")) # Kept by the engine for all web workers
+TRIP_CHANGE_RATIO = float(os.environ.get("PATHSYNC_TRIP_CHANGE_RATIO", "0.05")) # Weight change that counts
+TRIP_MIN_GAIN = float(os.environ.get("PATHSYNC_TRIP_MIN_GAIN", "0.05")) # A new route must be this much faster
+TRIP_RECHECK_S = float(os.environ.get("PATHSYNC_TRIP_RECHECK_S", "120")) # Simulated seconds between full re-searches
+TRIP_IDLE_TTL_S = float(os.environ.get("PATHSYNC_TRIP_IDLE_TTL_S", "1800")) # Trips nobody streams or fetches expire
+TRIP_CCH_WAIT_S = 2.0 # Re-route searches wait this long for the CCH customization of the new weights
+TRIP_KEEPALIVE_S = 15
+# --- WIRE FORMAT (wire_format.py) ---
+COMPRESS_MIN_BYTES = int(os.environ.get("PATHSYNC_COMPRESS_MIN_BYTES", "1024")) # 0 turns compression off
+# --- ADMIN DASHBOARD PUSH STREAM (SSE) ---
+DASHBOARD_KEEPALIVE_S = 15
+dashboard_broadcaster = DashboardBroadcaster()
+# --- HEATMAP PYRAMID (levels 0..HEATMAP_LEVELS-1, 8x8 cells at level 0) ---
+HEATMAP_LEVELS = int(os.environ.get("PATHSYNC_HEATMAP_LEVELS", "6"))
+# --- INCIDENT / RESOLUTION HISTORY (ring buffers) ---
+HISTORY_CAPACITY = int(os.environ.get("PATHSYNC_HISTORY_CAPACITY", "100000"))
+HISTORY_CHART_BUCKET_S = 60 # Bucket size of the history charts sent to the dashboard
+# --- ADMIN LOG RING (log_pipeline.py) ---
+LOG_CAPACITY = int(os.environ.get("PATHSYNC_LOG_CAPACITY", "5000"))
+LOG_TAIL_LINES = 50 # Entries in /admin/get_logs without ?since= and in the dashboard snapshot
+# --- DURABLE INCIDENT LOG (SQLite WAL, replayed at startup by the engine) ---
+INCIDENT_STORE_FILE = os.environ.get("PATHSYNC_INCIDENT_DB", "cache/incidents.db")
+incident_store = None # IncidentStore, engine side only
+# --- HEARTBEAT + AUTO-INCIDENT DETECTOR ---
+HEARTBEAT_INTERVAL_S = max(float(os.environ.get("PATHSYNC_HEARTBEAT_S", "10")), 1.0) # Simulated seconds between sweeps
+JAM_HALT_THRESHOLD = int(os.environ.get("PATHSYNC_JAM_HALT_THRESHOLD", "5")) # Halting vehicles above this count as a jam...
+JAM_TIME_THRESHOLD_S = float(os.environ.get("PATHSYNC_JAM_TIME_S", "10")) # ...once they last this many simulated seconds
+# --- ENGINE LOOP SCHEDULE (sim_scheduler.py): cadences in simulated seconds ---
+SIGNAL_INTERVAL_S = float(os.environ.get("PATHSYNC_SIGNAL_S", "2"))
+SPEED_SYNC_INTERVAL_S = float(os.environ.get("PATHSYNC_SPEED_SYNC_S", "1")) # Incident speeds pushed to SUMO
+JAM_DETECT_INTERVAL_S = float(os.environ.get("PATHSYNC_JAM_DETECT_S", "2"))
+HEATMAP_INTERVAL_S = float(os.environ.get("PATHSYNC_HEATMAP_S", str(HEARTBEAT_INTERVAL_S)))
+TICK_BUDGET_S = float(os.environ.get("PATHSYNC_TICK_BUDGET_MS", "250")) / 1000 # Low-priority tasks yield past this
+TASK_BUDGET_MS = {"speed_sync": 50, "jam_detection": 100, "weight_sync": 200, "heatmap": 100, "signals": 50}
+SIM_ADVANCE_S = float(os.environ.get("PATHSYNC_SIM_ADVANCE_S", "0")) # >0: simulationStep(t + this), several steps per call
+SIM_SPEEDUP = float(os.environ.get("PATHSYNC_SIM_SPEEDUP", "0")) # Simulated seconds per wall second, 0 = unthrottled
+# --- WHAT-IF EVALUATION (whatif.py): worker SUMOs fed from the live state ---
+WHATIF_WORKERS = int(os.environ.get("PATHSYNC_WHATIF_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1))))) # 0 = off
+WHATIF_DIR = os.environ.get("PATHSYNC_WHATIF_DIR", "cache/whatif") # Saved states
+WHATIF_MAX_MINUTES = float(os.environ.get("PATHSYNC_WHATIF_MAX_MINUTES", "30"))
+WHATIF_MAX_SCENARIOS = int(os.environ.get("PATHSYNC_WHATIF_MAX_SCENARIOS", "8"))
+WHATIF_SAMPLE_S = 5.0 # Simulated seconds between a worker's edge readings
+WHATIF_NICE = 10 # Workers yield the CPU to the live loop
+whatif_snapshots = None # StateSnapshots, served by the live loop
+whatif_service = None # WhatIfService, engine side only
+# --- BINARY NET SNAPSHOT + STARTUP ---
+NET_CACHE_DIR = os.environ.get("PATHSYNC_NET_CACHE_DIR", "cache/net")
+REPORT_SNAP_RADIUS_M = 200 # /report snaps to the nearest routable road within this distance
+STARTUP_TIMINGS = {} # phase -> milliseconds
+sumo_ready = threading.Event() # Set once SUMO is running and subscriptions are in place
+g_sumo_error = None
+
+# --- PROCESS ROLE ---
+# standalone: one process runs SUMO/TraCI and serves HTTP (the default)
+# engine:     runs SUMO/TraCI and publishes live state to shared memory (see engine.py)
+# standin:    like engine, but publishes synthetic traffic instead of running SUMO
+# web:        serves HTTP from the engine's shared memory; run as many as needed
+ENGINE_ROLE = os.environ.get("PATHSYNC_ROLE", "standalone")
+if ENGINE_ROLE not in ("standalone", "engine", "standin", "web"):
+    sys.exit(f"Unknown PATHSYNC_ROLE '{ENGINE_ROLE}'")
+OWNS_ENGINE = ENGINE_ROLE in ("standalone", "engine", "standin")
+RUNS_SUMO = ENGINE_ROLE in ("standalone", "engine")
+# The engine owns the geocode cache file; web workers only load it and send their new answers to the engine
+geocode_cache = GeocodeCache(GEOCODE_CACHE_FILE, max_entries=5000, ttl_seconds=7 * 24 * 3600, persist=OWNS_ENGINE)
+ENGINE_SHM_NAME = os.environ.get("PATHSYNC_SHM_NAME", "pathsync_engine")
+ENGINE_RPC_ADDRESS = ("127.0.0.1", int(os.environ.get("PATHSYNC_ENGINE_PORT", "8765")))
+# The RPC channel unpickles what it receives, so split roles need a shared secret; there is no default key
+ENGINE_AUTHKEY = os.environ.get("PATHSYNC_ENGINE_AUTHKEY", "").encode()
+if ENGINE_ROLE in ("engine", "standin", "web") and len(ENGINE_AUTHKEY) < 16:
+    sys.exit(f"PATHSYNC_ROLE={ENGINE_ROLE} needs PATHSYNC_ENGINE_AUTHKEY set to the same secret (16+ characters) "
+             "in the engine and every web worker, e.g. from: python -c \"import secrets; print(secrets.token_hex(16))\"")
+# Simulation backend: "traci" (socket to a SUMO process) or "libsumo" (in process)
+SIM_BACKEND = os.environ.get("PATHSYNC_SIM_BACKEND", "traci")
+if SIM_BACKEND not in sim_backend.SIM_BACKENDS:
+    sys.exit(f"Unknown PATHSYNC_SIM_BACKEND '{SIM_BACKEND}'")
+TRACI_PORT = int(os.environ.get("PATHSYNC_TRACI_PORT", "0")) # 0 = any free port
+g_traci_port = None
+g_scheduler = None # SimScheduler of the TraCI loop, for /status
+ENGINE_FOLLOW_INTERVAL_S = 0.2 # How often web workers poll the shared-memory seqlock
+ENGINE_REATTACH_CHECK_S = 2.0 # Seq stalled this long: check whether a restarted engine replaced the segment
+shared_state = None # SharedEngineState: written by engine/standin, read by web
+engine_rpc = None # EngineRPCClient (web role only)
+
+@contextmanager
+def startup_phase(name):
+    start_t = time.perf_counter()
+    yield
+    STARTUP_TIMINGS[name] = round((time.perf_counter() - start_t) * 1000, 1)
 g_traci_latency_ms = 0.0
 
 # --- FIX: Prevent Flask Reloader from running twice ---
@@ -30,36 +226,38 @@ ADMIN_STATE = {
     "total_incidents_reported": 0 
 }
 # --- INCIDENT HISTORY ---
-INCIDENT_HISTORY = []
-history_lock = threading.Lock()
+INCIDENT_HISTORY = EventSeries(HISTORY_CAPACITY) # Ring buffer of timestamps, has its own lock
 # --- RESOLVED INCIDENT HISTORY ---
-RESOLVED_INCIDENT_HISTORY = []
-resolved_history_lock = threading.Lock()
+RESOLVED_INCIDENT_HISTORY = EventSeries(HISTORY_CAPACITY)
 # --- TRAFFIC LIGHT LOCATIONS ---
 g_traffic_light_locations = {}
 # -----------------------------
+# --- TRACI SWEEP STATS (last speed sync's round trips, total speed updates, heartbeat wall time) ---
+g_sweep_stats = {"round_trips": 0, "speed_updates": 0, "wall_ms": 0.0, "signal_wall_ms": 0.0, "subscribed_edges": 0}
+# -----------------------------
 
-# --- BUGFIX: ADD GLOBAL LOCK FOR GRAPH 'G' ---
-g_lock = threading.Lock()
+# --- WRITER LOCK FOR GRAPH 'G' ---
+# Only serializes writers that publish a new weight snapshot (heartbeat,
+# /report, /admin/unblock_edge). Readers use G.snapshot and never lock.
+g_lock = TimedLock(G_LOCK_WAIT_SECONDS, G_LOCK_HOLD_SECONDS)
+CRITICAL_COST = 999999
 # ---------------------------------------------
 
 
-# --- THREAD-SAFE LOGGING SETUP ---
-log_queue = deque(maxlen=50) 
-log_lock = threading.Lock()
-
-class AdminLogHandler(logging.Handler):
-    """A custom log handler that captures logs for the admin panel."""
-    def emit(self, record):
-        msg = self.format(record)
-        with log_lock:
-            log_queue.append(msg)
-
-# Create and configure the handler
-admin_handler = AdminLogHandler()
-admin_handler.setLevel(logging.INFO)
+# --- NON-BLOCKING LOGGING SETUP ---
+# Logging threads only enqueue the record; the pipeline's consumer thread
+# formats it into log_ring (seq-numbered entries, the admin log's cursor)
+# and pushes the lines to dashboard clients.
+log_ring = LogRing(LOG_CAPACITY)
 formatter = logging.Formatter('%(asctime)s - %(message)s', '%H:%M:%S')
-admin_handler.setFormatter(formatter)
+log_pipeline = LogPipeline(log_ring, formatter,
+                           on_entries=lambda entries: dashboard_broadcaster.add_logs([e["line"] for e in entries]))
+admin_handler = log_pipeline.handler(logging.INFO)
+# A web worker's admin log is the engine's: those entries keep the engine's
+# seq numbers, so a cursor means the same line on every worker. The worker's
+# own lines stay in log_ring, which numbers them separately.
+engine_log_ring = LogRing(LOG_CAPACITY) if ENGINE_ROLE == "web" else None
+admin_log_ring = engine_log_ring if engine_log_ring is not None else log_ring
 
 # Get the root logger (to capture logging.info)
 root_logger = logging.getLogger()
@@ -67,10 +265,15 @@ root_logger.setLevel(logging.INFO)
 # Remove all existing handlers to avoid duplicates
 for handler in root_logger.handlers[:]:
     root_logger.removeHandler(handler)
-root_logger.addHandler(admin_handler)
+root_logger.addHandler(admin_handler) # app.logger and its children propagate here
 
-# Also add to Flask's specific logger
-app.logger.addHandler(admin_handler)
+# Components shown in the admin log (?component=); everything else is "app"
+engine_log = app.logger.getChild("engine")
+incident_log = app.logger.getChild("incidents")
+cch_log = app.logger.getChild("cch")
+web_log = app.logger.getChild("web")
+whatif_log = app.logger.getChild("whatif")
+trip_log = app.logger.getChild("trips")
 # ----------------------------------------
 
 
@@ -78,12 +281,14 @@ app.logger.addHandler(admin_handler)
 if 'SUMO_HOME' in os.environ:
     tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
     sys.path.append(tools)
-else:
+elif RUNS_SUMO:
     sys.exit("please declare 'SUMO_HOME' as an environment variable")
+# Same TraCI API either way; only the engine roles ever start a simulation
+traci, tc = sim_backend.load(SIM_BACKEND if RUNS_SUMO else "traci")
 
 # --- 3. DEFINE SUMO COMMAND ---
 sumoBinary = "sumo" # <-- Kept as sumo-gui for debugging
-sumo_net_file = "simulation/map.net.xml" 
+sumo_net_file = os.environ.get("PATHSYNC_NET_FILE", "simulation/map.net.xml")
 sumoConfig = "simulation/map.sumocfg"
 
 sumoCmd = [
@@ -93,46 +298,501 @@ sumoCmd = [
     "--start",  # --- ADDED AUTO-START ---
     "--end", "3600" 
 ]
+# What-if workers: same scenario, no GUI settings or end time (they run past the live --end if asked)
+whatifCmd = [sumoBinary, "-c", sumoConfig, "--no-step-log", "--no-warnings"]
 
 # --- 6. LOAD/CREATE YOUR ROUTING GRAPH (FIXED "ISLAND" BUG) ---
-app.logger.info("Loading SUMO map into NetworkX graph...")
-
-net = sumolib.net.readNet(sumo_net_file)
-G = nx.MultiDiGraph() 
-edge_id_to_uv = {} # Lookup map for O(n) efficiency
-
-app.logger.info("Adding ALL nodes to graph...")
-for node in net.getNodes():
-    node_id = node.getID()
-    x, y = node.getCoord()
-    lon, lat = net.convertXY2LonLat(x, y)
-    G.add_node(node_id, x=x, y=y, lon=lon, lat=lat)
-app.logger.info(f"Added {len(G.nodes())} total nodes.")
-
-# --- 2. NOW, ADD ALL EDGES ---
-app.logger.info("Adding ALL edges to graph...")
-routable_edge_count = 0
-for edge in net.getEdges():
-    edge_id = edge.getID()
-    from_node = edge.getFromNode().getID()
-    to_node = edge.getToNode().getID()
-    
-    if from_node in G and to_node in G:
-        length = edge.getLength()
-        speed = edge.getSpeed()
-        original_travel_time = length / (speed + 0.001) # Store original
-        
-        G.add_edge(
-            from_node, to_node, key=edge_id, 
-            length=length, 
-            travel_time=original_travel_time,
-            original_travel_time=original_travel_time
+# The graph comes from a memory-mapped binary snapshot keyed by the net file's
+# hash; the net XML is only parsed (and the snapshot rewritten) when it changed.
+app.logger.info("Loading SUMO map into array-backed routing graph...")
+
+with startup_phase("graph_load"):
+    loaded_net = load_or_build(sumo_net_file, NET_CACHE_DIR, sumolib.net.readNet, app.logger)
+G = loaded_net.graph
+projection = loaded_net.projection # lon/lat <-> SUMO x/y, same as sumolib's net.convert*
+edge_id_to_idx = G.edge_id_to_idx # Lookup map: SUMO edge id -> array index
+app.logger.info(
+    f"Routing graph 'G' {'loaded from snapshot' if loaded_net.from_cache else 'built from net XML'} "
+    f"with {len(G)} nodes and {G.edge_count} routable edges in {STARTUP_TIMINGS['graph_load']:.0f} ms."
+)
+# --- END OF GRAPH LOADING FIX ---
+
+# --- OFFLINE GAZETTEER: street names from the net, plus an optional local file ---
+with startup_phase("gazetteer"):
+    for name, u, v in loaded_net.street_names:
+        gazetteer.add_street(name, (G.lat[u] + G.lat[v]) / 2, (G.lon[u] + G.lon[v]) / 2)
+    if os.path.exists(GAZETTEER_FILE):
+        try:
+            gazetteer.load_file(GAZETTEER_FILE)
+        except Exception as e:
+            app.logger.warning(f"Could not load gazetteer file {GAZETTEER_FILE}: {e}")
+app.logger.info(f"Gazetteer ready with {len(gazetteer)} place names.")
+
+# --- HEATMAP TILE PYRAMID (cell membership computed once) ---
+with startup_phase("heatmap_pyramid"):
+    heatmap = HeatmapPyramid(G.lat, G.lon, G.edge_from, G.edge_to, G.length, levels=HEATMAP_LEVELS)
+    HEAT_CELL_TABLE_KEY = wire_format.table_key(*heatmap.cell_table(heatmap.levels - 1)) # Static cell positions
+app.logger.info(f"Heatmap pyramid built: {heatmap.levels} levels, finest {heatmap.cells(heatmap.levels - 1)}x{heatmap.cells(heatmap.levels - 1)} cells.")
+
+# --- SPATIAL INDEX FOR SNAPPING COORDINATES TO NODES (built once) ---
+with startup_phase("spatial_index"):
+    node_index = NodeSpatialIndex(G.node_ids, G.x, G.y)
+app.logger.info(f"Spatial index built: {len(node_index)} nodes in a {node_index.nx}x{node_index.ny} grid.")
+
+# --- EDGE SHAPE INDEX FOR /report SNAPPING (routable edges only, from the net snapshot) ---
+with startup_phase("edge_index"):
+    edge_index = EdgeSpatialIndex(loaded_net.shapes["shape_start"], loaded_net.shapes["shape_xy"])
+app.logger.info(f"Edge index built: {len(edge_index)} shape segments in a {edge_index.nx}x{edge_index.ny} grid.")
+
+# --- ACTIVE INCIDENTS (updated by the writers, so listing never scans the graph) ---
+incident_index = IncidentIndex()
+
+# --- CUSTOMIZABLE CONTRACTION HIERARCHY (CCH) ---
+# The node ordering is computed once in the background; /route falls back
+# to plain A* until the first customization for the current weights is done.
+cch_customizer = None
+
+def snapshot_weights_for_cch():
+    snap = G.snapshot # Immutable, no lock needed
+    return snap.version, snap.travel_time
+
+def build_cch():
+    global cch_customizer
+    try:
+        cch_log.info("CCH: Computing node ordering from the SUMO net...")
+        with startup_phase("cch_order"):
+            cch = CustomizableCH(G)
+        cch_log.info(f"CCH: Ordering done in {cch.build_seconds:.1f}s ({cch.num_arcs} arcs, {cch.num_triangles} triangles).")
+        cch_customizer = CCHCustomizer(cch, snapshot_weights_for_cch, cch_log).start()
+    except Exception as e:
+        cch_log.error(f"CCH: Failed to build hierarchy, routing will use A* only: {e}")
+
+def weights_changed():
+    """Call after publishing a new weight snapshot."""
+    if cch_customizer is not None:
+        cch_customizer.request()
+    if trip_registry is not None:
+        trip_registry.request()
+
+def snapshot_info(snap):
+    return {"snapshot_version": snap.version, "sim_time": snap.sim_time}
+
+def index_incidents(snap, edges):
+    """Brings incident_index in line with `snap` for `edges`, the edges a writer just flagged or cleared."""
+    for e in edges:
+        e = int(e)
+        if not snap.is_incident[e]:
+            incident_index.discard(e)
+            continue
+        u = G.edge_from[e] # Get node data as a fallback
+        lat, lon = snap.incident_lat[e], snap.incident_lon[e]
+        incident_index.set(
+            e, G.edge_ids[e],
+            # --- FIX: Use specific incident lat/lon if it exists ---
+            float(G.lat[u] if np.isnan(lat) else lat),
+            float(G.lon[u] if np.isnan(lon) else lon)
         )
-        edge_id_to_uv[edge_id] = (from_node, to_node)
-        routable_edge_count += 1
+
+def incident_list(bbox=None):
+    """Active incidents as [{"edge_id", "lat", "lon"}] for the dashboard, optionally within a lon/lat bbox."""
+    return incident_index.list(bbox)
+
+threading.Thread(target=build_cch, daemon=True).start()
+
+# --- ACTIVE TRIPS: re-routed off the request path, after each weight change ---
+# The engine keeps them; web workers reach them over RPC and stream their events through trip_follower
+def record_trip_pass(stats):
+    TRIP_REROUTE_SECONDS.observe(stats["latency_ms"] / 1000)
+    TRIP_REROUTES_PER_UPDATE.observe(stats["rerouted"])
+    trips_changed()
+
+trip_registry = None if not OWNS_ENGINE else TripRegistry(
+    G,
+    search_fn=lambda source, target, snap: compute_route(source, target, snap),
+    ready_fn=lambda version: cch_customizer.wait(version, TRIP_CCH_WAIT_S) if cch_customizer is not None else None,
+    on_pass=record_trip_pass,
+    max_trips=TRIP_MAX,
+    change_ratio=TRIP_CHANGE_RATIO,
+    min_gain=TRIP_MIN_GAIN,
+    recheck_s=TRIP_RECHECK_S,
+    idle_ttl_s=TRIP_IDLE_TTL_S,
+    logger=trip_log
+).start()
+trip_follower = TripFollower() if ENGINE_ROLE == "web" else None
+
+
+# --- LIVE STATE WRITERS (engine side: standalone, engine and standin roles) ---
+def engine_counts():
+    return len(INCIDENT_HISTORY), len(RESOLVED_INCIDENT_HISTORY), len(log_ring), trip_registry.event_count
+
+def trips_changed():
+    """Call after trips got new events, so web workers fetch them now rather than on the next publish."""
+    if shared_state is not None:
+        shared_state.publish(counts=engine_counts())
+
+def publish_heartbeat(current_time, measured_time, auto_incidents):
+    """
+    Merges one sweep of measured travel times (NaN = no reading; None when
+    only incidents changed) and newly detected incidents into a new
+    snapshot, then updates the caches, the dashboard stream and shared
+    memory. Returns the snapshot.
+    """
+    # --- PUBLISH: g_lock only covers the array merge and the reference swap ---
+    with g_lock:
+        latest = G.snapshot # May include /report or unblock writes made during the sweep
+        is_incident = latest.is_incident.copy()
+        is_incident[auto_incidents] = True
+        travel_time = latest.travel_time.copy()
+        if measured_time is not None:
+            live = ~np.isnan(measured_time) & ~is_incident
+            travel_time[live] = measured_time[live]
+        travel_time[auto_incidents] = CRITICAL_COST
+        if auto_incidents:
+            route_cache.invalidate_edges(auto_incidents, G.next_version) # Before readers can see the new version
+        snap = G.publish(sim_time=current_time, travel_time=travel_time, is_incident=is_incident)
+        index_incidents(snap, auto_incidents)
+        if incident_store is not None:
+            for e in auto_incidents:
+                incident_store.record("auto", G.edge_ids[e], incident_type="Halting queue", source="detector")
+    # --- END OF g_lock ---
+    weights_changed()
+    dashboard_broadcaster.update_incidents(incident_list())
+    if shared_state is not None:
+        shared_state.publish(snap=snap, counts=engine_counts())
+    return snap
+
+def publish_heatmap(live_edges, intensity):
+    """Updates the heatmap pyramid with live/original travel-time ratios for `live_edges`."""
+    heatmap.update(live_edges, intensity)
+    dashboard_broadcaster.update_heatmap(heatmap.last_changed)
+    if shared_state is not None:
+        heat = np.full(G.edge_count, np.nan)
+        heat[live_edges] = intensity
+        shared_state.publish(heat=heat)
+
+def publish_signal_states(signal_states):
+    """Publishes [{"id", "lat", "lon", "state"}] from the signal sweep."""
+    ADMIN_STATE["traffic_light_states"] = signal_states
+    dashboard_broadcaster.update_signals(signal_states)
+    dashboard_broadcaster.add_latency(g_traci_latency_ms)
+    if shared_state is not None:
+        ids = [s["id"] for s in signal_states]
+        if ids != ADMIN_STATE.get("shared_signal_ids"):
+            # Ids and locations go to the static area only when the set changes
+            shared_state.update_static(signals=[[s["id"], s["lat"], s["lon"]] for s in signal_states])
+            ADMIN_STATE["shared_signal_ids"] = ids
+        codes = np.array([SIGNAL_CODES[s["state"]] for s in signal_states], dtype=np.uint8)
+        shared_state.publish(signal_codes=codes, traci_latency_ms=g_traci_latency_ms, counts=engine_counts())
+
+def apply_incident(edge_id, lat, lon, incident_type):
+    """Flags `edge_id` as an incident at the clicked lat/lon. Returns (snapshot, edges_blocked)."""
+    reported_at = time.time()
+    INCIDENT_HISTORY.append(reported_at)
+    dashboard_broadcaster.add_history("reported", reported_at)
+        
+    edges_blocked = 0
     
-app.logger.info(f"NetworkX graph 'G' created successfully with {routable_edge_count} routable edges.")
-# --- END OF GRAPH LOADING FIX ---
+    # --- WRITER LOCK: copy the current snapshot, modify, publish ---
+    with g_lock:
+        snap = G.snapshot
+        if edge_id in edge_id_to_idx:
+            e = edge_id_to_idx[edge_id]
+            travel_time = snap.travel_time.copy()
+            is_incident = snap.is_incident.copy()
+            incident_lat = snap.incident_lat.copy()
+            incident_lon = snap.incident_lon.copy()
+            travel_time[e] = CRITICAL_COST
+            is_incident[e] = True
+            
+            # --- FIX: Store the *exact* clicked lat/lon ---
+            incident_lat[e] = lat
+            incident_lon[e] = lon
+            # --- END FIX ---
+            
+            affected = [e]
+            inverse_edge_id = get_inverse_edge_id(edge_id)
+            if inverse_edge_id in edge_id_to_idx:
+                affected.append(edge_id_to_idx[inverse_edge_id])
+            route_cache.invalidate_edges(affected, G.next_version) # Before readers can see the new version
+            snap = G.publish(travel_time=travel_time, is_incident=is_incident,
+                             incident_lat=incident_lat, incident_lon=incident_lon)
+            index_incidents(snap, [e])
+            if incident_store is not None:
+                incident_store.record("reported", edge_id, lat, lon, incident_type, "report", ts=reported_at)
+            edges_blocked += 1
+            incident_log.info(f"INCIDENT (Manual): Flagged primary edge {edge_id}")
+    # --- END OF g_lock ---
+    if edges_blocked:
+        weights_changed()
+        dashboard_broadcaster.update_incidents(incident_list())
+    
+    incident_log.info(f"INCIDENT DETECTED: {incident_type} reported. {edges_blocked} edge(s) flagged.")
+    if shared_state is not None:
+        shared_state.publish(snap=snap, counts=engine_counts())
+    return snap, edges_blocked
+
+def clear_incident(edge_id):
+    """Clears the incident on `edge_id` and its inverse and restores their travel times. Returns the snapshot."""
+    # --- WRITER LOCK: copy the current snapshot, modify, publish ---
+    with g_lock:
+        snap = G.snapshot
+        e = edge_id_to_idx[edge_id]
+        resolved_at = None
+        if snap.is_incident[e]:
+            resolved_at = time.time()
+            RESOLVED_INCIDENT_HISTORY.append(resolved_at)
+            incident_log.info(f"--- ADMIN: Manually flagged edge {edge_id} for unblocking ---")
+        
+        edges_to_clear = [e]
+        inverse_edge_id = get_inverse_edge_id(edge_id)
+        if inverse_edge_id in edge_id_to_idx:
+            edges_to_clear.append(edge_id_to_idx[inverse_edge_id])
+        
+        if incident_store is not None:
+            for cleared in edges_to_clear:
+                if snap.is_incident[cleared]:
+                    kind = "resolved" if cleared == e else "cleared"
+                    incident_store.record(kind, G.edge_ids[cleared], source="admin", ts=resolved_at)
+        
+        # --- FIX: Clear all incident data from the edge (and its inverse) ---
+        is_incident = snap.is_incident.copy()
+        incident_lat = snap.incident_lat.copy()
+        incident_lon = snap.incident_lon.copy()
+        travel_time = snap.travel_time.copy()
+        is_incident[edges_to_clear] = False
+        incident_lat[edges_to_clear] = np.nan
+        incident_lon[edges_to_clear] = np.nan
+        travel_time[edges_to_clear] = G.original_travel_time[edges_to_clear]
+        # --- END FIX ---
+        
+        if snap.is_incident[edges_to_clear].any():
+            # Detours around the edge don't use it: drop them before readers can see it open
+            route_cache.invalidate_reopened(edges_to_clear, G.next_version)
+        snap = G.publish(travel_time=travel_time, is_incident=is_incident,
+                         incident_lat=incident_lat, incident_lon=incident_lon)
+        index_incidents(snap, edges_to_clear)
+    # --- END OF g_lock ---
+    weights_changed()
+    if resolved_at is not None:
+        dashboard_broadcaster.add_history("resolved", resolved_at)
+    dashboard_broadcaster.update_incidents(incident_list())
+    if shared_state is not None:
+        shared_state.publish(snap=snap, counts=engine_counts())
+    return snap
+
+def engine_tail(reported_from, resolved_from, logs_from):
+    """History entries and log entries a web worker has not seen yet."""
+    reported, next_reported, _ = INCIDENT_HISTORY.since(reported_from)
+    resolved, next_resolved, _ = RESOLVED_INCIDENT_HISTORY.since(resolved_from)
+    logs, next_log, _ = log_ring.since(logs_from)
+    return {
+        "reported": reported,
+        "resolved": resolved,
+        "logs": logs,
+        "next": [next_reported, next_resolved, next_log]
+    }
+
+def engine_report(edge_id, lat, lon, incident_type):
+    snap, edges_blocked = apply_incident(edge_id, lat, lon, incident_type)
+    return {"edges_blocked": edges_blocked, **snapshot_info(snap)}
+
+def engine_trip_register(source, target, geometry):
+    """Searches and registers a trip. {"trip": payload} or {"error": message}; raises TripError when full."""
+    snap = G.snapshot
+    route = compute_route(source, target, snap)
+    if route is None:
+        return {"error": "No valid path found."}
+    return {"trip": trip_registry.register(source, target, route, snap, geometry)}
+
+def engine_trip_get(trip_id):
+    return trip_registry.get(trip_id)
+
+def engine_trip_move(trip_id, source):
+    """Re-routes a trip from a new origin node. {"trip": payload} or {"error": message}."""
+    endpoints = trip_registry.endpoints(trip_id)
+    if endpoints is None:
+        return {"error": f"No active trip {trip_id}"}
+    snap = G.snapshot
+    route = compute_route(source, endpoints[1], snap)
+    if route is None:
+        return {"error": "No valid path found."}
+    trip = trip_registry.move(trip_id, source, route, snap)
+    if trip is None:
+        return {"error": f"No active trip {trip_id}"}
+    trips_changed()
+    return {"trip": trip}
+
+def engine_trip_remove(trip_id):
+    removed = trip_registry.remove(trip_id)
+    if removed:
+        trips_changed()
+    return removed
+
+def engine_trip_snapshot(trip_id):
+    return trip_registry.snapshot(trip_id)
+
+def engine_trip_events(cursors):
+    return trip_registry.events_since(cursors)
+
+def engine_whatif_submit(scenarios, minutes, top):
+    if whatif_service is None:
+        raise RuntimeError("What-if evaluation needs SUMO (standalone or engine role) and PATHSYNC_WHATIF_WORKERS > 0.")
+    return whatif_service.submit(scenarios, minutes, top)
+
+def engine_whatif_job(job_id):
+    return whatif_service.job(job_id) if whatif_service is not None else None
+
+def edge_midpoint(edge_id):
+    e = edge_id_to_idx[edge_id]
+    u, v = G.edge_from[e], G.edge_to[e]
+    return {"lat": float((G.lat[u] + G.lat[v]) / 2), "lon": float((G.lon[u] + G.lon[v]) / 2)}
+
+def engine_unblock(edge_id):
+    return snapshot_info(clear_incident(edge_id))
+
+def engine_geocode_put(key, value):
+    """A web worker's geocoder answer, so the engine (the only writer of the cache file) persists it."""
+    geocode_cache.put(key, tuple(value) if value else None)
+
+
+def replay_incidents():
+    """
+    Engine startup: re-applies the incidents that were active at the last
+    shutdown in one snapshot publish, and refills the dashboard histories.
+    """
+    active = [inc for inc in incident_store.active() if inc.edge_id in edge_id_to_idx]
+    INCIDENT_HISTORY.extend(incident_store.history("reported", HISTORY_CAPACITY))
+    RESOLVED_INCIDENT_HISTORY.extend(incident_store.history("resolved", HISTORY_CAPACITY))
+    if not active:
+        return 0
+    idx = np.array([edge_id_to_idx[inc.edge_id] for inc in active], dtype=np.int64)
+    with g_lock:
+        snap = G.snapshot
+        travel_time = snap.travel_time.copy()
+        is_incident = snap.is_incident.copy()
+        incident_lat = snap.incident_lat.copy()
+        incident_lon = snap.incident_lon.copy()
+        travel_time[idx] = CRITICAL_COST
+        is_incident[idx] = True
+        incident_lat[idx] = [np.nan if inc.lat is None else inc.lat for inc in active]
+        incident_lon[idx] = [np.nan if inc.lon is None else inc.lon for inc in active]
+        snap = G.publish(travel_time=travel_time, is_incident=is_incident,
+                         incident_lat=incident_lat, incident_lon=incident_lon)
+        index_incidents(snap, idx)
+    weights_changed()
+    dashboard_broadcaster.update_incidents(incident_list())
+    return len(active)
+
+
+# --- LIVE STATE FOLLOWER (web role): mirror the engine's shared memory into this process ---
+g_follow = {"seq": None, "version": None, "heat_seq": None, "reported": 0, "resolved": 0, "logs": 0}
+follow_lock = threading.Lock()
+
+def sync_from_engine():
+    """Applies whatever the engine published since the last call. Safe to call from request threads."""
+    global g_traci_latency_ms
+    with follow_lock:
+        view = shared_state.read(g_follow["seq"], g_follow["version"], g_follow["heat_seq"])
+        if view is None:
+            return
+        if view.travel_time is not None:
+            with g_lock:
+                previous = G.snapshot
+                blocked = np.flatnonzero(view.is_incident & ~previous.is_incident)
+                reopened = np.flatnonzero(previous.is_incident & ~view.is_incident)
+                # Before readers can see the new version
+                if len(blocked):
+                    route_cache.invalidate_edges(blocked.tolist(), view.version)
+                if len(reopened):
+                    route_cache.invalidate_reopened(reopened.tolist(), view.version)
+                snap = G.publish(version=view.version, sim_time=view.sim_time,
+                                 travel_time=view.travel_time, is_incident=view.is_incident,
+                                 incident_lat=view.incident_lat, incident_lon=view.incident_lon)
+                index_incidents(snap, np.concatenate((blocked, reopened)))
+            weights_changed()
+            dashboard_broadcaster.update_incidents(incident_list())
+            g_follow["version"] = view.version
+        static = shared_state.read_static()
+        if view.heat is not None:
+            # Same epoch and generations as the engine, so every worker tags the heatmap alike
+            heatmap.set_epoch(static.get("heat_epoch", heatmap.epoch))
+            live_edges = np.flatnonzero(~np.isnan(view.heat))
+            heatmap.update(live_edges, view.heat[live_edges], generation=view.heat_seq)
+            dashboard_broadcaster.update_heatmap(heatmap.last_changed)
+            g_follow["heat_seq"] = view.heat_seq
+
+        signals = static.get("signals", [])
+        signal_states = [
+            {"id": tl_id, "lat": lat, "lon": lon, "state": SIGNAL_STATES.get(int(code), "red")}
+            for (tl_id, lat, lon), code in zip(signals, view.signal_codes.tolist())
+        ]
+        ADMIN_STATE["traffic_light_states"] = signal_states
+        dashboard_broadcaster.update_signals(signal_states)
+        g_traci_latency_ms = view.traci_latency_ms
+        dashboard_broadcaster.add_latency(g_traci_latency_ms)
+
+        if (view.reported_count, view.resolved_count, view.log_count) != (g_follow["reported"], g_follow["resolved"], g_follow["logs"]):
+            tail = engine_rpc.call("tail", reported_from=g_follow["reported"],
+                                   resolved_from=g_follow["resolved"], logs_from=g_follow["logs"])
+            INCIDENT_HISTORY.extend(tail["reported"])
+            RESOLVED_INCIDENT_HISTORY.extend(tail["resolved"])
+            engine_log_ring.extend(tail["logs"]) # Keeps the engine's seq numbers, so cursors work on any worker
+            for ts in tail["reported"]:
+                dashboard_broadcaster.add_history("reported", ts)
+            for ts in tail["resolved"]:
+                dashboard_broadcaster.add_history("resolved", ts)
+            if tail["logs"]:
+                dashboard_broadcaster.add_logs([e["line"] for e in tail["logs"]])
+            g_follow["reported"], g_follow["resolved"], g_follow["logs"] = tail["next"]
+        trip_follower.poll(view.trip_event_count, lambda cursors: engine_rpc.call("trip_events", cursors=cursors))
+        g_follow["seq"] = view.seq
+        sumo_ready.set()
+
+def attach_engine(state):
+    """
+    Follows `state` (a newly attached engine segment) from scratch: the new
+    engine numbers its versions, history, logs and trip events from 0 again.
+    """
+    global shared_state
+    with follow_lock:
+        previous, shared_state = shared_state, state
+        if previous is None:
+            return
+        g_follow.update(seq=None, version=None, heat_seq=None, reported=0, resolved=0, logs=0)
+        INCIDENT_HISTORY.clear()
+        RESOLVED_INCIDENT_HISTORY.clear()
+        engine_log_ring.clear()
+        route_cache.clear()
+        heatmap.set_epoch()
+        trip_follower.reset("engine_restarted")
+        previous.close()
+
+def follow_engine():
+    web_log.info(f"Web worker: Waiting for engine shared memory '{ENGINE_SHM_NAME}'...")
+    while shared_state is None:
+        try:
+            attach_engine(SharedEngineState.attach(ENGINE_SHM_NAME))
+        except FileNotFoundError:
+            time.sleep(1)
+    web_log.info("Web worker: Attached to engine state.")
+    last_seq, moved_at = None, time.monotonic()
+    while True:
+        try:
+            sync_from_engine()
+        except Exception as e:
+            web_log.warning(f"Web worker: Could not sync from engine: {e}")
+            time.sleep(1)
+        try:
+            if shared_state.seq != last_seq:
+                last_seq, moved_at = shared_state.seq, time.monotonic()
+            elif time.monotonic() - moved_at > ENGINE_REATTACH_CHECK_S:
+                moved_at = time.monotonic()
+                if SharedEngineState.instance_of(ENGINE_SHM_NAME) not in (None, 0, shared_state.instance): # 0: still being created
+                    web_log.warning("Web worker: The engine restarted; attaching to its new state.")
+                    attach_engine(SharedEngineState.attach(ENGINE_SHM_NAME))
+        except Exception as e:
+            web_log.warning(f"Web worker: Could not check for an engine restart: {e}")
+        time.sleep(ENGINE_FOLLOW_INTERVAL_S)
 
 
 # --- 5. DEFINE "AI ENGINE" HEARTBEAT FUNCTION (FINAL - "DUAL AI") ---
@@ -143,32 +803,157 @@ def update_live_traffic():
     """
     global g_traci_latency_ms
     global g_traffic_light_locations
+    global g_sumo_error
+    global g_traci_port
+    global g_scheduler
     global sim_thread_started # <-- FIX
     sim_thread_started = True # <-- FIX
     
-    app.logger.info("AI Engine: Background thread started. Attempting to launch and connect...")
+    engine_log.info("AI Engine: Background thread started. Attempting to launch and connect...")
     
     try:
-        traci.start(sumoCmd, port=8813)
-        app.logger.info("AI Engine: SUMO started and Traci connected successfully.")
+        g_traci_port = sim_backend.start(traci, SIM_BACKEND, sumoCmd, TRACI_PORT)
+        engine_log.info(f"AI Engine: SUMO started and connected via {SIM_BACKEND}" + (f" on port {g_traci_port}." if g_traci_port else "."))
         
-        # --- AI INCIDENT DETECTOR STATE ---
-        jam_tracker = {} # Stores how long an edge has been "jammed"
-        JAM_HALT_THRESHOLD = 5 # 10 stopped cars
-        JAM_TIME_THRESHOLD = 10 # 30 seconds
+        # --- AI INCIDENT DETECTOR STATE (arrays aligned with G's edges) ---
+        jam_detector = JamDetector(G.edge_ids, edge_id_to_idx, JAM_HALT_THRESHOLD, JAM_TIME_THRESHOLD_S)
+        g_sweep_stats["detector"] = jam_detector.stats()
         
         # --- FIX: Moved location finding to *inside* the loop ---
         traffic_lights_initialized = False
 
+        # --- BATCHED READS: subscribe once, results arrive with every simulationStep ---
+        subscribed_edges = [eid for eid in traci.edge.getIDList() if eid in edge_id_to_idx]
+        for edge_id in subscribed_edges:
+            traci.edge.subscribe(edge_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER, tc.VAR_CURRENT_TRAVELTIME])
+        g_sweep_stats["subscribed_edges"] = len(subscribed_edges)
+        engine_log.info(f"AI Engine: Subscribed to {len(subscribed_edges)} edges.")
+        STARTUP_TIMINGS["sumo_ready"] = round((time.perf_counter() - APP_START_T) * 1000, 1)
+        sumo_ready.set()
+
+        # Incident state last pushed to SUMO via setMaxSpeed (SUMO starts with native speeds)
+        pushed_blocked = np.zeros(G.edge_count, dtype=bool)
+        current_time = traci.simulation.getTime()
+
     except Exception as e:
-        app.logger.error(f"AI Engine: Failed to launch/connect to Traci: {e}")
+        engine_log.error(f"AI Engine: Failed to launch/connect to Traci: {e}")
+        g_sumo_error = str(e)
         sim_thread_started = False # <-- FIX: Allow re-run
         return # <-- This stops the thread if Traci fails to start
 
+    # --- PERIODIC TASKS: each on its own simulated-time cadence (sim_scheduler.py) ---
+    edge_readings = {"time": None}
+
+    def read_edges(sim_time):
+        """(edge idx, halting, travel time) arrays from the bulk subscription, pulled once per step."""
+        if edge_readings["time"] != sim_time:
+            with HEARTBEAT_PHASE_SECONDS.time(phase="travel_time_pull"):
+                edge_results = traci.edge.getAllSubscriptionResults()
+                values = list(edge_results.values())
+                edge_readings.update(
+                    time=sim_time,
+                    idx=np.fromiter(map(edge_id_to_idx.__getitem__, edge_results), dtype=np.int64, count=len(values)),
+                    halting=np.fromiter((v[tc.LAST_STEP_VEHICLE_HALTING_NUMBER] for v in values), dtype=np.int64, count=len(values)),
+                    travel_time=np.fromiter((v[tc.VAR_CURRENT_TRAVELTIME] for v in values), dtype=np.float64, count=len(values))
+                )
+        return edge_readings["idx"], edge_readings["halting"], edge_readings["travel_time"]
+
+    def sync_speeds(sim_time, dt):
+        # Push setMaxSpeed only for edges whose incident state changed since the last push
+        snap = G.snapshot
+        round_trips = 0
+        for e in np.flatnonzero(snap.is_incident != pushed_blocked).tolist():
+            edge_id = G.edge_ids[e]
+            try:
+                traci.edge.setMaxSpeed(edge_id, 0.1 if snap.is_incident[e] else G.speed[e])
+                pushed_blocked[e] = snap.is_incident[e]
+            except traci.TraCIException:
+                pushed_blocked[e] = snap.is_incident[e] # Edge unknown to SUMO; don't retry
+            round_trips += 1
+        g_sweep_stats["round_trips"] = round_trips
+        g_sweep_stats["speed_updates"] += round_trips
+
+    def detect_jams(sim_time, dt):
+        # Run AI 2: AUTOMATIC INCIDENT DETECTOR, as whole-array operations
+        idx, halting, travel_time = read_edges(sim_time)
+        _, auto_incidents, fired = jam_detector.update(idx, halting, travel_time, G.snapshot.is_incident, dt)
+        for e in fired.tolist():
+            incident_log.info(f"--- AUTO-INCIDENT: Halting queue detected on edge {G.edge_ids[e]}! Applying CRITICAL_COST. ---")
+            if jam_detector.inverse[e] >= 0:
+                incident_log.info(f"--- AUTO-INCIDENT: Also applied CRITICAL_COST to inverse edge {G.edge_ids[jam_detector.inverse[e]]}. ---")
+        if len(auto_incidents):
+            publish_heartbeat(sim_time, None, auto_incidents.tolist())
+        g_sweep_stats["detector"] = jam_detector.stats()
+
+    def sync_weights(sim_time, dt):
+        # --- SNAPSHOT SWEEP: measured travel times go into the next weight snapshot ---
+        sweep_start_t = time.perf_counter()
+        idx, _, travel_time = read_edges(sim_time)
+        measured_time = np.full(G.edge_count, np.nan)
+        measured_time[idx] = travel_time
+        with HEARTBEAT_PHASE_SECONDS.time(phase="publish"):
+            publish_heartbeat(sim_time, measured_time, [])
+        g_sweep_stats["wall_ms"] = (time.perf_counter() - sweep_start_t) * 1000
+        engine_log.info(f"AI Engine: Heartbeat. Sim Time: {sim_time}s.")
+
+    def build_heatmap(sim_time, dt):
+        # Heatmap pyramid for the edges with a reading that are not blocked
+        idx, _, travel_time = read_edges(sim_time)
+        keep = ~G.snapshot.is_incident[idx]
+        live_edges = idx[keep]
+        publish_heatmap(live_edges, travel_time[keep] / (G.original_travel_time[live_edges] + 0.001))
+
+    def poll_signals(sim_time, dt):
+        signal_start_t = time.time()
+        tl_results = traci.trafficlight.getAllSubscriptionResults() # Local, no round trip
+        signal_states = []
+        for tl_id, (lat, lon) in g_traffic_light_locations.items():
+            try:
+                state_string = tl_results[tl_id][tc.TL_RED_YELLOW_GREEN_STATE]
+                
+                # --- START OF TRAFFIC LIGHT LOGIC FIX ---
+                # Get the state of the very first light in the string
+                first_light_state = state_string.lower()[0] 
+                
+                if first_light_state == 'g':
+                    simple_state = 'green'
+                elif first_light_state == 'y':
+                    simple_state = 'yellow'
+                else: # Covers 'r' (red) or other unknown states
+                    simple_state = 'red'
+                # --- END OF TRAFFIC LIGHT LOGIC FIX ---
+                    
+                signal_states.append({
+                    "id": tl_id,
+                    "lat": lat,
+                    "lon": lon,
+                    "state": simple_state
+                })
+            except Exception:
+                pass # Ignore if a signal disappears
+        g_sweep_stats["signal_wall_ms"] = (time.time() - signal_start_t) * 1000
+        publish_signal_states(signal_states)
+
+    scheduler = SimScheduler(TICK_BUDGET_S, on_run=lambda name, seconds: HEARTBEAT_PHASE_SECONDS.observe(seconds, phase=name))
+    for name, fn, cadence_s, priority in (
+        ("speed_sync", sync_speeds, SPEED_SYNC_INTERVAL_S, HIGH),
+        ("jam_detection", detect_jams, JAM_DETECT_INTERVAL_S, HIGH),
+        ("weight_sync", sync_weights, HEARTBEAT_INTERVAL_S, HIGH),
+        ("heatmap", build_heatmap, HEATMAP_INTERVAL_S, LOW),
+        ("signals", poll_signals, SIGNAL_INTERVAL_S, LOW)
+    ):
+        scheduler.add(name, fn, cadence_s, TASK_BUDGET_MS[name] / 1000, priority, start=current_time)
+    g_scheduler = scheduler
+    limiter = RateLimiter(SIM_SPEEDUP)
+
     # --- This is the main loop ---
     try:
         while True:
-            traci.simulationStep() # <-- This will now be called
+            with SIM_STEP_SECONDS.time():
+                if SIM_ADVANCE_S > 0:
+                    traci.simulationStep(current_time + SIM_ADVANCE_S) # Runs every step up to the target
+                else:
+                    traci.simulationStep()
             
             # --- LATENCY MEASUREMENT ---
             start_t = time.time()
@@ -183,163 +968,121 @@ def update_live_traffic():
             
             # --- FINAL FIX: One-time initialization for traffic light locations ---
             if not traffic_lights_initialized:
-                app.logger.info("Fetching all traffic light locations...")
+                engine_log.info("Fetching all traffic light locations...")
                 
                 # 1. Get all *known* junction IDs
                 all_junction_ids = set(traci.junction.getIDList())
                 
                 # 2. Get all traffic light IDs
                 all_traffic_light_ids = traci.trafficlight.getIDList()
-                app.logger.info(f"Found {len(all_traffic_light_ids)} total traffic lights in network file.")
+                engine_log.info(f"Found {len(all_traffic_light_ids)} total traffic lights in network file.")
                 
                 for tl_id in all_traffic_light_ids:
                     try:
                         # 3. Check if the traffic light ID is also a known junction ID
                         if tl_id in all_junction_ids:
                             x, y = traci.junction.getPosition(tl_id)
-                            lon, lat = net.convertXY2LonLat(x, y)
+                            lon, lat = projection.convertXY2LonLat(x, y)
                             g_traffic_light_locations[tl_id] = (lat, lon)
                         else:
                             # 4. If not, it's a complex light. Skip it.
-                            app.logger.warning(f"Traffic light '{tl_id}' is not a simple junction. Skipping.")
+                            engine_log.warning(f"Traffic light '{tl_id}' is not a simple junction. Skipping.")
                             
                     except Exception as e:
                         # 5. Catch any other Traci errors
-                        app.logger.warning(f"Error getting location for traffic light '{tl_id}': {e}. Skipping.")
+                        engine_log.warning(f"Error getting location for traffic light '{tl_id}': {e}. Skipping.")
                         
-                app.logger.info(f"Located {len(g_traffic_light_locations)} traffic lights.")
+                engine_log.info(f"Located {len(g_traffic_light_locations)} traffic lights.")
+                for tl_id in g_traffic_light_locations:
+                    traci.trafficlight.subscribe(tl_id, [tc.TL_RED_YELLOW_GREEN_STATE])
                 traffic_lights_initialized = True
             # --- END FIX ---
 
 
             if current_time > 3600:
-                app.logger.info(f"AI Engine: Simulation time {current_time}s > 3600s. Stopping simulation.")
+                engine_log.info(f"AI Engine: Simulation time {current_time}s > 3600s. Stopping simulation.")
                 break 
             
-            # --- Update traffic light states (every 2 seconds) ---
-            if int(current_time) % 2 == 0:
-                signal_states = []
-                for tl_id, (lat, lon) in g_traffic_light_locations.items():
-                    try:
-                        state_string = traci.trafficlight.getRedYellowGreenState(tl_id)
-                        
-                        # --- START OF TRAFFIC LIGHT LOGIC FIX ---
-                        # Get the state of the very first light in the string
-                        first_light_state = state_string.lower()[0] 
-                        
-                        if first_light_state == 'g':
-                            simple_state = 'green'
-                        elif first_light_state == 'y':
-                            simple_state = 'yellow'
-                        else: # Covers 'r' (red) or other unknown states
-                            simple_state = 'red'
-                        # --- END OF TRAFFIC LIGHT LOGIC FIX ---
-                            
-                        signal_states.append({
-                            "id": tl_id,
-                            "lat": lat,
-                            "lon": lon,
-                            "state": simple_state
-                        })
-                    except Exception:
-                        pass # Ignore if a signal disappears
-                ADMIN_STATE["traffic_light_states"] = signal_states
-            
-            
-            # --- AI & ROUTING LOGIC (Runs every 10s for speed) ---
-            if int(current_time) % 10 == 0:
-            
-                # --- BUGFIX: LOCK THE GRAPH 'G' FOR ALL READS/WRITES ---
-                with g_lock:
-                    # --- DIGITAL TWIN (Graph Weight Update) ---
-                    edge_heatmap_data = [] # For the heatmap
-
-                    all_sumo_edges = traci.edge.getIDList()
-                    for edge_id in all_sumo_edges:
-                        if edge_id in edge_id_to_uv:
-                            u, v = edge_id_to_uv[edge_id]
-
-                            # 1. Check if graph 'G' says this edge is an incident
-                            if G.edges[u, v, edge_id].get('is_incident') == True:
-                                traci.edge.setMaxSpeed(edge_id, 0.1)
-                            
-                            # 2. If 'G' says it's NOT an incident
-                            else:
-                                original_edge = net.getEdge(edge_id)
-                                traci.edge.setMaxSpeed(edge_id, original_edge.getSpeed())
-
-                                # 2b. Run AI 2: AUTOMATIC INCIDENT DETECTOR
-                                is_normal_edge = not edge_id.startswith(":") and "#" not in edge_id
-                                if is_normal_edge:
-                                    halting_cars = traci.edge.getLastStepHaltingNumber(edge_id)
-                                    
-                                    if halting_cars > JAM_HALT_THRESHOLD:
-                                        jam_tracker[edge_id] = jam_tracker.get(edge_id, 0) + 10 
-                                        if jam_tracker[edge_id] >= JAM_TIME_THRESHOLD:
-                                            app.logger.info(f"--- AUTO-INCIDENT: Halting queue detected on edge {edge_id}! Applying CRITICAL_COST. ---")
-                                            G[u][v][edge_id]['travel_time'] = 999999
-                                            G[u][v][edge_id]['is_incident'] = True
-                                            
-                                            # --- SAFE INVERSE EDGE BLOCK ---
-                                            inverse_edge_id = ""
-                                            if edge_id.startswith("-"):
-                                                inverse_edge_id = edge_id[1:]
-                                            else:
-                                                inverse_edge_id = "-" + edge_id
-                                            
-                                            if inverse_edge_id in edge_id_to_uv:
-                                                inv_u, inv_v = edge_id_to_uv[inverse_edge_id]
-                                                G[inv_u][inv_v][inverse_edge_id]['travel_time'] = 999999
-                                                G[inv_u][inv_v][inverse_edge_id]['is_incident'] = True
-                                                app.logger.info(f"--- AUTO-INCIDENT: Also applied CRITICAL_COST to inverse edge {inverse_edge_id}. ---")
-                                                
-                                    else:
-                                        jam_tracker[edge_id] = 0
-                                
-                                # 2c. Update travel time from SUMO
-                                if G.edges[u, v, edge_id].get('is_incident') != True:
-                                    current_travel_time = traci.edge.getTraveltime(edge_id)
-                                    G.edges[u, v, edge_id]['travel_time'] = current_travel_time
-
-                                    # Add data for heatmap
-                                    original_time = G.edges[u, v, edge_id]['original_travel_time']
-                                    intensity = current_travel_time / (original_time + 0.001)
-                                    node_data = G.nodes[u]
-                                    edge_heatmap_data.append({
-                                        "lat": node_data['lat'],
-                                        "lon": node_data['lon'],
-                                        "intensity": intensity
-                                    })
-
-                    ADMIN_STATE["edge_heatmap_data"] = edge_heatmap_data
-                # --- END OF g_lock ---
-                
-                app.logger.info(f"AI Engine: Heartbeat. Sim Time: {current_time}s.")
+            # --- SIGNALS, SPEED SYNC, JAM DETECTION, WEIGHTS, HEATMAP: whatever is due at this time ---
+            tick_start_t = time.perf_counter()
+            if scheduler.run_due(current_time):
+                HEARTBEAT_PHASE_SECONDS.observe(time.perf_counter() - tick_start_t, phase="total")
+            # --- WHAT-IF: save the state only when a job is waiting for one ---
+            if whatif_snapshots is not None and whatif_snapshots.serve(traci.simulation, current_time):
+                HEARTBEAT_PHASE_SECONDS.observe(whatif_snapshots.last_save_ms / 1000, phase="save_state")
+            limiter.wait(current_time)
 
     except traci.TraCIException as e:
-        app.logger.warning(f"AI Engine: Traci connection error (simulation likely ended): {e}")
+        engine_log.warning(f"AI Engine: Traci connection error (simulation likely ended): {e}")
     except Exception as e:
-        app.logger.error(f"AI Engine: An unexpected error occurred: {e}")
+        engine_log.error(f"AI Engine: An unexpected error occurred: {e}")
     finally:
-        app.logger.info("AI Engine: Background thread stopping. Closing Traci connection.")
+        engine_log.info("AI Engine: Background thread stopping. Closing Traci connection.")
         try:
             traci.close()
         except Exception:
             pass 
 
-    app.logger.info("AI Engine: Background thread stopped.")
+    engine_log.info("AI Engine: Background thread stopped.")
 
 
 # --- 7. START THE BACKGROUND THREAD ---
-app.logger.info("AI Engine: Starting background thread...")
-# --- FIX: Check flag before starting thread ---
-if not sim_thread_started:
-    ai_thread = threading.Thread(target=update_live_traffic, daemon=True)
-    ai_thread.start()
-else:
-    app.logger.info("AI Engine: Thread already started by reloader.")
-# --- END FIX ---
-time.sleep(3) # Give SUMO time to boot
+if OWNS_ENGINE:
+    # Incidents and unblocks survive restarts: replay the log before anything else writes
+    with startup_phase("incident_replay"):
+        incident_store = IncidentStore(INCIDENT_STORE_FILE, logger=incident_log)
+        replayed = replay_incidents()
+    incident_log.info(f"Incident store: Replayed {replayed} active incident(s) from {INCIDENT_STORE_FILE} in {STARTUP_TIMINGS['incident_replay']:.0f} ms.")
+
+if ENGINE_ROLE in ("engine", "standin"):
+    # Shared memory for web workers, plus the channel for their incident writes
+    shared_state = SharedEngineState.create(ENGINE_SHM_NAME, G.edge_count)
+    shared_state.update_static(heat_epoch=heatmap.epoch) # Workers number heatmap ETags in this run's epoch
+    shared_state.publish(snap=G.snapshot, counts=engine_counts())
+    EngineRPCServer(ENGINE_RPC_ADDRESS, ENGINE_AUTHKEY, {
+        "report": engine_report,
+        "unblock": engine_unblock,
+        "geocode_put": engine_geocode_put,
+        "tail": engine_tail,
+        "whatif_submit": engine_whatif_submit,
+        "whatif_job": engine_whatif_job,
+        "trip_register": engine_trip_register,
+        "trip_get": engine_trip_get,
+        "trip_move": engine_trip_move,
+        "trip_remove": engine_trip_remove,
+        "trip_snapshot": engine_trip_snapshot,
+        "trip_events": engine_trip_events
+    }, app.logger).start()
+    engine_log.info(f"AI Engine: Publishing live state to shared memory '{ENGINE_SHM_NAME}'.")
+elif ENGINE_ROLE == "web":
+    engine_rpc = EngineRPCClient(ENGINE_RPC_ADDRESS, ENGINE_AUTHKEY)
+    threading.Thread(target=follow_engine, daemon=True).start()
+
+if RUNS_SUMO and WHATIF_WORKERS > 0:
+    # Workers start on the first job; until then this costs nothing
+    whatif_snapshots = StateSnapshots(WHATIF_DIR)
+    whatif_service = WhatIfService(
+        WorkerPool(WHATIF_WORKERS, {"backend_name": SIM_BACKEND, "cmd": whatifCmd, "edge_ids": list(G.edge_ids),
+                                    "free_speed": G.speed.tolist()}, WHATIF_NICE, whatif_log),
+        whatif_snapshots,
+        live_blocked_fn=lambda: [G.edge_ids[e] for e in np.flatnonzero(G.snapshot.is_incident).tolist()],
+        edge_info_fn=edge_midpoint,
+        sample_s=WHATIF_SAMPLE_S,
+        logger=whatif_log
+    )
+
+if RUNS_SUMO:
+    engine_log.info("AI Engine: Starting background thread...")
+    # --- FIX: Check flag before starting thread ---
+    if not sim_thread_started:
+        ai_thread = threading.Thread(target=update_live_traffic, daemon=True)
+        ai_thread.start()
+    else:
+        engine_log.info("AI Engine: Thread already started by reloader.")
+    # --- END FIX ---
+# No fixed sleep: requests that need SUMO check sumo_ready, and /ready reports it
+STARTUP_TIMINGS["until_serving"] = round((time.perf_counter() - APP_START_T) * 1000, 1)
+app.logger.info(f"Startup timings (ms): {STARTUP_TIMINGS}")
 
 # --- ENSURE SUMO CLOSES ---
 @atexit.register
@@ -349,36 +1092,107 @@ def cleanup_sumo():
         traci.close()
     except Exception as e:
         app.logger.error(f"Error closing Traci: {e}")
+    if incident_store is not None:
+        incident_store.close() # Commits whatever is still queued
+    if whatif_service is not None:
+        whatif_service.pool.close()
+    if shared_state is not None:
+        shared_state.close() # Unlinks the segment in the engine, only detaches in workers
+    try:
+        geocode_cache.save()
+    except Exception as e:
+        app.logger.error(f"Error saving geocode cache: {e}")
 # -----------------------------------------------
 
-# Helper function to find the closest node ID
+# Helper function to find the closest node ID (uses the grid index, not a full scan)
 def find_closest_node(target_x, target_y):
-    min_dist = float('inf')
-    closest_node_id = None
-    if not G.nodes():
+    return node_index.nearest(target_x, target_y)
+
+# Helper function for endpoints that need several candidate nodes
+def find_closest_nodes(target_x, target_y, k=5):
+    return node_index.k_nearest(target_x, target_y, k)
+
+# Helper function: [lat, lon] -> (lat, lon) floats, or None unless both are finite and in range
+def coordinate_pair(item):
+    if len(item) != 2:
+        return None
+    try:
+        lat, lon = float(item[0]), float(item[1])
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
         return None
-    for node_id, node_data in G.nodes(data=True):
-        dist = (target_x - node_data['x'])**2 + (target_y - node_data['y'])**2
-        if dist < min_dist:
-            min_dist = dist
-            closest_node_id = node_id
-    return closest_node_id
+    return lat, lon
+
+# Helper function: geocode + snap a list of locations in one pass.
+# Each item may be a name, a "lat,lon" string or a [lat, lon] pair.
+# Returns a list of (lat, lon, node_idx) tuples, None where a point failed.
+def resolve_points(items):
+    geocoded = {}
+    points = []
+    for item in items:
+        if isinstance(item, (list, tuple)):
+            loc = coordinate_pair(item) # Malformed pairs fail like an unknown name
+        else:
+            key = str(item)
+            if key not in geocoded:
+                geocoded[key] = parse_or_geocode(key) # Repeated names are geocoded once
+            loc = geocoded[key]
+        if not loc:
+            points.append(None)
+            continue
+        x, y = projection.convertLonLat2XY(loc[1], loc[0])
+        node_id = find_closest_node(x, y)
+        points.append((loc[0], loc[1], G.node_id_to_idx[node_id]) if node_id else None)
+    return points
+
+# Helper function: one shortest-path query against a single weight snapshot
+def compute_route(source, target, snap):
+    metric = cch_customizer.current(snap.version) if cch_customizer else None
+    if metric is not None:
+        return cch_customizer.cch.shortest_path(source, target, metric)
+    # CCH not customized for this snapshot yet: plain A* on its weights
+    return G.shortest_path(source, target, snap.travel_time)
+
+# Helper function: up to k diverse routes, both search trees shared by all candidates
+def compute_alternatives(source, target, snap, k):
+    metric = cch_customizer.current(snap.version) if cch_customizer else None
+    if metric is not None:
+        return cch_customizer.cch.alternatives(source, target, metric, k)
+    return G.alternatives(source, target, k, snap.travel_time)
 
 # --- GLOBAL HELPER FUNCTION ---
 def parse_or_geocode(location_string):
+    global g_geocoder_calls
     if ',' in location_string and location_string.count('.') >= 2:
         try:
             lat, lon = map(float, location_string.split(','))
             return (lat, lon)
         except ValueError:
             pass  
+    # 1. Offline gazetteer (no network)
+    place = gazetteer.lookup(location_string)
+    if place:
+        return place
+    # 2. Persistent LRU/TTL cache (also remembers names the geocoder could not find)
+    cache_key = normalize_place_name(location_string)
+    found, cached = geocode_cache.contains(cache_key)
+    if found:
+        return cached
+    # 3. Network geocoder; only definite answers are cached, not errors/timeouts
     try:
-        location = geolocator.geocode(f"{location_string}, Mysuru, Karnataka", timeout=10)
-        if location:
-            return (location.latitude, location.longitude)
+        g_geocoder_calls += 1
+        location = geolocator.geocode(f"{location_string}, Mysuru, Karnataka", timeout=GEOCODE_TIMEOUT_S)
+        result = (location.latitude, location.longitude) if location else None
     except Exception:
-        return None 
-    return None
+        return None
+    geocode_cache.put(cache_key, result)
+    if engine_rpc is not None:
+        try:
+            engine_rpc.call("geocode_put", key=cache_key, value=result)
+        except EngineRPCError as e:
+            web_log.warning(f"Web worker: Could not hand geocode result to the engine: {e}")
+    return result
 
 # --- 8. DEFINE API ENDPOINTS ---
 @app.route('/')
@@ -391,40 +1205,306 @@ def get_route():
         data = request.get_json()
         start_name = data['start_name']
         end_name = data['end_name']
-        start_loc_data = parse_or_geocode(start_name)
-        end_loc_data = parse_or_geocode(end_name)
+        # Optional "geometry": "polyline" | "polyline6" sends encoded polylines instead of route_coords
+        geometry = data.get('geometry') or "coords"
+        if geometry not in wire_format.GEOMETRY_FORMATS:
+            return jsonify({"status": "error", "message": f"geometry must be one of {list(wire_format.GEOMETRY_FORMATS)}"}), 400
+        # Optional "alternatives": k asks for up to k diverse routes, fastest first
+        try:
+            k = int(data.get('alternatives') or 1)
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "alternatives must be an integer"}), 400
+        k = min(max(k, 1), MAX_ALTERNATIVES)
+        with ROUTE_STAGE_SECONDS.time(stage="geocode"):
+            start_loc_data = parse_or_geocode(start_name)
+            end_loc_data = parse_or_geocode(end_name)
         if not start_loc_data or not end_loc_data:
             return jsonify({"status": "error", "message": "Location not recognized or invalid map click."}), 404
         start_lat, start_lon = start_loc_data
         end_lat, end_lon = end_loc_data
-        start_x, start_y = net.convertLonLat2XY(start_lon, start_lat)
-        end_x, end_y = net.convertLonLat2XY(end_lon, end_lat)
-        start_node = find_closest_node(start_x, start_y)
-        end_node = find_closest_node(end_x, end_y)
+        with ROUTE_STAGE_SECONDS.time(stage="snap"):
+            start_x, start_y = projection.convertLonLat2XY(start_lon, start_lat)
+            end_x, end_y = projection.convertLonLat2XY(end_lon, end_lat)
+            start_node = find_closest_node(start_x, start_y)
+            end_node = find_closest_node(end_x, end_y)
         if not start_node or not end_node:
              return jsonify({"status": "error", "message": "Could not find a routable road near one of the locations."}), 404
         
-        # --- BUGFIX: LOCK THE GRAPH 'G' FOR READING ---
-        with g_lock:
-            route = nx.shortest_path(G, start_node, end_node, weight='travel_time')
-            total_travel_time_seconds = nx.path_weight(G, route, weight='travel_time')
-            total_distance_meters = nx.path_weight(G, route, weight='length')
-            route_coords = [[G.nodes[node]['lat'], G.nodes[node]['lon']] for node in route]
-        # --- END OF g_lock ---
-            
+        source, target = G.node_id_to_idx[start_node], G.node_id_to_idx[end_node]
+        key = (source, target) if k <= 1 else (source, target, k)
+        
+        # --- LOCK-FREE READ: route against one immutable weight snapshot ---
+        snap = G.snapshot
+        cached = route_cache.get(key, snap)
+        if cached is not None:
+            return jsonify({
+                "status": "success",
+                **wire_format.encode_route_geometry(cached.payload, geometry),
+                "snapshot_version": cached.version,
+                "sim_time": cached.sim_time,
+                "cached": True
+            }), 200
+
+        with ROUTE_STAGE_SECONDS.time(stage="search"):
+            if k <= 1:
+                route = compute_route(source, target, snap)
+                routes = [(route, 0.0)] if route is not None else []
+            else:
+                routes = compute_alternatives(source, target, snap, k)
+        if not routes:
+            return jsonify({"status": "error", "message": "No valid path found. (The roads may be disconnected or blocked by an incident)"}), 404
+        
+        route = routes[0][0]
+        payload = {
+            "route_coords": G.path_coords(route.nodes),
+            "total_time_seconds": route.travel_time,
+            "total_distance_meters": route.length
+        }
+        edges = route.edges
+        if k > 1:
+            payload["alternatives"] = [{
+                "route_coords": G.path_coords(alt.nodes),
+                "total_time_seconds": alt.travel_time,
+                "total_distance_meters": alt.length,
+                "overlap_ratio": round(overlap, 3)
+            } for alt, overlap in routes]
+            edges = list({e for alt, _ in routes for e in alt.edges})
+        route_cache.put(key, snap, edges, payload)
         return jsonify({
             "status": "success",
-            "route_coords": route_coords,
-            "total_time_seconds": total_travel_time_seconds,
-            "total_distance_meters": total_distance_meters
+            **wire_format.encode_route_geometry(payload, geometry),
+            **snapshot_info(snap),
+            "cached": False
         }), 200
-    except nx.NetworkXNoPath:
-        return jsonify({"status": "error", "message": "No valid path found. (The roads may be disconnected or blocked by an incident)"}), 404
     except Exception as e:
         app.logger.error(f"--- CRITICAL ERROR in /route --- \n{e}\n--- END ERROR ---")
         return jsonify({"status": "error", "message": "An error occurred on the server during routing."}), 500
 
 
+@app.route('/route/batch', methods=['POST'])
+def get_route_batch():
+    """
+    Many independent routes in one request: {"pairs": [{"start_name", "end_name"}, ...]}
+    and optionally "geometry" as in /route. All points are geocoded/snapped in
+    one pass and every route uses the same snapshot.
+    """
+    try:
+        data = request.get_json()
+        pairs = data.get('pairs', [])
+        geometry = data.get('geometry') or "coords"
+        if geometry not in wire_format.GEOMETRY_FORMATS:
+            return jsonify({"status": "error", "message": f"geometry must be one of {list(wire_format.GEOMETRY_FORMATS)}"}), 400
+        if len(pairs) > MAX_BATCH_PAIRS:
+            return jsonify({"status": "error", "message": f"At most {MAX_BATCH_PAIRS} pairs per batch."}), 400
+        points = resolve_points([p['start_name'] for p in pairs] + [p['end_name'] for p in pairs])
+        starts, ends = points[:len(pairs)], points[len(pairs):]
+        
+        snap = G.snapshot
+        metric = cch_customizer.current(snap.version) if cch_customizer else None
+        # Without the CCH, pairs sharing a start node share one Dijkstra tree
+        trees = {}
+        if metric is None:
+            by_source = {}
+            for start, end in zip(starts, ends):
+                if start and end:
+                    by_source.setdefault(start[2], set()).add(end[2])
+            trees = {src: G.one_to_many(src, dsts, snap.travel_time) for src, dsts in by_source.items()}
+        
+        results = []
+        for start, end in zip(starts, ends):
+            if not start or not end:
+                results.append({"status": "error", "message": "Location not recognized or not near a road."})
+                continue
+            key = (start[2], end[2])
+            cached = route_cache.get(key, snap)
+            if cached is not None:
+                results.append({"status": "success", **wire_format.encode_route_geometry(cached.payload, geometry), "cached": True})
+                continue
+            if metric is not None:
+                route = cch_customizer.cch.shortest_path(key[0], key[1], metric)
+            else:
+                route = trees[key[0]].get(key[1])
+            if route is None:
+                results.append({"status": "error", "message": "No valid path found."})
+                continue
+            payload = {
+                "route_coords": G.path_coords(route.nodes),
+                "total_time_seconds": route.travel_time,
+                "total_distance_meters": route.length
+            }
+            route_cache.put(key, snap, route.edges, payload)
+            results.append({"status": "success", **wire_format.encode_route_geometry(payload, geometry), "cached": False})
+        
+        return jsonify({"status": "success", "routes": results, **snapshot_info(snap)}), 200
+    except Exception as e:
+        app.logger.error(f"--- CRITICAL ERROR in /route/batch --- \n{e}\n--- END ERROR ---")
+        return jsonify({"status": "error", "message": "An error occurred on the server during batch routing."}), 500
+
+
+@app.route('/route/matrix', methods=['POST'])
+def get_route_matrix():
+    """
+    Travel-time / distance matrix: {"sources": [...], "targets": [...]}.
+    Uses the CCH many-to-many search when customized, else one Dijkstra per source.
+    Unreachable cells are null.
+    """
+    try:
+        data = request.get_json()
+        source_items, target_items = data.get('sources', []), data.get('targets', [])
+        if len(source_items) > MAX_MATRIX_SIDE or len(target_items) > MAX_MATRIX_SIDE:
+            return jsonify({"status": "error", "message": f"At most {MAX_MATRIX_SIDE} sources and targets."}), 400
+        points = resolve_points(list(source_items) + list(target_items))
+        sources, targets = points[:len(source_items)], points[len(source_items):]
+        src_idx = [i for i, p in enumerate(sources) if p]
+        dst_idx = [j for j, p in enumerate(targets) if p]
+        
+        snap = G.snapshot
+        metric = cch_customizer.current(snap.version) if cch_customizer else None
+        times = np.full((len(sources), len(targets)), np.inf)
+        lengths = np.full((len(sources), len(targets)), np.inf)
+        if src_idx and dst_idx:
+            src_nodes = [sources[i][2] for i in src_idx]
+            dst_nodes = [targets[j][2] for j in dst_idx]
+            if metric is not None:
+                sub_t, sub_l = cch_customizer.cch.many_to_many(src_nodes, dst_nodes, metric)
+                times[np.ix_(src_idx, dst_idx)] = sub_t
+                lengths[np.ix_(src_idx, dst_idx)] = sub_l
+            else:
+                for i, src in zip(src_idx, src_nodes):
+                    tree = G.one_to_many(src, dst_nodes, snap.travel_time)
+                    for j, dst in zip(dst_idx, dst_nodes):
+                        route = tree.get(dst)
+                        if route is not None:
+                            times[i, j], lengths[i, j] = route.travel_time, route.length
+        
+        def to_json(matrix):
+            return [[v if np.isfinite(v) else None for v in row] for row in matrix.tolist()]
+        
+        def describe(p):
+            return {"lat": p[0], "lon": p[1], "node_id": G.node_ids[p[2]]} if p else None
+        
+        return jsonify({
+            "status": "success",
+            "durations": to_json(times),
+            "distances": to_json(lengths),
+            "sources": [describe(p) for p in sources],
+            "targets": [describe(p) for p in targets],
+            "engine": "cch" if metric is not None else "dijkstra",
+            **snapshot_info(snap)
+        }), 200
+    except Exception as e:
+        app.logger.error(f"--- CRITICAL ERROR in /route/matrix --- \n{e}\n--- END ERROR ---")
+        return jsonify({"status": "error", "message": "An error occurred on the server while building the matrix."}), 500
+
+
+@app.route('/trips', methods=['POST'])
+def register_trip():
+    """
+    Registers an active trip: {"start_name", "end_name"} and optionally "geometry"
+    as in /route. Answers 201 with the trip and its first route; the server then
+    re-routes it when the weights change, pushed on GET /trips/<id>/stream.
+    Trips live in the engine, so any worker can serve any trip.
+    """
+    try:
+        data = request.get_json() or {}
+        geometry = data.get('geometry') or "coords"
+        if geometry not in wire_format.GEOMETRY_FORMATS:
+            return jsonify({"status": "error", "message": f"geometry must be one of {list(wire_format.GEOMETRY_FORMATS)}"}), 400
+        if 'start_name' not in data or 'end_name' not in data:
+            return jsonify({"status": "error", "message": "start_name and end_name are required."}), 400
+        start, end = resolve_points([data['start_name'], data['end_name']])
+        if not start or not end:
+            return jsonify({"status": "error", "message": "Location not recognized or not near a road."}), 404
+        if engine_rpc is not None:
+            result = engine_rpc.call("trip_register", source=start[2], target=end[2], geometry=geometry)
+        else:
+            result = engine_trip_register(start[2], end[2], geometry)
+        if "error" in result:
+            return jsonify({"status": "error", "message": result["error"]}), 404
+        return jsonify({"status": "success", "trip": result["trip"]}), 201
+    except (TripError, EngineRPCError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    except Exception as e:
+        app.logger.error(f"--- CRITICAL ERROR in /trips --- \n{e}\n--- END ERROR ---")
+        return jsonify({"status": "error", "message": "An error occurred on the server while registering the trip."}), 500
+
+@app.route('/trips/<trip_id>', methods=['GET', 'DELETE'])
+def trip_detail(trip_id):
+    try:
+        if request.method == 'DELETE':
+            removed = engine_rpc.call("trip_remove", trip_id=trip_id) if engine_rpc is not None else engine_trip_remove(trip_id)
+            if not removed:
+                return jsonify({"status": "error", "message": f"No active trip {trip_id}"}), 404
+            return jsonify({"status": "success"})
+        trip = engine_rpc.call("trip_get", trip_id=trip_id) if engine_rpc is not None else engine_trip_get(trip_id)
+    except EngineRPCError as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    if trip is None:
+        return jsonify({"status": "error", "message": f"No active trip {trip_id}"}), 404
+    return jsonify({"status": "success", "trip": trip})
+
+@app.route('/trips/<trip_id>/position', methods=['POST'])
+def move_trip(trip_id):
+    """The client moved: {"location": name, "lat,lon" or [lat, lon]}. Re-routes from there."""
+    data = request.get_json() or {}
+    if 'location' not in data:
+        return jsonify({"status": "error", "message": "location is required."}), 400
+    point = resolve_points([data['location']])[0]
+    if not point:
+        return jsonify({"status": "error", "message": "Location not recognized or not near a road."}), 404
+    try:
+        if engine_rpc is not None:
+            result = engine_rpc.call("trip_move", trip_id=trip_id, source=point[2])
+        else:
+            result = engine_trip_move(trip_id, point[2])
+    except EngineRPCError as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    if "error" in result:
+        return jsonify({"status": "error", "message": result["error"]}), 404
+    return jsonify({"status": "success", "trip": result["trip"]})
+
+@app.route('/trips/<trip_id>/stream')
+def trip_stream(trip_id):
+    """
+    Server-sent events for one trip: a "snapshot" with the current route, then
+    "route" (switched: reason blocked | faster | moved), "eta" (same route, new
+    travel time), "unreachable" (blocked with no way around) and "closed" (the trip
+    was removed or expired; the stream ends).
+    """
+    if engine_rpc is not None:
+        # Web worker: start from the engine's snapshot, then sync_from_engine feeds the queue
+        try:
+            snapshot = engine_rpc.call("trip_snapshot", trip_id=trip_id)
+        except EngineRPCError as e:
+            return jsonify({"status": "error", "message": str(e)}), 503
+        subscription = trip_follower.subscribe(trip_id, snapshot) if snapshot is not None else None
+        streams = trip_follower
+    else:
+        subscription = trip_registry.subscribe(trip_id)
+        streams = trip_registry
+    if subscription is None:
+        return jsonify({"status": "error", "message": f"No active trip {trip_id}"}), 404
+    client_queue, snapshot_frame = subscription
+
+    def generate():
+        try:
+            yield "retry: 3000\n" + snapshot_frame
+            while True:
+                try:
+                    frame = client_queue.get(timeout=TRIP_KEEPALIVE_S)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if frame is STREAM_CLOSED:
+                    return # Dropped as too slow, or the trip ended (after its "closed" event)
+                yield frame
+        finally:
+            streams.unsubscribe(trip_id, client_queue)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/report', methods=['POST'])
 def report_incident():
     data = request.get_json()
@@ -435,50 +1515,28 @@ def report_incident():
         if not loc_data:
             return jsonify({"status": "error", "message": "Location name or coordinate not recognized."}), 404
         lat, lon = loc_data # <-- This is the *exact* clicked location
-        incident_x, incident_y = net.convertLonLat2XY(lon, lat)
+        incident_x, incident_y = projection.convertLonLat2XY(lon, lat)
     except Exception as e:
         return jsonify({"status": "error", "message": f"Could not geocode/parse location: {e}"}), 500
     try:
-        nearest_edge_list = net.getNeighboringEdges(incident_x, incident_y, r=200) 
-        if not nearest_edge_list:
-             return jsonify({"status": "error", "message": "Report location is too far from any mapped road."}), 404
-        nearest_edge_list.sort(key=lambda x: x[1])
-        edge_to_block = None
-        for edge, dist in nearest_edge_list:
-            if edge.getID() in edge_id_to_uv:
-                edge_to_block = edge 
-                break 
-        if not edge_to_block:
-            return jsonify({"status": "error", "message": "Reported location is on a non-drivable road. Try clicking the middle of a main street."}), 404
-        
-        with history_lock:
-            INCIDENT_HISTORY.append(time.time())
-            
-        CRITICAL_COST = 999999 
-        edges_blocked = 0
-        edge_id = edge_to_block.getID()
+        # Only routable edges are indexed, so the nearest one is the one to block
+        nearest = edge_index.nearest(incident_x, incident_y, REPORT_SNAP_RADIUS_M)
+        if nearest is None:
+            return jsonify({"status": "error", "message": "Report location is too far from any drivable road. Try clicking the middle of a main street."}), 404
         
-        # --- BUGFIX: LOCK THE GRAPH 'G' FOR WRITING ---
-        with g_lock:
-            if edge_id in edge_id_to_uv:
-                u, v = edge_id_to_uv[edge_id]
-                G[u][v][edge_id]['travel_time'] = CRITICAL_COST
-                G[u][v][edge_id]['is_incident'] = True
-                
-                # --- FIX: Store the *exact* clicked lat/lon ---
-                G[u][v][edge_id]['incident_lat'] = lat
-                G[u][v][edge_id]['incident_lon'] = lon
-                # --- END FIX ---
-                
-                edges_blocked += 1
-                app.logger.info(f"INCIDENT (Manual): Flagged primary edge {edge_id}")
-        # --- END OF g_lock ---
-        
-        app.logger.info(f"INCIDENT DETECTED: {incident_type} reported. {edges_blocked} edge(s) flagged.")
+        edge_id = G.edge_ids[nearest[0]]
+        if engine_rpc is not None:
+            # Web worker: the engine owns the live state; pull its result right away
+            info = engine_rpc.call("report", edge_id=edge_id, lat=lat, lon=lon, incident_type=incident_type)
+            info.pop("edges_blocked")
+            sync_from_engine()
+        else:
+            info = snapshot_info(apply_incident(edge_id, lat, lon, incident_type)[0])
         
         return jsonify({
             "status": "success",
-            "message": f"{incident_type} reported successfully. Routes will now avoid this road."
+            "message": f"{incident_type} reported successfully. Routes will now avoid this road.",
+            **info
         }), 200
 
     except Exception as e:
@@ -492,32 +1550,77 @@ def report_incident():
 # --- ADMIN API ENDPOINTS ---
 # ==========================================================
 
+def signal_table(signal_states):
+    """Static columns (id, lat, lon) and key for the current signal list; rebuilt only when the list is replaced."""
+    cached = ADMIN_STATE.get("signal_table")
+    if cached is None or cached[0] is not signal_states:
+        table = {
+            "id": [s["id"] for s in signal_states],
+            "lat": [round(s["lat"], 6) for s in signal_states],
+            "lon": [round(s["lon"], 6) for s in signal_states]
+        }
+        key = wire_format.table_key(table["id"], table["lat"], table["lon"])
+        cached = ADMIN_STATE["signal_table"] = (signal_states, table, key)
+    return cached[1], cached[2]
+
+def columnar_dashboard_data(snap, incidents, signal_states, client_static_key):
+    """
+    /admin/dashboard_data as columns. Signal and heatmap cell positions are
+    static: they are sent only when the client's ?static= key is stale, and
+    the live columns refer to them by index.
+    """
+    signals, signal_key = signal_table(signal_states)
+    static_key = f"{HEAT_CELL_TABLE_KEY}-{signal_key}"
+    cell, intensity = heatmap.query_indexed(heatmap.levels - 1)
+    payload = {
+        "format": "columnar",
+        "static_key": static_key,
+        "stats": {"total_incidents_reported": len(INCIDENT_HISTORY)},
+        "incidents": wire_format.columns(incidents, ("edge_id", "lat", "lon")),
+        "heatmap": {"cell": cell.tolist(), "intensity": np.round(intensity, 3).tolist()},
+        # Signal states as SIGNAL_CODES, in static "signals" order
+        "signal_codes": [SIGNAL_CODES[s["state"]] for s in signal_states],
+        **snapshot_info(snap)
+    }
+    if client_static_key != static_key:
+        cell_lat, cell_lon = heatmap.cell_table(heatmap.levels - 1)
+        payload["static"] = {
+            "signals": signals,
+            "signal_states": [SIGNAL_STATES[code] for code in sorted(SIGNAL_STATES)],
+            "heatmap_cells": {"lat": np.round(cell_lat, 6).tolist(), "lon": np.round(cell_lon, 6).tolist()}
+        }
+    return payload
+
 @app.route('/admin/dashboard_data')
 def get_dashboard_data():
     """
     Provides all live data for the admin dashboard.
+      ?format=columnar             columns instead of one dict per row (see columnar_dashboard_data)
+      ?format=msgpack              the columnar payload as MessagePack (also via Accept: application/msgpack)
+      ?static=<static_key>         with either: skip the static tables the client already has
     """
-    # 1. Get all active incidents from the graph
-    incidents = []
-    try:
-        # --- BUGFIX: LOCK THE GRAPH 'G' FOR READING ---
-        with g_lock:
-            for u, v, key, data in G.edges(keys=True, data=True):
-                if data.get('is_incident') == True:
-                    node_data = G.nodes[u] # Get node data as a fallback
-                    incidents.append({
-                        "edge_id": key,
-                        # --- FIX: Use specific incident lat/lon if it exists ---
-                        "lat": data.get('incident_lat', node_data['lat']),
-                        "lon": data.get('incident_lon', node_data['lon'])
-                    })
-        # --- END OF g_lock ---
-            
-    except Exception as e:
-        app.logger.error(f"Error reading graph incidents: {e}")
+    # 1. Get all active incidents from the incident index (no graph scan)
+    snap = G.snapshot
+    incidents = incident_list()
 
-    # 2. Get heatmap data
-    heatmap_data = ADMIN_STATE.get("edge_heatmap_data", [])
+    fmt = request.args.get('format')
+    msgpack_wanted = wire_format.wants_msgpack(request.accept_mimetypes, fmt)
+    if fmt == "msgpack" and not msgpack_wanted:
+        return jsonify({"status": "error", "message": "format=msgpack needs the msgpack package on the server."}), 406
+    if msgpack_wanted or fmt == "columnar":
+        payload = columnar_dashboard_data(snap, incidents, ADMIN_STATE.get("traffic_light_states", []),
+                                          request.args.get('static'))
+        if not msgpack_wanted:
+            return jsonify(payload)
+        response = Response(wire_format.pack(payload), mimetype=wire_format.MSGPACK_MIMETYPE)
+        response.vary.add('Accept')
+        return response
+
+    # 2. Get heatmap data (finest pyramid level; /admin/heatmap serves per zoom + bbox)
+    heatmap_data = [
+        {"lat": lat, "lon": lon, "intensity": val}
+        for lat, lon, val in heatmap.query(heatmap.levels - 1)
+    ]
     
     # 3. Get traffic light data
     traffic_light_states = ADMIN_STATE.get("traffic_light_states", [])
@@ -528,86 +1631,305 @@ def get_dashboard_data():
         },
         "incidents": incidents,
         "edge_heatmap_data": heatmap_data,
-        "traffic_light_states": traffic_light_states
+        "traffic_light_states": traffic_light_states,
+        **snapshot_info(snap)
     })
 
+@app.route('/admin/incidents')
+def get_incidents():
+    """Active incidents, optionally only those in ?bbox=minLon,minLat,maxLon,maxLat."""
+    try:
+        bbox = request.args.get('bbox')
+        bbox = tuple(map(float, bbox.split(','))) if bbox else None
+        if bbox is not None and len(bbox) != 4:
+            raise ValueError("bbox needs 4 values")
+    except ValueError:
+        return jsonify({"status": "error", "message": "Use bbox=minLon,minLat,maxLon,maxLat"}), 400
+    incidents = incident_list(bbox)
+    return jsonify({"status": "success", "count": len(incidents), "incidents": incidents, **snapshot_info(G.snapshot)})
+
 @app.route('/admin/get_logs')
 def get_logs():
-    with log_lock:
-        logs = list(log_queue)
-    return jsonify({"logs": logs})
+    """
+    Admin log entries ({seq, ts, level, levelno, component, line}), oldest first.
+      ?since=<cursor>              only entries after a cursor from an earlier response
+      ?level=WARNING               this level and above
+      ?component=engine,cch        only these components
+      ?limit=<n>                   at most n entries (default: all after the cursor, else the newest 50)
+    Every response carries "cursor" for the next ?since= read.
+    """
+    try:
+        cursor = request.args.get('since', type=int)
+        if 'since' in request.args and cursor is None:
+            raise ValueError("since must be an integer")
+        level = request.args.get('level')
+        min_level = None
+        if level:
+            if level.upper() not in LOG_LEVELS:
+                raise ValueError(f"level must be one of {LOG_LEVELS}")
+            min_level = logging.getLevelName(level.upper())
+        component = request.args.get('component')
+        components = set(component.split(',')) if component else None
+        limit = request.args.get('limit', type=int) or (LOG_TAIL_LINES if cursor is None else None)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Use since=<cursor>, level=<name>, component=<a,b> and limit=<n>"}), 400
+    entries, next_cursor, truncated = admin_log_ring.since(cursor, min_level, components, limit)
+    return jsonify({"logs": entries, "cursor": next_cursor, "truncated": truncated})
+
+# Helper function: answers a history query against one EventSeries.
+#   ?since=<cursor>               events after a cursor from an earlier response
+#   ?start=<ts>&end=<ts>          raw timestamps in a time range
+#   ?bucket=minute|hour|<secs>    counts per bucket (optionally with start/end)
+# Every response carries "cursor" (the all-time count) for the next ?since= read.
+def history_response(series):
+    try:
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+        bucket = request.args.get('bucket')
+        if bucket:
+            bucket_s = BUCKET_SECONDS.get(bucket) or float(bucket)
+            if bucket_s <= 0:
+                raise ValueError("bucket must be positive")
+            return jsonify({**series.buckets(bucket_s, start, end), "cursor": len(series)})
+        if 'since' in request.args:
+            history, cursor, truncated = series.since(int(request.args['since']))
+            return jsonify({"history": history, "cursor": cursor, "truncated": truncated})
+        return jsonify({"history": series.range(start, end), "cursor": len(series)})
+    except ValueError:
+        return jsonify({"status": "error", "message": "Use since=<cursor>, start/end=<unix seconds> or bucket=minute|hour|<seconds>"}), 400
 
 @app.route('/admin/incident_history')
 def get_incident_history():
-    with history_lock:
-        history = list(INCIDENT_HISTORY)
-    return jsonify({"history": history})
+    return history_response(INCIDENT_HISTORY)
 
 @app.route('/admin/resolved_history')
 def get_resolved_history():
-    with resolved_history_lock:
-        history = list(RESOLVED_INCIDENT_HISTORY)
-    return jsonify({"history": history})
+    return history_response(RESOLVED_INCIDENT_HISTORY)
+
+
+@app.route('/admin/heatmap')
+def get_heatmap():
+    """
+    Congestion heatmap cells for one pyramid level: ?z=<level>&bbox=minLon,minLat,maxLon,maxLat.
+    Answers 304 when If-None-Match matches, i.e. no visible cell changed.
+    """
+    try:
+        z = min(max(int(request.args.get('z', heatmap.levels - 1)), 0), heatmap.levels - 1)
+        bbox = request.args.get('bbox')
+        bbox = tuple(map(float, bbox.split(','))) if bbox else None
+        if bbox is not None and len(bbox) != 4:
+            raise ValueError("bbox needs 4 values")
+    except ValueError:
+        return jsonify({"status": "error", "message": "Use z=<level>&bbox=minLon,minLat,maxLon,maxLat"}), 400
+
+    etag = heatmap.etag(z, bbox)
+    if request.if_none_match.contains_weak(etag): # Weak once compressed
+        response = Response(status=304)
+    else:
+        cell_lat, cell_lon = heatmap.cell_size(z)
+        response = jsonify({
+            "status": "success",
+            "zoom": z,
+            "levels": heatmap.levels,
+            "extent": heatmap.extent(),
+            "cell_size_deg": [cell_lat, cell_lon],
+            "cells": heatmap.query(z, bbox) # [[lat, lon, intensity], ...]
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag'
+    return response
+
+
+@app.route('/admin/stream')
+def admin_stream():
+    """
+    Server-sent events for the admin dashboard: one full "snapshot" event,
+    then only deltas (signals, heatmap, incidents, history, log, latency).
+    """
+    def extra_state():
+        logs, cursor, _ = admin_log_ring.since(limit=LOG_TAIL_LINES)
+        return {
+            "logs": [e["line"] for e in logs],
+            "log_cursor": cursor,
+            "incident_history": INCIDENT_HISTORY.buckets(HISTORY_CHART_BUCKET_S),
+            "resolved_history": RESOLVED_INCIDENT_HISTORY.buckets(HISTORY_CHART_BUCKET_S)
+        }
+
+    client_queue, snapshot_frame = dashboard_broadcaster.subscribe(extra_state)
+
+    def generate():
+        try:
+            yield "retry: 3000\n" + snapshot_frame
+            while True:
+                try:
+                    frame = client_queue.get(timeout=DASHBOARD_KEEPALIVE_S)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if frame is STREAM_CLOSED:
+                    return # Dropped as too slow: closing makes EventSource reconnect
+                yield frame
+        finally:
+            dashboard_broadcaster.unsubscribe(client_queue)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/admin/unblock_edge', methods=['POST'])
 def unblock_edge():
     data = request.get_json()
     edge_id = data.get('edge_id')
-    if not edge_id or edge_id not in edge_id_to_uv:
+    if not edge_id or edge_id not in edge_id_to_idx:
         return jsonify({"status": "error", "message": "Invalid edge_id"}), 404
     try:
-        # --- BUGFIX: LOCK THE GRAPH 'G' FOR WRITING ---
-        with g_lock:
-            u, v = edge_id_to_uv[edge_id]
-            if G.edges[u, v, edge_id].get('is_incident') == True:
-                with resolved_history_lock:
-                    RESOLVED_INCIDENT_HISTORY.append(time.time())
-                app.logger.info(f"--- ADMIN: Manually flagged edge {edge_id} for unblocking ---")
-            
-            # --- FIX: Clear all incident data from the edge ---
-            G.edges[u, v, edge_id]['is_incident'] = False
-            G.edges[u, v, edge_id].pop('incident_lat', None)
-            G.edges[u, v, edge_id].pop('incident_lon', None)
-            # --- END FIX ---
-            
-            edge = net.getEdge(edge_id)
-            travel_time = edge.getLength() / (edge.getSpeed() + 0.001)
-            G.edges[u, v, edge_id]['travel_time'] = travel_time
-            
-            inverse_edge_id = ""
-            if edge_id.startswith("-"):
-                inverse_edge_id = edge_id[1:]
-            else:
-                inverse_edge_id = "-" + edge_id
-            
-            if inverse_edge_id in edge_id_to_uv:
-                inv_u, inv_v = edge_id_to_uv[inverse_edge_id]
-                
-                # --- FIX: Clear all incident data from inverse edge ---
-                G.edges[inv_u, inv_v, inverse_edge_id]['is_incident'] = False
-                G.edges[inv_u, inv_v, inverse_edge_id].pop('incident_lat', None)
-                G.edges[inv_u, inv_v, inverse_edge_id].pop('incident_lon', None)
-                # --- END FIX ---
-
-                inv_edge = net.getEdge(inverse_edge_id)
-                inv_travel_time = inv_edge.getLength() / (inv_edge.getSpeed() + 0.001)
-                G.edges[inv_u, inv_v, inverse_edge_id]['travel_time'] = inv_travel_time
-        # --- END OF g_lock ---
+        if engine_rpc is not None:
+            info = engine_rpc.call("unblock", edge_id=edge_id)
+            sync_from_engine()
+        else:
+            info = snapshot_info(clear_incident(edge_id))
         
-        return jsonify({"status": "success", "message": f"Edge {edge_id} flagged for unblocking."})
+        return jsonify({"status": "success", "message": f"Edge {edge_id} flagged for unblocking.", **info})
     except Exception as e:
         app.logger.error(f"Error unblocking edge: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/admin/whatif', methods=['POST'])
+def submit_whatif():
+    """
+    Starts a what-if job: {"scenarios": [{"name", "close": [edge ids], "reopen": [edge ids]}, ...],
+    "minutes": N, "top": K}. Answers 202 with the job; poll GET /admin/whatif/<id> for the results.
+    """
+    data = request.get_json() or {}
+    scenarios = data.get('scenarios') or []
+    try:
+        minutes = float(data.get('minutes', 10))
+        top = int(data.get('top', 10))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "minutes and top must be numbers"}), 400
+    if not 0 < minutes <= WHATIF_MAX_MINUTES:
+        return jsonify({"status": "error", "message": f"minutes must be in (0, {WHATIF_MAX_MINUTES:g}]"}), 400
+    if not 1 <= len(scenarios) <= WHATIF_MAX_SCENARIOS:
+        return jsonify({"status": "error", "message": f"Send 1 to {WHATIF_MAX_SCENARIOS} scenarios"}), 400
+    cleaned = []
+    for i, scenario in enumerate(scenarios):
+        close, reopen = list(scenario.get('close') or []), list(scenario.get('reopen') or [])
+        unknown = [e for e in close + reopen if e not in edge_id_to_idx]
+        if unknown:
+            return jsonify({"status": "error", "message": f"Unknown edge_id(s): {unknown[:5]}"}), 404
+        cleaned.append({"name": str(scenario.get('name') or f"scenario {i + 1}"), "close": close, "reopen": reopen})
+    try:
+        if engine_rpc is not None:
+            job = engine_rpc.call("whatif_submit", scenarios=cleaned, minutes=minutes, top=top)
+        else:
+            job = engine_whatif_submit(cleaned, minutes, top)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    return jsonify({"status": "success", "job": job}), 202
+
+@app.route('/admin/whatif/<job_id>')
+def get_whatif(job_id):
+    try:
+        job = engine_rpc.call("whatif_job", job_id=job_id) if engine_rpc is not None else engine_whatif_job(job_id)
+    except EngineRPCError as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    if job is None:
+        return jsonify({"status": "error", "message": f"No what-if job {job_id}"}), 404
+    return jsonify({"status": "success", "job": job})
+
+@app.route('/ready')
+def get_ready():
+    """Readiness probe: 200 once the graph is loaded and SUMO is connected, else 503."""
+    components = {
+        "graph": True, # Loaded before the app serves anything
+        "sumo": sumo_ready.is_set(),
+        "cch": cch_customizer is not None and cch_customizer.metric is not None
+    }
+    ready = components["graph"] and components["sumo"]
+    return jsonify({
+        "status": "ready" if ready else "starting",
+        "components": components,
+        "sumo_error": g_sumo_error,
+        "startup_ms": STARTUP_TIMINGS
+    }), 200 if ready else 503
+
 @app.route('/status')
 def get_status():
     global g_traci_latency_ms
     return jsonify({
         "status": "success",
-        "traci_latency_ms": g_traci_latency_ms
+        "traci_latency_ms": g_traci_latency_ms,
+        "cch_ready": cch_customizer is not None and cch_customizer.current(G.snapshot.version) is not None,
+        "cch_customize_ms": cch_customizer.last_customize_ms if cch_customizer else None,
+        "sweep": g_sweep_stats,
+        "scheduler": g_scheduler.stats() if g_scheduler else None,
+        "whatif": whatif_service.stats() if whatif_service else None,
+        "sim_backend": {"name": SIM_BACKEND, "port": g_traci_port},
+        "route_cache": route_cache.stats(),
+        "trips": trip_registry.stats() if trip_registry is not None else trip_follower.stats(),
+        "geocode": {
+            "cache": geocode_cache.stats(),
+            "gazetteer": gazetteer.stats(),
+            "geocoder_calls": g_geocoder_calls
+        },
+        "dashboard_stream": dashboard_broadcaster.stats(),
+        "history": {"reported": INCIDENT_HISTORY.stats(), "resolved": RESOLVED_INCIDENT_HISTORY.stats()},
+        "logs": {**log_ring.stats(), "backlog": log_pipeline.backlog(),
+                 "engine": engine_log_ring.stats() if engine_log_ring is not None else None},
+        "incident_store": incident_store.stats() if incident_store else None,
+        "startup_ms": STARTUP_TIMINGS,
+        "net_snapshot": {"hash": loaded_net.net_hash, "from_cache": loaded_net.from_cache},
+        "role": ENGINE_ROLE,
+        "pid": os.getpid(),
+        **snapshot_info(G.snapshot)
     }), 200
 
+# --- METRICS ENDPOINT (per process; scrape every worker in the web role) ---
+metrics.gauge("pathsync_snapshot_version", "Version of the published weight snapshot", lambda: G.snapshot.version)
+metrics.gauge("pathsync_sim_time_seconds", "Simulation time of the published snapshot", lambda: G.snapshot.sim_time or 0)
+metrics.gauge("pathsync_active_incidents", "Edges currently flagged as incidents", lambda: len(incident_index))
+metrics.gauge("pathsync_traci_latency_ms", "EWMA of the TraCI getTime() round trip", lambda: g_traci_latency_ms)
+metrics.gauge("pathsync_route_cache_entries", "Cached routes", lambda: len(route_cache))
+metrics.counter_func("pathsync_route_cache_hits_total", "Route cache hits", lambda: route_cache.hits)
+metrics.counter_func("pathsync_route_cache_misses_total", "Route cache misses", lambda: route_cache.misses)
+if trip_registry is not None:
+    metrics.gauge("pathsync_active_trips", "Registered active trips", lambda: len(trip_registry))
+    metrics.counter_func("pathsync_trip_reroutes_total", "Active trips switched to a new route", lambda: trip_registry.reroutes)
+    metrics.counter_func("pathsync_trip_searches_total", "Re-route searches for active trips", lambda: trip_registry.searches)
+else:
+    metrics.gauge("pathsync_trip_stream_clients", "Connected /trips/<id>/stream clients", lambda: trip_follower.stats()["streaming"])
+metrics.counter_func("pathsync_geocoder_calls_total", "Calls to the network geocoder", lambda: g_geocoder_calls)
+metrics.gauge("pathsync_dashboard_stream_clients", "Connected /admin/stream clients", lambda: dashboard_broadcaster.stats()["clients"])
+metrics.counter_func("pathsync_incidents_reported_total", "Incidents reported", lambda: len(INCIDENT_HISTORY))
+metrics.counter_func("pathsync_incidents_resolved_total", "Incidents resolved", lambda: len(RESOLVED_INCIDENT_HISTORY))
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def admin_profiler():
+    """
+    Sampling profiler. POST {"enabled": true, "interval_ms": 5} starts it (clearing old
+    samples), {"enabled": false} stops it. GET returns the top functions, or the
+    stacks in collapsed flame-graph format with ?format=folded.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get("enabled"):
+            interval_ms = float(data.get("interval_ms", 5))
+            if not 1 <= interval_ms <= 1000:
+                return jsonify({"status": "error", "message": "interval_ms must be between 1 and 1000"}), 400
+            profiler.start(interval_ms / 1000)
+            app.logger.info(f"--- ADMIN: Sampling profiler started ({interval_ms:g} ms interval) ---")
+        else:
+            profiler.stop()
+            app.logger.info("--- ADMIN: Sampling profiler stopped ---")
+    if request.args.get('format') == 'folded':
+        return Response(profiler.folded(), mimetype="text/plain")
+    return jsonify({"status": "success", **profiler.top(request.args.get('limit', 20, type=int))})
+
 # ==========================================================
 # --- ROUTES TO SERVE THE ADMIN WEB PAGE ---
 # ==========================================================
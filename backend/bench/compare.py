@@ -0,0 +1,49 @@
+"""
+compare.py
+Side-by-side view of two run_bench.py result files.
+
+    python bench/compare.py bench/results/<before>.json bench/results/<after>.json
+"""
+import json
+import sys
+
+
+def change(before, after):
+    if not before:
+        return ""
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def rows(results):
+    """(name, summary) pairs: endpoints, then sweep and g_lock."""
+    yield from results["endpoints"].items()
+    yield "heartbeat sweep", results["sweep"]
+    yield "g_lock wait", results["g_lock"]["wait"]
+    yield "g_lock hold", results["g_lock"]["hold"]
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit("usage: compare.py BEFORE.json AFTER.json")
+    with open(sys.argv[1], encoding="utf-8") as f:
+        before = json.load(f)
+    with open(sys.argv[2], encoding="utf-8") as f:
+        after = json.load(f)
+    for label, results in (("before", before), ("after", after)):
+        print(f"{label:7} {results['created']}  git {results['git']}  {results['config']['kind']} "
+              f"{results['net']['edges']} edges  {results['label']}")
+    print(f"\n{'':28} {'p50 ms':>19} {'':>8} {'p99 ms':>19} {'':>8} {'rps':>17} {'':>8}")
+    previous = dict(rows(before))
+    for name, b in rows(after):
+        a = previous.get(name)
+        if not a or not a.get("count") or not b.get("count"):
+            continue
+        line = f"{name:28}"
+        for key in ("p50_ms", "p99_ms", "throughput_rps"):
+            if key in a and key in b:
+                line += f" {a[key]:>9} -> {b[key]:<9}{change(a[key], b[key]):>8}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
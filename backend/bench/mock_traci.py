@@ -0,0 +1,211 @@
+"""
+mock_traci.py
+Scriptable stand-in for the parts of the traci package that app.py uses
+(start/close, simulationStep, edge/junction/trafficlight subscriptions),
+so the real update loop can run without SUMO. Edge travel times follow
+congestion waves; scripted hotspots hold halting queues long enough for
+the jam detector to fire.
+
+install() registers it as `traci` / `traci.constants` before app.py is
+imported; configure() then hands it the network (app.py's graph) and
+releases the waiting traci.start().
+"""
+import math
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+# Same variable ids as traci.constants
+LAST_STEP_VEHICLE_HALTING_NUMBER = 0x14
+VAR_CURRENT_TRAVELTIME = 0x5a
+TL_RED_YELLOW_GREEN_STATE = 0x20
+
+
+class TraCIException(Exception):
+    pass
+
+
+class Scenario:
+    """
+    Traffic pattern. Travel time = free-flow time * (1 + wave_amplitude * wave)
+    where the wave sweeps west -> east every `wave_period_s`; every
+    `hotspot_every_s` simulated seconds `hotspots` random edges get
+    `hotspot_halting` halting vehicles for `hotspot_duration_s`.
+    """
+
+    def __init__(self, wave_period_s=600.0, wave_amplitude=1.5, hotspots=3, hotspot_every_s=60.0,
+                 hotspot_duration_s=60.0, hotspot_halting=12, seed=0):
+        self.wave_period_s = wave_period_s
+        self.wave_amplitude = wave_amplitude
+        self.hotspots = hotspots
+        self.hotspot_every_s = hotspot_every_s
+        self.hotspot_duration_s = hotspot_duration_s
+        self.hotspot_halting = hotspot_halting
+        self.seed = seed
+
+
+class MockSimulation:
+    def __init__(self, scenario, speedup):
+        self.scenario = scenario
+        self.speedup = speedup # Simulated seconds per wall second; 0 = as fast as possible
+        self.rng = np.random.default_rng(scenario.seed)
+        self.ready = threading.Event()
+        self.time = 0.0
+        self.step_s = 1.0
+        self.edge_ids = []
+        self.steps = 0
+        self.step_wall_ms = [] # Wall time the app spent between simulationStep calls
+        self.sweep_wall_ms = [] # ... for the steps that ran a heartbeat sweep (pulled edge results)
+        self._last_step_t = None
+        self._sweep_step = False
+
+    def configure(self, edge_ids, edge_x, free_flow_s, junctions, traffic_lights):
+        """
+        edge_ids/edge_x/free_flow_s: per edge; junctions: {id: (x, y)};
+        traffic_lights: ids of junctions that have a signal.
+        """
+        self.edge_ids = list(edge_ids)
+        self.edge_index = {edge_id: e for e, edge_id in enumerate(self.edge_ids)}
+        span = max(float(np.ptp(edge_x)), 1.0)
+        self.phase = (np.asarray(edge_x) - np.min(edge_x)) / span * 2 * math.pi
+        self.free_flow_s = np.asarray(free_flow_s, dtype=np.float64)
+        self.hotspot_until = np.zeros(len(self.edge_ids))
+        self.max_speed = {} # edge index -> speed set by the app
+        self.junctions = dict(junctions)
+        self.traffic_lights = list(traffic_lights)
+        self.tl_offset = {tl_id: float(self.rng.uniform(0, 60)) for tl_id in self.traffic_lights}
+        self.edge_subscriptions = []
+        self.tl_subscriptions = []
+        self.ready.set()
+
+    # --- stepping ---
+    def step(self):
+        now = time.perf_counter()
+        if self._last_step_t is not None:
+            wall_ms = (now - self._last_step_t) * 1000
+            self.step_wall_ms.append(wall_ms)
+            if self._sweep_step:
+                self.sweep_wall_ms.append(wall_ms)
+        if self.speedup > 0 and self._last_step_t is not None:
+            time.sleep(max(self.step_s / self.speedup - (now - self._last_step_t), 0.0))
+        self.time += self.step_s
+        self.steps += 1
+        self._sweep_step = False
+        sc = self.scenario
+        if sc.hotspots and int(self.time) % int(sc.hotspot_every_s) == 0:
+            chosen = self.rng.integers(0, len(self.edge_ids), sc.hotspots)
+            self.hotspot_until[chosen] = self.time + sc.hotspot_duration_s
+        self._last_step_t = time.perf_counter()
+
+    def travel_times(self):
+        sc = self.scenario
+        wave = np.maximum(np.sin(2 * math.pi * self.time / sc.wave_period_s - self.phase), 0.0)
+        return self.free_flow_s * (1 + sc.wave_amplitude * wave)
+
+    def edge_results(self):
+        self._sweep_step = True
+        travel_time = self.travel_times()
+        halting = np.where(self.hotspot_until > self.time, self.scenario.hotspot_halting, 0)
+        blocked = [e for e, speed in self.max_speed.items() if speed < 1.0]
+        travel_time[blocked] *= 20 # Blocked by the app (incident): very slow
+        tt = travel_time.tolist()
+        hal = halting.tolist()
+        return {
+            self.edge_ids[e]: {LAST_STEP_VEHICLE_HALTING_NUMBER: hal[e], VAR_CURRENT_TRAVELTIME: tt[e]}
+            for e in self.edge_subscriptions
+        }
+
+    def signal_state(self, tl_id):
+        t = (self.time + self.tl_offset[tl_id]) % 60
+        return "GGrr" if t < 25 else "yyrr" if t < 30 else "rrGG"
+
+
+_sim = MockSimulation(Scenario(), speedup=0.0)
+
+
+def _require_ready():
+    if not _sim.ready.is_set():
+        raise TraCIException("mock_traci.configure() has not been called")
+
+
+# --- traci API surface used by app.py ---
+def start(cmd, port=None, **kwargs):
+    _sim.ready.wait() # The bench configures the network once app.py has loaded it
+    _sim.time = 0.0
+
+
+def close():
+    pass
+
+
+def simulationStep(target_time=0.0):
+    _require_ready()
+    _sim.step()
+    while target_time and _sim.time < target_time:
+        _sim.step()
+
+
+simulation = types.SimpleNamespace(getTime=lambda: _sim.time)
+
+
+def _edge_subscribe(edge_id, var_ids):
+    _sim.edge_subscriptions.append(_sim.edge_index[edge_id])
+
+
+def _edge_set_max_speed(edge_id, speed):
+    e = _sim.edge_index.get(edge_id)
+    if e is None:
+        raise TraCIException(f"Edge '{edge_id}' is not known")
+    _sim.max_speed[e] = speed
+
+
+def _tl_subscribe(tl_id, var_ids):
+    _sim.tl_subscriptions.append(tl_id)
+
+
+edge = types.SimpleNamespace(
+    getIDList=lambda: list(_sim.edge_ids),
+    subscribe=_edge_subscribe,
+    getAllSubscriptionResults=lambda: _sim.edge_results(),
+    setMaxSpeed=_edge_set_max_speed
+)
+junction = types.SimpleNamespace(
+    getIDList=lambda: list(_sim.junctions),
+    getPosition=lambda junction_id: _sim.junctions[junction_id]
+)
+trafficlight = types.SimpleNamespace(
+    getIDList=lambda: list(_sim.traffic_lights),
+    subscribe=_tl_subscribe,
+    getAllSubscriptionResults=lambda: {
+        tl_id: {TL_RED_YELLOW_GREEN_STATE: _sim.signal_state(tl_id)} for tl_id in _sim.tl_subscriptions
+    }
+)
+
+
+def install(scenario=None, speedup=0.0):
+    """Registers this module as `traci`; call before importing app. Returns the simulation."""
+    global _sim
+    _sim = MockSimulation(scenario or Scenario(), speedup)
+    module = sys.modules[__name__]
+    constants = types.ModuleType("traci.constants")
+    constants.LAST_STEP_VEHICLE_HALTING_NUMBER = LAST_STEP_VEHICLE_HALTING_NUMBER
+    constants.VAR_CURRENT_TRAVELTIME = VAR_CURRENT_TRAVELTIME
+    constants.TL_RED_YELLOW_GREEN_STATE = TL_RED_YELLOW_GREEN_STATE
+    module.constants = constants
+    sys.modules["traci"] = module
+    sys.modules["traci.constants"] = constants
+    return _sim
+
+
+def configure(G, traffic_light_every=7):
+    """Feeds the mock from app.py's RoutingGraph and lets traci.start() return."""
+    edge_x = (G.x[G.edge_from] + G.x[G.edge_to]) / 2
+    junctions = {node_id: (float(G.x[n]), float(G.y[n])) for n, node_id in enumerate(G.node_ids)}
+    in_degree = np.diff(G.in_start)
+    traffic_lights = [G.node_ids[n] for n in np.flatnonzero(in_degree >= 4).tolist() if n % traffic_light_every == 0]
+    _sim.configure(G.edge_ids, edge_x, G.original_travel_time, junctions, traffic_lights)
+    return _sim
+
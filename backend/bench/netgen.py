@@ -0,0 +1,111 @@
+"""
+netgen.py
+Synthetic SUMO road networks (.net.xml) for benchmarks: a grid or a radial
+(rings + spokes) layout of two-way streets, from about 1k to 500k edges.
+The output has the elements app.py and sumolib read (location, edge/lane,
+junction), placed around Mysuru so the app's geocoding defaults make sense.
+
+    python bench/netgen.py grid 20000 bench/work/grid_20000.net.xml
+"""
+import argparse
+import math
+import os
+
+import numpy as np
+
+# UTM zone 43N, with the net origin at roughly central Mysuru
+PROJ_PARAMETER = "+proj=utm +zone=43 +ellps=WGS84 +datum=WGS84 +units=m +no_defs"
+NET_OFFSET = (-678000.0, -1359800.0)
+SPEEDS = (8.33, 13.89, 16.67) # m/s: side street, street, arterial
+
+
+def grid_layout(num_edges, spacing):
+    """Square grid; returns (xy[n, 2], undirected segments[m, 2])."""
+    side = max(int(math.sqrt(num_edges / 4)) + 1, 2) # ~4 directed edges per node
+    ix, iy = np.meshgrid(np.arange(side), np.arange(side), indexing="ij")
+    xy = np.column_stack((ix.ravel(), iy.ravel())).astype(np.float64) * spacing
+    ids = np.arange(side * side).reshape(side, side)
+    horizontal = np.column_stack((ids[:-1, :].ravel(), ids[1:, :].ravel()))
+    vertical = np.column_stack((ids[:, :-1].ravel(), ids[:, 1:].ravel()))
+    return xy, np.vstack((horizontal, vertical))
+
+
+def radial_layout(num_edges, spacing):
+    """Rings around a centre joined by spokes; returns (xy[n, 2], segments[m, 2])."""
+    rings = max(int(math.sqrt(num_edges / 4 / 2 / math.pi)), 1)
+    spokes = max(int(round(2 * math.pi * rings)), 8) # Keeps ring segments about `spacing` long at the rim
+    r = np.repeat(np.arange(1, rings + 1), spokes) * spacing
+    angle = np.tile(np.arange(spokes), rings) * (2 * math.pi / spokes)
+    extent = rings * spacing
+    xy = np.vstack(([[extent, extent]], np.column_stack((extent + r * np.cos(angle), extent + r * np.sin(angle)))))
+    ids = 1 + np.arange(rings * spokes).reshape(rings, spokes)
+    ring = np.column_stack((ids.ravel(), np.roll(ids, -1, axis=1).ravel()))
+    spoke = np.column_stack((np.vstack((np.zeros((1, spokes), dtype=np.int64), ids[:-1])).ravel(), ids.ravel()))
+    return xy, np.vstack((ring, spoke))
+
+
+LAYOUTS = {"grid": grid_layout, "radial": radial_layout}
+
+
+def write_net(path, xy, segments, seed=0):
+    """
+    Writes both directions of every segment ("s12" and "-s12", like SUMO's
+    opposite edges) with one lane each. Returns the number of edges.
+    """
+    rng = np.random.default_rng(seed)
+    speeds = rng.choice(SPEEDS, size=len(segments), p=(0.5, 0.35, 0.15))
+    xmin, ymin = xy.min(axis=0)
+    xmax, ymax = xy.max(axis=0)
+    incoming = [[] for _ in range(len(xy))]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<net version="1.16" junctionCornerDetail="5" limitTurnSpeed="5.50">\n')
+        f.write(
+            f'    <location netOffset="{NET_OFFSET[0]:.2f},{NET_OFFSET[1]:.2f}" '
+            f'convBoundary="{xmin:.2f},{ymin:.2f},{xmax:.2f},{ymax:.2f}" '
+            f'origBoundary="-10000000000.00,-10000000000.00,10000000000.00,10000000000.00" '
+            f'projParameter="{PROJ_PARAMETER}"/>\n'
+        )
+        for s, ((u, v), speed) in enumerate(zip(segments.tolist(), speeds.tolist())):
+            length = max(float(np.hypot(*(xy[v] - xy[u]))), 0.1)
+            name = f' name="Street {s // 50}"' if s % 50 == 0 else ""
+            for edge_id, a, b in ((f"s{s}", u, v), (f"-s{s}", v, u)):
+                f.write(
+                    f'    <edge id="{edge_id}" from="n{a}" to="n{b}" priority="1"{name}>\n'
+                    f'        <lane id="{edge_id}_0" index="0" speed="{speed:.2f}" length="{length:.2f}" '
+                    f'shape="{xy[a, 0]:.2f},{xy[a, 1]:.2f} {xy[b, 0]:.2f},{xy[b, 1]:.2f}"/>\n'
+                    f'    </edge>\n'
+                )
+                incoming[b].append(f"{edge_id}_0")
+        for n, (x, y) in enumerate(xy.tolist()):
+            junction_type = "traffic_light" if len(incoming[n]) >= 4 and n % 7 == 0 else "priority"
+            f.write(
+                f'    <junction id="n{n}" type="{junction_type}" x="{x:.2f}" y="{y:.2f}" '
+                f'incLanes="{" ".join(incoming[n])}" intLanes="" shape=""/>\n'
+            )
+        f.write('</net>\n')
+    return 2 * len(segments)
+
+
+def generate(kind, num_edges, path, spacing=100.0, seed=0):
+    xy, segments = LAYOUTS[kind](num_edges, spacing)
+    return write_net(path, xy, segments, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic SUMO net for benchmarks")
+    parser.add_argument("kind", choices=sorted(LAYOUTS))
+    parser.add_argument("edges", type=int, help="approximate number of directed edges")
+    parser.add_argument("path", help="output .net.xml")
+    parser.add_argument("--spacing", type=float, default=100.0, help="metres between neighbouring junctions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    count = generate(args.kind, args.edges, args.path, args.spacing, args.seed)
+    print(f"Wrote {count} edges to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+run_bench.py
+Mixed-load benchmark: loads app.py on a synthetic net (netgen.py) with the
+mock TraCI (mock_traci.py) driving the real update loop, then runs /route,
+/report + /admin/unblock_edge and dashboard polling concurrently with it.
+Reports p50/p99 latency and throughput per endpoint, heartbeat sweep time
+and g_lock wait/hold times, and saves them as JSON under bench/results/.
+
+    cd backend
+    python bench/run_bench.py --kind grid --edges 20000 --duration 60
+    python bench/compare.py bench/results/<old>.json bench/results/<new>.json
+
+Needs the app's dependencies (Flask, sumolib, pyproj), but not SUMO itself.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mock_traci # noqa: E402
+import netgen # noqa: E402
+
+
+class TimedLock:
+    """Wraps app.g_lock to record how long writers wait for it and hold it."""
+
+    def __init__(self, lock):
+        self._lock = lock
+        self._acquired_at = 0.0
+        self.wait_ms = []
+        self.hold_ms = []
+
+    def acquire(self, *args, **kwargs):
+        start_t = time.perf_counter()
+        acquired = self._lock.acquire(*args, **kwargs)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            self.wait_ms.append((self._acquired_at - start_t) * 1000)
+        return acquired
+
+    def release(self):
+        self.hold_ms.append((time.perf_counter() - self._acquired_at) * 1000)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def summarize(samples_ms, duration_s=None):
+    if not samples_ms:
+        return {"count": 0}
+    arr = np.asarray(samples_ms)
+    summary = {
+        "count": len(arr),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p90_ms": round(float(np.percentile(arr, 90)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "max_ms": round(float(arr.max()), 3),
+        "mean_ms": round(float(arr.mean()), 3)
+    }
+    if duration_s:
+        summary["throughput_rps"] = round(len(arr) / duration_s, 2)
+    return summary
+
+
+class LoadRunner:
+    """Closed-loop workers (optional think time) against the Flask test client."""
+
+    def __init__(self, backend, duration_s, seed):
+        self.backend = backend
+        self.duration_s = duration_s
+        self.seed = seed
+        self.latencies = {} # endpoint -> [ms]
+        self.errors = {} # endpoint -> count
+        self._lock = threading.Lock()
+        G = backend.G
+        self.points = [f"{lat:.6f},{lon:.6f}" for lat, lon in zip(G.lat.tolist(), G.lon.tolist())]
+
+    def _record(self, endpoint, start_t, response):
+        elapsed_ms = (time.perf_counter() - start_t) * 1000
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed_ms)
+            if response.status_code >= 500:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def _worker(self, task, think_s, worker_id):
+        client = self.backend.app.test_client()
+        rng = random.Random(self.seed * 1000 + worker_id)
+        deadline = time.monotonic() + self.duration_s
+        while time.monotonic() < deadline:
+            task(client, rng)
+            if think_s:
+                time.sleep(think_s)
+
+    def route(self, client, rng):
+        start, end = rng.sample(self.points, 2)
+        start_t = time.perf_counter()
+        response = client.post("/route", json={"start_name": start, "end_name": end})
+        self._record("/route", start_t, response)
+
+    def report(self, client, rng):
+        start_t = time.perf_counter()
+        response = client.post("/report", json={"location_name": rng.choice(self.points), "type": "Accident"})
+        self._record("/report", start_t, response)
+        # Keep the number of active incidents bounded: unblock one of them
+        snap = self.backend.G.snapshot
+        active = np.flatnonzero(snap.is_incident)
+        if len(active) > 20:
+            edge_id = self.backend.G.edge_ids[int(rng.choice(active.tolist()))]
+            start_t = time.perf_counter()
+            response = client.post("/admin/unblock_edge", json={"edge_id": edge_id})
+            self._record("/admin/unblock_edge", start_t, response)
+
+    DASHBOARD_PATHS = (
+        "/admin/dashboard_data",
+        "/admin/heatmap?z=3",
+        "/admin/incident_history?bucket=minute",
+        "/admin/get_logs",
+        "/status"
+    )
+
+    def dashboard(self, client, rng):
+        for path in self.DASHBOARD_PATHS:
+            start_t = time.perf_counter()
+            response = client.get(path)
+            self._record(path.split("?")[0], start_t, response)
+
+    def run(self, route_workers, report_workers, report_think_s, dashboard_workers, dashboard_think_s):
+        threads = []
+        for kind, count, think_s in (
+            (self.route, route_workers, 0.0),
+            (self.report, report_workers, report_think_s),
+            (self.dashboard, dashboard_workers, dashboard_think_s)
+        ):
+            for _ in range(count):
+                threads.append(threading.Thread(target=self._worker, args=(kind, think_s, len(threads)), daemon=True))
+        start_t = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - start_t
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pathsync mixed-load benchmark")
+    parser.add_argument("--kind", choices=sorted(netgen.LAYOUTS), default="grid")
+    parser.add_argument("--edges", type=int, default=20000, help="approximate directed edges (1k to 500k)")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of load")
+    parser.add_argument("--speedup", type=float, default=10.0,
+                        help="simulated seconds per wall second (the run stops at 3600 simulated seconds)")
+    parser.add_argument("--route-workers", type=int, default=4)
+    parser.add_argument("--report-workers", type=int, default=1)
+    parser.add_argument("--report-think", type=float, default=0.5, help="seconds between a worker's reports")
+    parser.add_argument("--dashboard-workers", type=int, default=2)
+    parser.add_argument("--dashboard-think", type=float, default=1.0, help="seconds between a worker's polls")
+    parser.add_argument("--hotspots", type=int, default=3, help="jams started per simulated minute")
+    parser.add_argument("--no-cch-wait", action="store_true", help="start the load before CCH is ready")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="free-form tag stored with the results")
+    parser.add_argument("--work-dir", default=os.path.join(BENCH_DIR, "work"))
+    parser.add_argument("--results-dir", default=os.path.join(BENCH_DIR, "results"))
+    args = parser.parse_args()
+
+    # 1. Synthetic net (reused across runs; the app caches its binary snapshot too)
+    net_file = os.path.join(args.work_dir, f"{args.kind}_{args.edges}.net.xml")
+    if not os.path.exists(net_file):
+        count = netgen.generate(args.kind, args.edges, net_file, seed=args.seed)
+        print(f"Generated {net_file} ({count} edges)")
+    incident_db = os.path.join(args.work_dir, "incidents.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(incident_db + suffix):
+            os.remove(incident_db + suffix) # Each run starts without incidents
+    os.environ.update({
+        "PATHSYNC_NET_FILE": net_file,
+        "PATHSYNC_NET_CACHE_DIR": os.path.join(args.work_dir, "net_cache"),
+        "PATHSYNC_INCIDENT_DB": incident_db,
+        "PATHSYNC_GEOCODE_CACHE": os.path.join(args.work_dir, "geocode_cache.json"),
+        "PATHSYNC_ROLE": "standalone"
+    })
+    os.environ.setdefault("SUMO_HOME", "") # app.py only checks it; the mock replaces SUMO
+
+    # 2. Load the app with the mock TraCI, then hand the mock its network
+    sim = mock_traci.install(mock_traci.Scenario(hotspots=args.hotspots, seed=args.seed), speedup=args.speedup)
+    os.chdir(BACKEND_DIR)
+    import_t = time.perf_counter()
+    import app as backend
+    import_ms = (time.perf_counter() - import_t) * 1000
+    timed_lock = TimedLock(backend.g_lock)
+    backend.g_lock = timed_lock
+    mock_traci.configure(backend.G)
+    backend.sumo_ready.wait()
+    if not args.no_cch_wait:
+        while backend.cch_customizer is None or backend.cch_customizer.current(backend.G.snapshot.version) is None:
+            time.sleep(0.1)
+    print(f"App ready: {backend.G.edge_count} edges, startup {import_ms:.0f} ms, load starts now ({args.duration:.0f} s)")
+
+    # 3. Mixed load against the running update loop
+    runner = LoadRunner(backend, args.duration, args.seed)
+    first_step = len(sim.step_wall_ms)
+    first_sweep = len(sim.sweep_wall_ms)
+    first_lock = len(timed_lock.wait_ms)
+    elapsed_s = runner.run(args.route_workers, args.report_workers, args.report_think,
+                           args.dashboard_workers, args.dashboard_think)
+
+    results = {
+        "label": args.label,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("work_dir", "results_dir")},
+        "net": {"edges": backend.G.edge_count, "nodes": len(backend.G)},
+        "startup_ms": {"import": round(import_ms, 1), **backend.STARTUP_TIMINGS},
+        "duration_s": round(elapsed_s, 2),
+        "endpoints": {
+            endpoint: {**summarize(samples, elapsed_s), "errors": runner.errors.get(endpoint, 0)}
+            for endpoint, samples in sorted(runner.latencies.items())
+        },
+        "sweep": summarize(sim.sweep_wall_ms[first_sweep:]),
+        "sim_step": summarize(sim.step_wall_ms[first_step:]),
+        "g_lock": {
+            "wait": summarize(timed_lock.wait_ms[first_lock:]),
+            "hold": summarize(timed_lock.hold_ms[first_lock:])
+        },
+        "sim_time": sim.time,
+        "route_cache": backend.route_cache.stats()
+    }
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    out_path = os.path.join(args.results_dir, f"{stamp}_{args.kind}_{args.edges}{'_' + args.label if args.label else ''}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'endpoint':28} {'count':>7} {'rps':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for endpoint, s in results["endpoints"].items():
+        print(f"{endpoint:28} {s['count']:>7} {s['throughput_rps']:>8} {s['p50_ms']:>9} {s['p99_ms']:>9} {s['errors']:>7}")
+    for name, s in (("heartbeat sweep", results["sweep"]), ("g_lock wait", results["g_lock"]["wait"]),
+                    ("g_lock hold", results["g_lock"]["hold"])):
+        if s["count"]:
+            print(f"{name:28} {s['count']:>7} {'':>8} {s['p50_ms']:>9} {s['p99_ms']:>9}")
+    print(f"\nSaved {out_path}")
+
+
+if __name__ == "__main__":
+    main()
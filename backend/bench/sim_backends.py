@@ -0,0 +1,155 @@
+"""
+sim_backends.py
+Compares the simulation backends (sim_backend.py) on the same scenario:
+steps per second, and heartbeat sweep time (one bulk edge subscription
+pull plus a few setMaxSpeed writes, like the engine's sweep). Each backend
+runs in its own subprocess, since libsumo hosts one simulation per process.
+
+    cd backend
+    python bench/sim_backends.py --steps 3600              # simulation/map.sumocfg
+    python bench/sim_backends.py --grid 30 --steps 1800    # netgenerate grid + randomTrips
+
+Needs SUMO (sumo, netgenerate, tools/randomTrips.py) and, for libsumo,
+the libsumo module (SUMO_HOME/tools or `pip install libsumo`).
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+if "SUMO_HOME" in os.environ:
+    sys.path.append(os.path.join(os.environ["SUMO_HOME"], "tools"))
+
+import sim_backend # noqa: E402
+
+SPEED_WRITES_PER_SWEEP = 10
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    arr = np.asarray(samples)
+    return {
+        "count": len(arr),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "mean_ms": round(float(arr.mean()), 3)
+    }
+
+
+def run_worker(name, cmd, steps, sweep_every):
+    """Runs one backend in this process and returns its measurements."""
+    module, tc = sim_backend.load(name)
+    start_t = time.perf_counter()
+    port = sim_backend.start(module, name, cmd)
+    start_ms = (time.perf_counter() - start_t) * 1000
+
+    edges = [e for e in module.edge.getIDList() if not e.startswith(":")]
+    for edge_id in edges:
+        module.edge.subscribe(edge_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER, tc.VAR_CURRENT_TRAVELTIME])
+    speed_edges = edges[:SPEED_WRITES_PER_SWEEP]
+    rng = np.random.default_rng(0)
+
+    step_ms, sweep_ms = [], []
+    loop_t = time.perf_counter()
+    for step in range(1, steps + 1):
+        t = time.perf_counter()
+        module.simulationStep()
+        step_ms.append((time.perf_counter() - t) * 1000)
+        if step % sweep_every == 0:
+            t = time.perf_counter()
+            results = module.edge.getAllSubscriptionResults()
+            halting = sum(v[tc.LAST_STEP_VEHICLE_HALTING_NUMBER] for v in results.values())
+            for e in speed_edges:
+                # Block / restore a few edges, like incident speed sync does
+                module.edge.setMaxSpeed(e, 0.1 if rng.random() < 0.5 else 13.89)
+            sweep_ms.append((time.perf_counter() - t) * 1000)
+        if module.simulation.getMinExpectedNumber() == 0:
+            break
+    loop_s = time.perf_counter() - loop_t
+    module.close()
+    return {
+        "backend": name,
+        "port": port,
+        "edges": len(edges),
+        "start_ms": round(start_ms, 1),
+        "steps": len(step_ms),
+        "steps_per_s": round(len(step_ms) / loop_s, 1),
+        "step": percentiles(step_ms),
+        "sweep": percentiles(sweep_ms),
+        "halting_at_end": halting if sweep_ms else None
+    }
+
+
+def grid_scenario(work_dir, size, steps):
+    """A netgenerate grid plus random trips; returns the sumo arguments."""
+    import sumolib
+    os.makedirs(work_dir, exist_ok=True)
+    net = os.path.join(work_dir, f"sumo_grid_{size}.net.xml")
+    routes = os.path.join(work_dir, f"sumo_grid_{size}.rou.xml")
+    if not os.path.exists(net):
+        subprocess.run([sumolib.checkBinary("netgenerate"), "--grid", "--grid.number", str(size),
+                        "--grid.length", "100", "-o", net], check=True)
+    if not os.path.exists(routes):
+        random_trips = os.path.join(os.environ["SUMO_HOME"], "tools", "randomTrips.py")
+        subprocess.run([sys.executable, random_trips, "-n", net, "-r", routes, "-e", str(steps),
+                        "--period", "0.2", "-o", os.path.join(work_dir, f"sumo_grid_{size}.trips.xml")], check=True)
+    return ["-n", net, "-r", routes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TraCI vs libsumo benchmark")
+    parser.add_argument("--steps", type=int, default=3600)
+    parser.add_argument("--sweep-every", type=int, default=10, help="steps between sweeps")
+    parser.add_argument("--grid", type=int, help="use a netgenerate grid of N x N junctions instead of map.sumocfg")
+    parser.add_argument("--backends", default=",".join(sim_backend.SIM_BACKENDS))
+    parser.add_argument("--work-dir", default=os.path.join(BENCH_DIR, "work"))
+    parser.add_argument("--results-dir", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--cmd", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, json.loads(args.cmd), args.steps, args.sweep_every)))
+        return
+
+    import sumolib
+    scenario = grid_scenario(args.work_dir, args.grid, args.steps) if args.grid else \
+        ["-c", os.path.join(BACKEND_DIR, "simulation", "map.sumocfg")]
+    cmd = [sumolib.checkBinary("sumo"), *scenario, "--no-step-log", "--no-warnings", "--end", str(args.steps)]
+
+    runs = []
+    for name in args.backends.split(","):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", name, "--cmd", json.dumps(cmd),
+             "--steps", str(args.steps), "--sweep-every", str(args.sweep_every)],
+            capture_output=True, text=True, cwd=BACKEND_DIR
+        )
+        if proc.returncode != 0:
+            print(f"{name}: failed\n{proc.stderr.strip()}")
+            continue
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"\n{'backend':10} {'edges':>7} {'steps/s':>9} {'step p50':>9} {'step p99':>9} {'sweep p50':>10} {'sweep p99':>10}")
+    for r in runs:
+        print(f"{r['backend']:10} {r['edges']:>7} {r['steps_per_s']:>9} {r['step'].get('p50_ms', '-'):>9} "
+              f"{r['step'].get('p99_ms', '-'):>9} {r['sweep'].get('p50_ms', '-'):>10} {r['sweep'].get('p99_ms', '-'):>10}")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    out_path = os.path.join(args.results_dir, f"{stamp}_sim_backends.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"scenario": scenario, "steps": args.steps, "sweep_every": args.sweep_every, "runs": runs}, f, indent=2)
+    print(f"\nSaved {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+wire_formats.py
+Payload size and encode time of the compact wire encodings (wire_format.py)
+against the plain JSON responses, on a synthetic net (netgen.py) with the
+mock TraCI (mock_traci.py) running the real update loop:
+
+    /route             route_coords JSON vs polyline / polyline6 geometry
+    /admin/dashboard_data  row JSON vs columnar (first poll with the static
+                       tables, later polls without) vs MessagePack
+
+Each body is measured raw, gzip'ed and brotli'ed (if brotli is installed),
+and each variant is timed through the Flask test client, so the times
+include serialization and compression.
+
+    cd backend
+    python bench/wire_formats.py --kind grid --edges 20000
+
+Needs the app's dependencies (Flask, sumolib, pyproj), but not SUMO itself.
+msgpack and brotli are measured when installed.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mock_traci # noqa: E402
+import netgen # noqa: E402
+import wire_format # noqa: E402
+
+ENCODINGS = ("identity", "gzip") + (("br",) if wire_format.brotli is not None else ())
+
+
+def time_request(send, repeat):
+    """Calls send() `repeat` times; returns (last response, p50 ms, p99 ms)."""
+    samples = []
+    for _ in range(repeat):
+        start_t = time.perf_counter()
+        response = send()
+        samples.append((time.perf_counter() - start_t) * 1000)
+    return response, round(float(np.percentile(samples, 50)), 3), round(float(np.percentile(samples, 99)), 3)
+
+
+def measure(client, method, path, repeat, body=None, headers=None):
+    """One row per Accept-Encoding: bytes on the wire and request time."""
+    rows = {}
+    for encoding in ENCODINGS:
+        h = {**(headers or {}), "Accept-Encoding": encoding}
+        send = (lambda: client.post(path, json=body, headers=h)) if method == "POST" else (lambda: client.get(path, headers=h))
+        response, p50, p99 = time_request(send, repeat)
+        if response.status_code != 200:
+            raise RuntimeError(f"{method} {path} answered {response.status_code}")
+        rows[encoding] = {"bytes": len(response.data), "p50_ms": p50, "p99_ms": p99}
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire encoding size / time benchmark")
+    parser.add_argument("--kind", choices=sorted(netgen.LAYOUTS), default="grid")
+    parser.add_argument("--edges", type=int, default=20000, help="approximate directed edges (1k to 500k)")
+    parser.add_argument("--routes", type=int, default=50, help="random /route pairs")
+    parser.add_argument("--alternatives", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20, help="requests per variant")
+    parser.add_argument("--warmup", type=float, default=10.0, help="wall seconds of simulation before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=os.path.join(BENCH_DIR, "work"))
+    parser.add_argument("--results-dir", default=os.path.join(BENCH_DIR, "results"))
+    args = parser.parse_args()
+
+    net_file = os.path.join(args.work_dir, f"{args.kind}_{args.edges}.net.xml")
+    if not os.path.exists(net_file):
+        count = netgen.generate(args.kind, args.edges, net_file, seed=args.seed)
+        print(f"Generated {net_file} ({count} edges)")
+    os.environ.update({
+        "PATHSYNC_NET_FILE": net_file,
+        "PATHSYNC_NET_CACHE_DIR": os.path.join(args.work_dir, "net_cache"),
+        "PATHSYNC_INCIDENT_DB": os.path.join(args.work_dir, "wire_incidents.db"),
+        "PATHSYNC_GEOCODE_CACHE": os.path.join(args.work_dir, "geocode_cache.json"),
+        "PATHSYNC_ROLE": "standalone"
+    })
+    os.environ.setdefault("SUMO_HOME", "") # app.py only checks it; the mock replaces SUMO
+
+    mock_traci.install(mock_traci.Scenario(seed=args.seed), speedup=10.0)
+    os.chdir(BACKEND_DIR)
+    import app as backend
+    mock_traci.configure(backend.G)
+    backend.sumo_ready.wait()
+    while backend.cch_customizer is None or backend.cch_customizer.current(backend.G.snapshot.version) is None:
+        time.sleep(0.1)
+    time.sleep(args.warmup) # Heatmap, signals and detector incidents fill in
+    client = backend.app.test_client()
+    G = backend.G
+
+    # 1. Route geometry
+    rng = random.Random(args.seed)
+    points = [f"{lat:.6f},{lon:.6f}" for lat, lon in zip(G.lat.tolist(), G.lon.tolist())]
+    bodies = []
+    while len(bodies) < args.routes:
+        start, end = rng.sample(points, 2)
+        body = {"start_name": start, "end_name": end, "alternatives": args.alternatives}
+        if client.post("/route", json=body).status_code == 200: # Also fills the route cache
+            bodies.append(body)
+    route = {}
+    for geometry in wire_format.GEOMETRY_FORMATS:
+        per_encoding = {encoding: {"bytes": [], "p50_ms": []} for encoding in ENCODINGS}
+        for body in bodies:
+            for encoding, row in measure(client, "POST", "/route", max(args.repeat // 4, 1),
+                                         body={**body, "geometry": geometry}).items():
+                per_encoding[encoding]["bytes"].append(row["bytes"])
+                per_encoding[encoding]["p50_ms"].append(row["p50_ms"])
+        route[geometry] = {
+            encoding: {"mean_bytes": round(float(np.mean(v["bytes"])), 1), "p50_ms": round(float(np.median(v["p50_ms"])), 3)}
+            for encoding, v in per_encoding.items()
+        }
+    coords = [client.post("/route", json=b).get_json()["route_coords"] for b in bodies]
+    encode_ms = {}
+    for geometry, precision in wire_format.GEOMETRY_FORMATS.items():
+        start_t = time.perf_counter()
+        for c in coords:
+            json.dumps(c) if precision is None else wire_format.encode_polyline(c, precision)
+        encode_ms[geometry] = round((time.perf_counter() - start_t) * 1000 / len(coords), 4)
+
+    # 2. Dashboard payloads
+    static_key = client.get("/admin/dashboard_data?format=columnar").get_json()["static_key"]
+    variants = {
+        "json_rows": ("/admin/dashboard_data", None),
+        "columnar_first": ("/admin/dashboard_data?format=columnar", None),
+        "columnar": (f"/admin/dashboard_data?format=columnar&static={static_key}", None)
+    }
+    if wire_format.msgpack is not None:
+        variants["msgpack_first"] = ("/admin/dashboard_data", {"Accept": wire_format.MSGPACK_MIMETYPE})
+        variants["msgpack"] = (f"/admin/dashboard_data?static={static_key}", {"Accept": wire_format.MSGPACK_MIMETYPE})
+    dashboard = {name: measure(client, "GET", path, args.repeat, headers=headers) for name, (path, headers) in variants.items()}
+    counts = client.get("/admin/dashboard_data").get_json()
+
+    results = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("work_dir", "results_dir")},
+        "net": {"edges": G.edge_count, "nodes": len(G)},
+        "dashboard_rows": {
+            "heatmap": len(counts["edge_heatmap_data"]),
+            "signals": len(counts["traffic_light_states"]),
+            "incidents": len(counts["incidents"])
+        },
+        "route": route,
+        "route_geometry_encode_ms": encode_ms,
+        "dashboard": dashboard
+    }
+
+    def table(title, rows):
+        print(f"\n{title}")
+        print(f"{'variant':16}" + "".join(f"{e + ' bytes':>16}{e + ' ms':>12}" for e in ENCODINGS))
+        for name, row in rows.items():
+            print(f"{name:16}" + "".join(
+                f"{row[e].get('mean_bytes', row[e].get('bytes')):>16}{row[e]['p50_ms']:>12}" for e in ENCODINGS))
+
+    print(f"Net: {G.edge_count} edges; dashboard rows: {results['dashboard_rows']}")
+    table(f"/route ({args.routes} routes, {args.alternatives} alternatives, mean body)", route)
+    print(f"geometry encode per route (ms): {encode_ms}")
+    table("/admin/dashboard_data", dashboard)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    out_path = os.path.join(args.results_dir, f"{stamp}_wire_formats_{args.kind}_{args.edges}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved {out_path}")
+    os._exit(0) # The update loop thread is not meant to be joined
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+"""
+cch.py
+Customizable Contraction Hierarchy (CCH) over the RoutingGraph.
+
+Phase 1 (once, metric independent): compute a node ordering on the
+undirected road topology and the chordal "shortcut" graph it induces.
+Phase 2 (after every weight change): re-customize the metric by running
+the lower-triangle relaxation with vectorized NumPy ops, level by level.
+Phase 3 (per query): bidirectional upward search, then unpack shortcuts
+back into original edges.
+"""
+import heapq
+import math
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from routing_graph import DEFAULT_MAX_OVERLAP, DEFAULT_MAX_STRETCH, select_alternatives
+
+CCHMetric = namedtuple("CCHMetric", ["version", "weights", "up", "down"])
+CCHRoute = namedtuple("CCHRoute", ["nodes", "edges", "travel_time", "length", "settled"])
+
+
+def min_degree_order(num_nodes, undirected_pairs):
+    """
+    Greedy minimum-degree elimination ordering.
+    Returns (rank array, list of upper-neighbour lists) where the upper
+    neighbours of a node are its neighbours at the moment it is eliminated.
+    """
+    adj = [set() for _ in range(num_nodes)]
+    for a, b in undirected_pairs:
+        adj[a].add(b)
+        adj[b].add(a)
+
+    heap = [(len(adj[v]), v) for v in range(num_nodes)]
+    heapq.heapify(heap)
+    rank = np.full(num_nodes, -1, dtype=np.int64)
+    upper = [None] * num_nodes
+    next_rank = 0
+    while heap:
+        deg, x = heapq.heappop(heap)
+        if rank[x] >= 0 or deg != len(adj[x]):
+            continue # Stale heap entry
+        rank[x] = next_rank
+        next_rank += 1
+        nbrs = adj[x]
+        upper[x] = list(nbrs)
+        for a in nbrs:
+            na = adj[a]
+            na.discard(x)
+            na.update(nbrs) # Fill-in: neighbours of x become a clique
+            na.discard(a)
+            heapq.heappush(heap, (len(na), a))
+        adj[x] = set()
+    return rank, upper
+
+
+class CustomizableCH:
+    """
+    Metric-independent CCH structure for one RoutingGraph topology.
+    Arcs are undirected pairs (low, high) by rank; every arc carries an
+    `up` weight (low -> high) and a `down` weight (high -> low).
+    """
+
+    def __init__(self, graph):
+        start_t = time.time()
+        self.graph = graph
+        n = len(graph)
+        ef, et = graph.edge_from, graph.edge_to
+
+        pairs = {(min(a, b), max(a, b)) for a, b in zip(ef.tolist(), et.tolist()) if a != b}
+        self.rank, upper = min_degree_order(n, pairs)
+        rank = self.rank
+
+        # --- Arcs of the chordal supergraph, grouped by their low endpoint ---
+        arc_low, arc_high = [], []
+        arc_of = {}
+        for x in np.argsort(rank).tolist():
+            for y in sorted(upper[x], key=lambda v: rank[v]):
+                arc_of[(x, y)] = len(arc_low)
+                arc_low.append(x)
+                arc_high.append(y)
+        self.arc_low = np.array(arc_low, dtype=np.int64)
+        self.arc_high = np.array(arc_high, dtype=np.int64)
+        self.num_arcs = len(arc_low)
+
+        # Each node's upward arcs are one contiguous slice, sorted by head rank
+        low_rank = rank[self.arc_low]
+        self._arc_first = np.searchsorted(low_rank, rank).tolist()
+        self._arc_end = np.searchsorted(low_rank, rank, side="right").tolist()
+        self._arc_high = self.arc_high.tolist()
+        self._arc_low = self.arc_low.tolist()
+
+        # Elimination tree: a node's parent is its lowest-ranked upper neighbour.
+        # The upward search space of any node is exactly its ancestor chain.
+        parent = [-1] * n
+        for x in range(n):
+            if self._arc_end[x] > self._arc_first[x]:
+                parent[x] = self._arc_high[self._arc_first[x]]
+        self._parent = parent
+
+        # Arcs grouped by their high endpoint, for path recovery
+        self.in_arcs = np.argsort(self.arc_high, kind="stable")
+        in_start = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.arc_high, minlength=n), out=in_start[1:])
+        self._in_start = in_start.tolist()
+
+        # --- Levels: a node's level is above all of its lower neighbours ---
+        level = np.zeros(n, dtype=np.int64)
+        for x in np.argsort(rank).tolist():
+            lx = level[x]
+            for y in upper[x]:
+                if level[y] <= lx:
+                    level[y] = lx + 1
+        self.level = level
+
+        # --- Lower triangles (x, u, v): x below u below v, arc (u, v) is the target ---
+        tri_target, tri_xu, tri_xv = [], [], []
+        for x in range(n):
+            ups = sorted(upper[x], key=lambda v: rank[v])
+            for i, u in enumerate(ups):
+                xu = arc_of[(x, u)]
+                for v in ups[i + 1:]:
+                    tri_target.append(arc_of[(u, v)])
+                    tri_xu.append(xu)
+                    tri_xv.append(arc_of[(x, v)])
+        tri_target = np.array(tri_target, dtype=np.int64)
+        tri_xu = np.array(tri_xu, dtype=np.int64)
+        tri_xv = np.array(tri_xv, dtype=np.int64)
+
+        # Sort by (level of the target's low end, target arc) so that each
+        # customization batch is contiguous and each arc's triangles are too.
+        tri_level = level[self.arc_low[tri_target]] if len(tri_target) else tri_target
+        order = np.lexsort((tri_target, tri_level))
+        self.tri_target = tri_target[order]
+        self.tri_xu = tri_xu[order]
+        self.tri_xv = tri_xv[order]
+        tri_level = tri_level[order]
+        if len(tri_level):
+            bounds = np.flatnonzero(np.diff(tri_level)) + 1
+            edges = np.concatenate(([0], bounds, [len(tri_level)]))
+            self.level_batches = list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+        else:
+            self.level_batches = []
+        self._index_triangles()
+
+        # --- Original edges mapped onto arcs ---
+        keep = np.flatnonzero(ef != et)
+        lo = np.where(rank[ef[keep]] < rank[et[keep]], ef[keep], et[keep])
+        hi = np.where(rank[ef[keep]] < rank[et[keep]], et[keep], ef[keep])
+        self.base_edge = keep
+        self.base_arc = np.array([arc_of[(a, b)] for a, b in zip(lo.tolist(), hi.tolist())], dtype=np.int64)
+        self.base_up = rank[ef[keep]] < rank[et[keep]]
+        base_order = np.argsort(self.base_arc, kind="stable")
+        self._base_edge_by_arc = self.base_edge[base_order].tolist()
+        base_start = np.zeros(self.num_arcs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.base_arc, minlength=self.num_arcs), out=base_start[1:])
+        self._base_start = base_start.tolist()
+
+        self.build_seconds = time.time() - start_t
+
+    def _index_triangles(self):
+        """Records, per arc, where its (contiguous) triangles start and how many there are."""
+        first = np.full(self.num_arcs, -1, dtype=np.int64)
+        if len(self.tri_target):
+            change = np.concatenate(([True], self.tri_target[1:] != self.tri_target[:-1]))
+            first[self.tri_target[change]] = np.flatnonzero(change)
+        self._tri_first = first.tolist()
+        self._tri_count = np.bincount(self.tri_target, minlength=self.num_arcs).tolist()
+        self._tri_xu = self.tri_xu.tolist()
+        self._tri_xv = self.tri_xv.tolist()
+        self._length_cache = (None, None) # (metric, (up_len, down_len))
+        self._length_lock = threading.Lock()
+
+    @property
+    def num_triangles(self):
+        return len(self.tri_target)
+
+    # --- PHASE 2: CUSTOMIZATION ---
+    def customize(self, weights, version=0):
+        """
+        Builds up/down arc weights for one weight vector. Pure NumPy.
+        `weights` is kept for path unpacking and must not be mutated later
+        (snapshot arrays are read-only, so they qualify).
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        up = np.full(self.num_arcs, math.inf)
+        down = np.full(self.num_arcs, math.inf)
+        w = weights[self.base_edge]
+        np.minimum.at(up, self.base_arc[self.base_up], w[self.base_up])
+        np.minimum.at(down, self.base_arc[~self.base_up], w[~self.base_up])
+
+        for s, e in self.level_batches:
+            t, xu, xv = self.tri_target[s:e], self.tri_xu[s:e], self.tri_xv[s:e]
+            np.minimum.at(up, t, down[xu] + up[xv])
+            np.minimum.at(down, t, down[xv] + up[xu])
+        return CCHMetric(version, weights, up, down)
+
+    def metric_lengths(self, metric):
+        """
+        Length (metres) of the path each arc's up/down weight stands for.
+        Only needed for distance matrices, so it is computed lazily once
+        per metric by replaying the triangles and keeping the tight ones.
+        """
+        with self._length_lock:
+            cached_metric, lengths = self._length_cache
+            if cached_metric is metric:
+                return lengths
+            up, down = metric.up, metric.down
+            up_len = np.full(self.num_arcs, math.inf)
+            down_len = np.full(self.num_arcs, math.inf)
+            w = metric.weights[self.base_edge]
+            base_len = self.graph.length[self.base_edge]
+            arcs = self.base_arc
+            tight_up = self.base_up & (w == up[arcs])
+            tight_down = ~self.base_up & (w == down[arcs])
+            np.minimum.at(up_len, arcs[tight_up], base_len[tight_up])
+            np.minimum.at(down_len, arcs[tight_down], base_len[tight_down])
+
+            for s, e in self.level_batches:
+                t, xu, xv = self.tri_target[s:e], self.tri_xu[s:e], self.tri_xv[s:e]
+                tight = (down[xu] + up[xv]) == up[t]
+                np.minimum.at(up_len, t[tight], down_len[xu[tight]] + up_len[xv[tight]])
+                tight = (down[xv] + up[xu]) == down[t]
+                np.minimum.at(down_len, t[tight], down_len[xv[tight]] + up_len[xu[tight]])
+            lengths = (up_len, down_len)
+            self._length_cache = (metric, lengths)
+            return lengths
+
+    # --- PHASE 3: QUERY ---
+    def _ancestors(self, node):
+        chain = []
+        parent = self._parent
+        while node != -1:
+            chain.append(node)
+            node = parent[node]
+        return chain
+
+    def _upward_search(self, source, arc_weights, arc_lengths=None):
+        """
+        Elimination-tree search: relax every upward arc of each ancestor of
+        `source`, lowest first. No priority queue is needed because an arc
+        always points further up the same chain. With `arc_lengths`, the
+        length of each tentative path is carried along as well.
+        """
+        dist = np.full(len(self.graph), math.inf)
+        dist[source] = 0.0
+        length = None
+        if arc_lengths is not None:
+            length = np.zeros(len(self.graph))
+        chain = self._ancestors(source)
+        arc_first, arc_end, arc_high = self._arc_first, self._arc_end, self.arc_high
+        for u in chain:
+            du = dist[u]
+            a0, a1 = arc_first[u], arc_end[u]
+            if du == math.inf or a0 == a1:
+                continue
+            heads = arc_high[a0:a1]
+            if length is None:
+                dist[heads] = np.minimum(dist[heads], du + arc_weights[a0:a1])
+                continue
+            cand = du + arc_weights[a0:a1]
+            better = cand < dist[heads]
+            if better.any():
+                improved = heads[better]
+                dist[improved] = cand[better]
+                length[improved] = length[u] + arc_lengths[a0:a1][better]
+        if length is None:
+            return dist, chain
+        return dist, length, chain
+
+    def many_to_many(self, sources, targets, metric):
+        """
+        Travel-time and distance matrices (len(sources) x len(targets)).
+        Backward searches from all targets are done once and stored as a
+        dense block over the union of their ancestor chains; each source
+        then needs one upward search and a single vectorized min.
+        Unreachable cells are inf.
+        """
+        up_len, down_len = self.metric_lengths(metric)
+        backward = [self._upward_search(t, metric.down, down_len) for t in targets]
+
+        col = np.full(len(self.graph), -1, dtype=np.int64)
+        union = np.unique(np.concatenate([np.array(ch, dtype=np.int64) for _, _, ch in backward])) \
+            if backward else np.zeros(0, dtype=np.int64)
+        col[union] = np.arange(len(union))
+        back_time = np.full((len(targets), len(union)), math.inf)
+        back_len = np.full((len(targets), len(union)), math.inf)
+        for j, (dist, length, chain) in enumerate(backward):
+            ch = np.array(chain, dtype=np.int64)
+            back_time[j, col[ch]] = dist[ch]
+            back_len[j, col[ch]] = length[ch]
+
+        times = np.full((len(sources), len(targets)), math.inf)
+        lengths = np.full((len(sources), len(targets)), math.inf)
+        rows = np.arange(len(targets))
+        for i, s in enumerate(sources):
+            dist, length, chain = self._upward_search(s, metric.up, up_len)
+            ch = np.array(chain, dtype=np.int64)
+            c = col[ch]
+            keep = c >= 0
+            ch, c = ch[keep], c[keep]
+            if len(ch) == 0 or len(targets) == 0:
+                continue
+            totals = dist[ch][None, :] + back_time[:, c]
+            best = np.argmin(totals, axis=1)
+            times[i] = totals[rows, best]
+            lengths[i] = length[ch][best] + back_len[rows, c[best]]
+        lengths[~np.isfinite(times)] = math.inf
+        return times, lengths
+
+    def shortest_path(self, source, target, metric):
+        """
+        Upward searches from both ends over the customized metric, meeting
+        on the common ancestors. Returns a CCHRoute, or None if unreachable.
+        """
+        dist_f, chain_s = self._upward_search(source, metric.up)
+        dist_b, chain_t = self._upward_search(target, metric.down)
+
+        common = np.array(chain_s, dtype=np.int64)
+        totals = dist_f[common] + dist_b[common]
+        i = int(np.argmin(totals))
+        best = float(totals[i])
+        if best == math.inf:
+            return None
+        meet = int(common[i])
+        edges = self._unpack_via(source, target, meet, dist_f, dist_b, metric)
+        nodes = [source] + [int(self.graph.edge_to[e]) for e in edges]
+        length = float(self.graph.length[edges].sum()) if edges else 0.0
+        return CCHRoute(nodes, edges, best, length, len(chain_s) + len(chain_t))
+
+    def alternatives(self, source, target, metric, k=3,
+                     max_stretch=DEFAULT_MAX_STRETCH, max_overlap=DEFAULT_MAX_OVERLAP):
+        """
+        Up to `k` diverse routes by the via-node method on the two upward
+        searches of one shortest_path query: every common ancestor within
+        `max_stretch` x the best total is a candidate via node, unpacked
+        lazily in order of its total. Returns [(Route, overlap), ...] as
+        routing_graph.select_alternatives does; [] if unreachable.
+        """
+        dist_f, chain_s = self._upward_search(source, metric.up)
+        dist_b, _ = self._upward_search(target, metric.down)
+
+        common = np.array(chain_s, dtype=np.int64)
+        totals = dist_f[common] + dist_b[common]
+        order = np.argsort(totals, kind="stable")
+        best = float(totals[order[0]])
+        if best == math.inf:
+            return []
+
+        def candidates():
+            # Paths through nearby via nodes share most of their arcs
+            unpacked = {}
+            for i in order:
+                total = float(totals[i])
+                if total > max_stretch * best:
+                    break
+                yield self._unpack_via(source, target, int(common[i]), dist_f, dist_b, metric, unpacked), total
+
+        return select_alternatives(self.graph, source, candidates(), k, metric.weights,
+                                   max_stretch, max_overlap)
+
+    def _unpack_via(self, source, target, meet, dist_f, dist_b, metric, unpacked=None):
+        """
+        Original edge ids of the path source -up-> meet -down-> target.
+        `unpacked` memoizes expanded arcs across calls sharing one metric.
+        """
+        hops = []
+        node = meet
+        while node != source:
+            a = self._incoming_arc(node, dist_f, metric.up)
+            hops.append((a, True))
+            node = self._arc_low[a]
+        hops.reverse()
+        node = meet
+        while node != target:
+            a = self._incoming_arc(node, dist_b, metric.down)
+            hops.append((a, False))
+            node = self._arc_low[a]
+
+        edges = []
+        for hop in hops:
+            if unpacked is None:
+                self._unpack(*hop, metric, edges)
+                continue
+            part = unpacked.get(hop)
+            if part is None:
+                part = unpacked[hop] = []
+                self._unpack(*hop, metric, part)
+            edges.extend(part)
+        return edges
+
+    def _incoming_arc(self, node, dist, arc_weights):
+        """Finds the arc from below that realised dist[node] in an upward search."""
+        arcs = self.in_arcs[self._in_start[node]:self._in_start[node + 1]]
+        via = dist[self.arc_low[arcs]] + arc_weights[arcs]
+        return int(arcs[np.flatnonzero(via == dist[node])[0]])
+
+    def _unpack(self, arc, going_up, metric, out):
+        """Expands one (possibly shortcut) arc into original edge ids, in travel order."""
+        up, down, weights = metric.up, metric.down, metric.weights
+        stack = [(arc, going_up)]
+        while stack:
+            a, upward = stack.pop()
+            target_w = up[a] if upward else down[a]
+            low, high = self._arc_low[a], self._arc_high[a]
+            src = low if upward else high
+
+            found = False
+            for k in range(self._base_start[a], self._base_start[a + 1]):
+                e = self._base_edge_by_arc[k]
+                if self.graph.edge_from[e] == src and weights[e] == target_w:
+                    out.append(e)
+                    found = True
+                    break
+            if found:
+                continue
+
+            first = self._tri_first[a]
+            for k in range(first, first + self._tri_count[a]):
+                xu, xv = self._tri_xu[k], self._tri_xv[k]
+                if upward and down[xu] + up[xv] == target_w:
+                    # low -> x -> high; push in reverse so low -> x pops first
+                    stack.append((xv, True))
+                    stack.append((xu, False))
+                    break
+                if not upward and down[xv] + up[xu] == target_w:
+                    stack.append((xu, True))
+                    stack.append((xv, False))
+                    break
+
+
+class CCHCustomizer:
+    """
+    Owns the background customization thread.
+
+    `snapshot_fn()` must return an immutable (version, weights) pair, e.g.
+    from the graph's current WeightSnapshot. Call `request()` after any
+    weight change;
+    `current(version)` returns the metric only if it matches `version`,
+    so callers fall back to plain search while customization is running.
+    """
+
+    def __init__(self, cch, snapshot_fn, logger=None):
+        self.cch = cch
+        self.snapshot_fn = snapshot_fn
+        self.logger = logger
+        self.metric = None
+        self.last_customize_ms = 0.0
+        self._wake = threading.Event()
+        self._customized = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self.request()
+        return self
+
+    def request(self):
+        self._wake.set()
+
+    def current(self, version):
+        metric = self.metric
+        if metric is not None and metric.version == version:
+            return metric
+        return None
+
+    def wait(self, version, timeout=None):
+        """Blocks until a metric for `version` (or a newer one) is ready. Returns current(version)."""
+        with self._customized:
+            self._customized.wait_for(lambda: self.metric is not None and self.metric.version >= version, timeout)
+        return self.current(version)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                version, weights = self.snapshot_fn()
+                start_t = time.time()
+                metric = self.cch.customize(weights, version)
+                self.last_customize_ms = (time.time() - start_t) * 1000
+                with self._customized:
+                    self.metric = metric
+                    self._customized.notify_all()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"CCH: Customization failed: {e}")
@@ -0,0 +1,147 @@
+"""
+dashboard_stream.py
+Server-sent-events fan-out for the admin dashboard.
+
+The broadcaster keeps the last published dashboard state, computes deltas
+once per update (not once per client) and pushes pre-encoded SSE frames
+into a bounded queue per connected dashboard.
+"""
+import json
+import queue
+import threading
+
+STREAM_CLOSED = None # Queued last for a client whose stream must end
+
+
+def sse_frame(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def close_client(q, final_frame=None):
+    """Ends a client's stream: drops the frames it has not read, queues `final_frame` if given, then STREAM_CLOSED."""
+    with q.mutex:
+        q.queue.clear()
+    if final_frame is not None:
+        q.put_nowait(final_frame)
+    q.put_nowait(STREAM_CLOSED)
+
+
+class DashboardBroadcaster:
+    """
+    Holds signal, heatmap and incident state and emits delta events:
+      signals   {"add": [...], "update": [[id, state]], "remove": [id]}
+      heatmap   {"generation": g}
+      incidents {"add": [...], "remove": [edge_id]}
+      history   {"kind": "reported" | "resolved", "ts": t}
+      log       {"lines": [...]}
+      latency   {"traci_latency_ms": x}
+    """
+
+    def __init__(self, client_queue_size=256):
+        self.client_queue_size = client_queue_size
+        self._lock = threading.Lock()
+        self._clients = []
+        self._signals = {} # id -> {"id", "lat", "lon", "state"}
+        self._heat_generation = 0
+        self._incidents = {} # edge_id -> {"edge_id", "lat", "lon"}
+        self._latency_ms = 0.0
+        self.frames_sent = 0
+        self.clients_dropped = 0
+
+    # --- CLIENTS ---
+    def subscribe(self, extra_state_fn=None):
+        """
+        Registers a client. Returns (queue, snapshot frame). The snapshot is
+        taken under the same lock as registration, so no delta is missed.
+        """
+        q = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            snapshot = {
+                "signals": list(self._signals.values()),
+                "heatmap_generation": self._heat_generation,
+                "incidents": list(self._incidents.values()),
+                "traci_latency_ms": self._latency_ms
+            }
+            if extra_state_fn is not None:
+                snapshot.update(extra_state_fn())
+            self._clients.append(q)
+        return q, sse_frame("snapshot", snapshot)
+
+    def unsubscribe(self, q):
+        with self._lock:
+            if q in self._clients:
+                self._clients.remove(q)
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def _emit(self, event, data):
+        """Encodes once and fans out. Caller holds self._lock."""
+        if not self._clients:
+            return
+        frame = sse_frame(event, data)
+        for q in list(self._clients):
+            try:
+                q.put_nowait(frame)
+                self.frames_sent += 1
+            except queue.Full:
+                # Slow client: end its stream; EventSource reconnects and gets a fresh snapshot
+                self._clients.remove(q)
+                close_client(q)
+                self.clients_dropped += 1
+
+    # --- STATE UPDATES ---
+    def update_signals(self, signal_states):
+        with self._lock:
+            seen = set()
+            added, updated = [], []
+            for s in signal_states:
+                seen.add(s["id"])
+                old = self._signals.get(s["id"])
+                if old is None:
+                    added.append(s)
+                elif old["state"] != s["state"]:
+                    updated.append([s["id"], s["state"]])
+                self._signals[s["id"]] = s
+            removed = [sid for sid in self._signals if sid not in seen]
+            for sid in removed:
+                del self._signals[sid]
+            if added or updated or removed:
+                self._emit("signals", {"add": added, "update": updated, "remove": removed})
+
+    def update_heatmap(self, generation):
+        """The heatmap itself is served as tiles (/admin/heatmap); this only tells clients to revalidate."""
+        with self._lock:
+            if generation != self._heat_generation:
+                self._heat_generation = generation
+                self._emit("heatmap", {"generation": generation})
+
+    def update_incidents(self, incidents):
+        with self._lock:
+            current = {i["edge_id"]: i for i in incidents}
+            added = [i for eid, i in current.items() if eid not in self._incidents]
+            removed = [eid for eid in self._incidents if eid not in current]
+            self._incidents = current
+            if added or removed:
+                self._emit("incidents", {"add": added, "remove": removed})
+
+    def add_history(self, kind, ts):
+        with self._lock:
+            self._emit("history", {"kind": kind, "ts": ts})
+
+    def add_logs(self, lines):
+        with self._lock:
+            self._emit("log", {"lines": lines})
+
+    def add_latency(self, latency_ms):
+        with self._lock:
+            self._latency_ms = latency_ms
+            self._emit("latency", {"traci_latency_ms": latency_ms})
+
+    def stats(self):
+        return {
+            "clients": len(self._clients),
+            "frames_sent": self.frames_sent,
+            "clients_dropped": self.clients_dropped
+        }
@@ -0,0 +1,128 @@
+"""
+engine.py
+Runs the live-traffic engine as its own process. It owns SUMO/TraCI and
+publishes travel times, incidents, signal states and heatmap data to
+shared memory (shared_state.py); web workers serve HTTP from there.
+
+    export PATHSYNC_ENGINE_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(16))")
+    python engine.py                 # SUMO/TraCI engine
+    python engine.py --standin       # synthetic traffic, no SUMO needed
+    PATHSYNC_ROLE=web gunicorn -w 4 -b 0.0.0.0:5000 app:app
+
+Run both from backend/, like app.py, with the same PATHSYNC_ENGINE_AUTHKEY.
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+from sim_scheduler import HIGH, LOW, RateLimiter, SimScheduler
+
+
+class StandInEngine:
+    """
+    Local stand-in for the SUMO engine, for testing web workers without
+    SUMO: congestion waves sweep across the map, a few edges jam now and
+    then, and fake signals at busy junctions cycle green/yellow/red.
+    It publishes through the same functions the TraCI loop uses.
+    """
+
+    def __init__(self, backend, step_s=1.0, speedup=10.0, wave_period_s=600.0, jam_probability=0.02,
+                 num_signals=50, seed=0):
+        self.backend = backend
+        self.step_s = step_s
+        self.speedup = speedup
+        self.wave_period_s = wave_period_s
+        self.jam_probability = jam_probability
+        self.rng = np.random.default_rng(seed)
+        self.scheduler = SimScheduler(backend.TICK_BUDGET_S)
+        self.scheduler.add("heartbeat", self.heartbeat, backend.HEARTBEAT_INTERVAL_S,
+                           backend.TASK_BUDGET_MS["weight_sync"] / 1000, HIGH)
+        self.scheduler.add("signals", self.publish_signals, backend.SIGNAL_INTERVAL_S,
+                           backend.TASK_BUDGET_MS["signals"] / 1000, LOW)
+
+        G = backend.G
+        mid_x = (G.x[G.edge_from] + G.x[G.edge_to]) / 2
+        span = max(float(np.ptp(mid_x)), 1.0)
+        self.phase = (mid_x - mid_x.min()) / span * 2 * math.pi # Waves travel west -> east
+        self.normal_edges = np.array(
+            [e for e, edge_id in enumerate(G.edge_ids) if not edge_id.startswith(":") and "#" not in edge_id],
+            dtype=np.int64
+        )
+
+        # Fake signals at the junctions with the most incoming edges
+        in_degree = np.diff(G.in_start)
+        junctions = np.argsort(-in_degree, kind="stable")[:num_signals]
+        self.signals = [
+            (f"standin_{G.node_ids[n]}", float(G.lat[n]), float(G.lon[n]), float(self.rng.uniform(0, 60)))
+            for n in junctions.tolist() if in_degree[n] >= 3
+        ]
+
+    def signal_state(self, sim_time, offset):
+        t = (sim_time + offset) % 60
+        return "green" if t < 25 else "yellow" if t < 30 else "red"
+
+    def publish_signals(self, sim_time, dt):
+        self.backend.publish_signal_states([
+            {"id": tl_id, "lat": lat, "lon": lon, "state": self.signal_state(sim_time, offset)}
+            for tl_id, lat, lon, offset in self.signals
+        ])
+
+    def heartbeat(self, sim_time, dt):
+        backend = self.backend
+        G = backend.G
+        wave = np.maximum(np.sin(2 * math.pi * sim_time / self.wave_period_s - self.phase), 0.0)
+        noise = self.rng.uniform(0.9, 1.1, G.edge_count)
+        measured_time = G.original_travel_time * (1 + 2.0 * wave) * noise
+        auto_incidents = []
+        if len(self.normal_edges) and self.rng.random() < self.jam_probability:
+            e = int(self.rng.choice(self.normal_edges))
+            if not G.snapshot.is_incident[e]:
+                auto_incidents.append(e)
+                backend.incident_log.info(f"--- STAND-IN: Simulated jam on edge {G.edge_ids[e]}. ---")
+        snap = backend.publish_heartbeat(sim_time, measured_time, auto_incidents)
+        live_edges = np.flatnonzero(~snap.is_incident)
+        backend.publish_heatmap(live_edges, measured_time[live_edges] / (G.original_travel_time[live_edges] + 0.001))
+        backend.engine_log.info(f"Stand-in Engine: Heartbeat. Sim Time: {sim_time}s.")
+
+    def step(self, sim_time):
+        self.scheduler.run_due(sim_time)
+
+    def run(self, end_time=3600.0):
+        self.backend.sumo_ready.set()
+        self.backend.engine_log.info(f"Stand-in Engine: Running with {len(self.signals)} fake signals at {self.speedup}x.")
+        self.backend.g_scheduler = self.scheduler
+        limiter = RateLimiter(self.speedup)
+        sim_time = 0.0
+        while sim_time <= end_time:
+            start_t = time.perf_counter()
+            sim_time += self.step_s
+            self.step(sim_time)
+            self.backend.g_traci_latency_ms = (time.perf_counter() - start_t) * 1000
+            limiter.wait(sim_time)
+        self.backend.engine_log.info("Stand-in Engine: Reached end time.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pathsync live-traffic engine process")
+    parser.add_argument("--standin", action="store_true", help="publish synthetic traffic instead of running SUMO")
+    parser.add_argument("--speedup", type=float, default=10.0, help="stand-in: simulated seconds per real second")
+    parser.add_argument("--seed", type=int, default=0, help="stand-in: random seed")
+    args = parser.parse_args()
+
+    os.environ["PATHSYNC_ROLE"] = "standin" if args.standin else "engine"
+    import app as backend # Loads the graph and, for the SUMO engine, starts the TraCI thread
+
+    if args.standin:
+        StandInEngine(backend, speedup=args.speedup, seed=args.seed).run()
+    else:
+        backend.ai_thread.join()
+    # Keep the last state and the RPC channel up for the web workers until stopped
+    while True:
+        time.sleep(60)
+
+
+if __name__ == "__main__":
+    main()
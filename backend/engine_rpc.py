@@ -0,0 +1,142 @@
+"""
+engine_rpc.py
+Small request/response channel from web workers to the engine process,
+for the few writes that must go through the engine (incident report,
+unblock) and for history/log tails. Built on multiprocessing.connection.
+"""
+import os
+import socket
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+
+class EngineRPCError(Exception):
+    pass
+
+
+class EngineRPCServer:
+    """
+    Accepts worker connections and answers (command, kwargs) messages with
+    ("ok", result) or ("error", message). `handlers` maps command -> callable.
+    Each connection authenticates in its own thread, and is cut off if that
+    takes longer than `handshake_timeout_s`, so a stalled connector does
+    not hold up the others.
+    """
+
+    def __init__(self, address, authkey, handlers, logger=None, handshake_timeout_s=5.0):
+        self.address = address
+        self.authkey = authkey
+        self.handlers = handlers
+        self.logger = logger
+        self.handshake_timeout_s = handshake_timeout_s
+        self._listener = None
+
+    def start(self):
+        self._listener = Listener(self.address) # No authkey: accept() would run the handshake inline
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning(f"Engine RPC: accept failed: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _handshake(self, conn):
+        """Authenticates both ways, like Listener(authkey=...); a peer that stalls gets its socket shut down."""
+        sock = socket.socket(fileno=os.dup(conn.fileno()))
+
+        def cut_off():
+            try:
+                sock.shutdown(socket.SHUT_RDWR) # Wakes the blocked read below with EOF
+            except OSError:
+                pass
+
+        timer = threading.Timer(self.handshake_timeout_s, cut_off)
+        timer.start()
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+        finally:
+            timer.cancel()
+            sock.close()
+
+    def _serve(self, conn):
+        with conn:
+            try:
+                self._handshake(conn)
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning(f"Engine RPC: rejected connection: {e or type(e).__name__}")
+                return
+            while True:
+                try:
+                    command, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                handler = self.handlers.get(command)
+                try:
+                    if handler is None:
+                        raise EngineRPCError(f"Unknown engine command: {command}")
+                    conn.send(("ok", handler(**kwargs)))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+
+
+class EngineRPCClient:
+    """
+    A small pool of connections per worker: each call takes an idle one or
+    opens another, so a slow call does not hold up the worker's other
+    request threads. Up to `max_idle` connections are kept for reuse. A
+    failure to connect or send is retried once on a new connection; a
+    failure after the request went out is not, since the engine may
+    already have run it.
+    """
+
+    def __init__(self, address, authkey, max_idle=4):
+        self.address = address
+        self.authkey = authkey
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def call(self, command, **kwargs):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        for attempt in (0, 1):
+            try:
+                if conn is None:
+                    conn = Client(self.address, authkey=self.authkey)
+                conn.send((command, kwargs))
+                break
+            except (EOFError, OSError, ConnectionError, AuthenticationError):
+                self._close(conn)
+                conn = None
+                if attempt:
+                    raise EngineRPCError("Engine process is not reachable")
+        try:
+            status, result = conn.recv()
+        except (EOFError, OSError, ConnectionError):
+            self._close(conn)
+            raise EngineRPCError(f"Engine connection lost before it answered '{command}' (it may have run)")
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                conn = None
+        self._close(conn)
+        if status != "ok":
+            raise EngineRPCError(result)
+        return result
+
+    @staticmethod
+    def _close(conn):
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
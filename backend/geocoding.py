@@ -0,0 +1,186 @@
+"""
+geocoding.py
+Offline gazetteer and a persistent LRU/TTL cache that sit in front of
+the Nominatim geocoder used by parse_or_geocode.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def normalize_place_name(name):
+    """Lower-cases, drops the ', Mysuru, ...' suffix and collapses whitespace."""
+    name = name.strip().lower()
+    name = re.split(r",\s*(mysuru|mysore)\b", name)[0]
+    return re.sub(r"\s+", " ", name).strip(" ,")
+
+
+class GeocodeCache:
+    """
+    Bounded LRU cache with a per-entry TTL, persisted to a JSON file.
+    Values are (lat, lon) tuples, or None for "geocoder found nothing".
+    With persist=False the file is only loaded, never written (for
+    processes that share it with the one that owns it).
+    """
+
+    def __init__(self, path=None, max_entries=5000, ttl_seconds=7 * 24 * 3600, save_every=20, persist=True):
+        self.path = path
+        self.persist = persist
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.save_every = save_every
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock() # One save() at a time; held while writing, unlike _lock
+        self._dirty_writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < now:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def contains(self, key):
+        """Like get() but tells a cached None apart from a miss. Returns (found, value)."""
+        value = self.get(key, _MISSING)
+        return (value is not _MISSING), (None if value is _MISSING else value)
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty_writes += 1
+            should_save = self.path and self.persist and self._dirty_writes >= self.save_every
+        if should_save:
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        now = time.time()
+        with self._lock:
+            for key, expires_at, value in rows:
+                if expires_at >= now:
+                    self._entries[key] = (expires_at, tuple(value) if value else None)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return len(self._entries)
+
+    def save(self):
+        """Writes the cache atomically (a temp file of its own + rename)."""
+        if not self.path or not self.persist:
+            return
+        with self._save_lock:
+            with self._lock:
+                rows = [[key, expires_at, value] for key, (expires_at, value) in self._entries.items()]
+                self._dirty_writes = 0
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(rows, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0
+        }
+
+
+class Gazetteer:
+    """
+    Offline place-name lookup. Names come from the SUMO net (street names,
+    placed at the centroid of all edges that carry the name) and from an
+    optional local JSON file of {"name": [lat, lon]}.
+    """
+
+    def __init__(self):
+        self._sums = {} # normalized name -> [lat_sum, lon_sum, count]
+        self._places = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._places.keys() | self._sums.keys())
+
+    def add_street(self, name, lat, lon):
+        key = normalize_place_name(name)
+        if not key:
+            return
+        acc = self._sums.setdefault(key, [0.0, 0.0, 0])
+        acc[0] += float(lat)
+        acc[1] += float(lon)
+        acc[2] += 1
+
+    def add_place(self, name, lat, lon):
+        key = normalize_place_name(name)
+        if key:
+            self._places[key] = (float(lat), float(lon))
+
+    def load_file(self, path):
+        """Loads {"name": [lat, lon]} entries. Returns how many were added."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for name, (lat, lon) in data.items():
+            self.add_place(name, lat, lon)
+        return len(data)
+
+    def lookup(self, name):
+        key = normalize_place_name(name)
+        place = self._places.get(key)
+        if place is None and key in self._sums:
+            lat_sum, lon_sum, count = self._sums[key]
+            place = (lat_sum / count, lon_sum / count)
+        if place is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return place
+
+    def stats(self):
+        return {"names": len(self), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,171 @@
+"""
+heatmap_tiles.py
+Multi-resolution congestion heatmap over the net's lon/lat extent.
+"""
+import secrets
+from collections import namedtuple
+
+import numpy as np
+
+# Per-level state published by update(); replaced as a whole, never mutated
+HeatLevel = namedtuple("HeatLevel", ["intensity", "weight", "cell_gen"])
+
+
+class HeatmapPyramid:
+    """
+    Grid pyramid over the network extent. Level z has (base_cells * 2**z)^2
+    cells. Each edge is binned once (at its midpoint) into the finest level;
+    coarser levels are 2x2 block sums of the level below.
+
+    Cell intensity is the length-weighted mean of (live travel time /
+    original travel time) over the cell's live edges, rounded to
+    `resolution`. Every cell carries the generation in which its rounded
+    value last changed, so a bbox's ETag only changes when one of its
+    cells does. Generations only mean something within one `epoch` (a
+    random id per pyramid, or the engine's in a web worker), which the
+    ETag carries too, so tags from other processes or runs never match.
+    """
+
+    def __init__(self, lat, lon, edge_from, edge_to, edge_length, base_cells=8, levels=6, resolution=0.01):
+        self.levels = levels
+        self.base_cells = base_cells
+        self.resolution = resolution
+        self.epoch = secrets.token_hex(4)
+        self.generation = 0
+        self.last_changed = 0 # Generation of the most recent change at any level
+        fine = base_cells * 2 ** (levels - 1)
+
+        mid_lat = (lat[edge_from] + lat[edge_to]) / 2
+        mid_lon = (lon[edge_from] + lon[edge_to]) / 2
+        self.min_lat, self.min_lon = float(lat.min()), float(lon.min())
+        # Pad so the max coordinate still falls inside the last cell
+        self.span_lat = max(float(lat.max()) - self.min_lat, 1e-9) * (1 + 1e-9)
+        self.span_lon = max(float(lon.max()) - self.min_lon, 1e-9) * (1 + 1e-9)
+
+        rows = ((mid_lat - self.min_lat) / self.span_lat * fine).astype(np.int64).clip(0, fine - 1)
+        cols = ((mid_lon - self.min_lon) / self.span_lon * fine).astype(np.int64).clip(0, fine - 1)
+        self._fine_cell = rows * fine + cols
+        self._edge_weight = np.maximum(np.asarray(edge_length, dtype=np.float64), 1.0)
+
+        # Static length-weighted centroid of each cell, used as the point position
+        w = np.bincount(self._fine_cell, weights=self._edge_weight, minlength=fine * fine).reshape(fine, fine)
+        wlat = np.bincount(self._fine_cell, weights=self._edge_weight * mid_lat, minlength=fine * fine).reshape(fine, fine)
+        wlon = np.bincount(self._fine_cell, weights=self._edge_weight * mid_lon, minlength=fine * fine).reshape(fine, fine)
+        self._centroid = []
+        for sums in self._pyramid_sums(w, wlat, wlon):
+            cw, clat, clon = sums
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self._centroid.append((clat / cw, clon / cw))
+
+        self._state = [
+            HeatLevel(np.zeros((self.cells(z),) * 2), np.zeros((self.cells(z),) * 2), np.zeros((self.cells(z),) * 2, dtype=np.int64))
+            for z in range(levels)
+        ]
+
+    def cells(self, z):
+        return self.base_cells * 2 ** z
+
+    def _pyramid_sums(self, *fine_grids):
+        """Yields, coarsest first, the tuple of grids block-summed down to each level."""
+        grids = list(fine_grids)
+        out = [tuple(grids)]
+        for _ in range(self.levels - 1):
+            grids = [g.reshape(g.shape[0] // 2, 2, g.shape[1] // 2, 2).sum(axis=(1, 3)) for g in grids]
+            out.append(tuple(grids))
+        out.reverse()
+        return out
+
+    def set_epoch(self, epoch=None):
+        """
+        Numbers later updates in another writer's epoch (a web worker following
+        the engine's heat_seq), or in a fresh random one if None. Cell
+        generations restart at 0, so the first change in the new epoch is
+        newer than every cell.
+        """
+        epoch = epoch or secrets.token_hex(4)
+        if epoch == self.epoch:
+            return
+        self._state = [HeatLevel(s.intensity, s.weight, np.zeros_like(s.cell_gen)) for s in self._state]
+        self.generation = self.last_changed = 0
+        self.epoch = epoch
+
+    def update(self, edge_idx, intensity, generation=None):
+        """
+        Re-aggregates all levels from the live edges' intensities. Called by the
+        writer thread only. `generation` (increasing within the epoch) replaces
+        the local counter, e.g. with the engine's heat_seq.
+        """
+        fine = self.cells(self.levels - 1)
+        edge_idx = np.asarray(edge_idx, dtype=np.int64)
+        cells = self._fine_cell[edge_idx]
+        w = self._edge_weight[edge_idx]
+        weight = np.bincount(cells, weights=w, minlength=fine * fine).reshape(fine, fine)
+        total = np.bincount(cells, weights=w * intensity, minlength=fine * fine).reshape(fine, fine)
+
+        self.generation = self.generation + 1 if generation is None else generation
+        new_state = []
+        for z, (lvl_weight, lvl_total) in enumerate(self._pyramid_sums(weight, total)):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                value = np.where(lvl_weight > 0, lvl_total / lvl_weight, 0.0)
+            value = np.round(value / self.resolution) * self.resolution
+            old = self._state[z]
+            changed = (value != old.intensity) | ((lvl_weight > 0) != (old.weight > 0))
+            cell_gen = np.where(changed, self.generation, old.cell_gen)
+            if changed.any():
+                self.last_changed = self.generation
+            new_state.append(HeatLevel(value, lvl_weight, cell_gen))
+        self._state = new_state # Single reference swap; readers see old or new levels
+
+    def _cell_range(self, z, bbox):
+        n = self.cells(z)
+        if bbox is None:
+            return 0, n, 0, n
+        min_lon, min_lat, max_lon, max_lat = bbox
+        r0 = int(np.floor((min_lat - self.min_lat) / self.span_lat * n))
+        r1 = int(np.floor((max_lat - self.min_lat) / self.span_lat * n)) + 1
+        c0 = int(np.floor((min_lon - self.min_lon) / self.span_lon * n))
+        c1 = int(np.floor((max_lon - self.min_lon) / self.span_lon * n)) + 1
+        return max(r0, 0), min(max(r1, 0), n), max(c0, 0), min(max(c1, 0), n)
+
+    def etag(self, z, bbox=None):
+        """Tag for (level, visible cells, last change among them); cheap to compute."""
+        r0, r1, c0, c1 = self._cell_range(z, bbox)
+        block = self._state[z].cell_gen[r0:r1, c0:c1]
+        last = int(block.max()) if block.size else 0
+        return f"heat-{self.epoch}-{z}-{r0}-{r1}-{c0}-{c1}-{last}"
+
+    def query(self, z, bbox=None):
+        """Returns [[lat, lon, intensity], ...] for the non-empty cells of level z inside bbox."""
+        state = self._state[z]
+        r0, r1, c0, c1 = self._cell_range(z, bbox)
+        weight = state.weight[r0:r1, c0:c1]
+        rows, cols = np.nonzero(weight > 0)
+        rows += r0
+        cols += c0
+        clat, clon = self._centroid[z]
+        return np.column_stack((clat[rows, cols], clon[rows, cols], state.intensity[rows, cols])).tolist()
+
+    def cell_table(self, z):
+        """
+        Static (lat, lon) arrays of every cell of level z that has edges, in
+        row-major order. Cell numbers in query_indexed() index into them.
+        """
+        clat, clon = self._centroid[z]
+        has_edges = ~np.isnan(clat)
+        return clat[has_edges], clon[has_edges]
+
+    def query_indexed(self, z):
+        """Returns (cell numbers into cell_table(z), intensities) for the non-empty cells of level z."""
+        state = self._state[z]
+        has_edges = ~np.isnan(self._centroid[z][0])
+        number = np.cumsum(has_edges.ravel()) - 1 # Row-major rank among the cells with edges
+        live = (state.weight > 0).ravel()
+        return number[live], state.intensity.ravel()[live]
+
+    def cell_size(self, z):
+        """(lat, lon) size of one cell at level z, in degrees."""
+        n = self.cells(z)
+        return self.span_lat / n, self.span_lon / n
+
+    def extent(self):
+        return [self.min_lon, self.min_lat, self.min_lon + self.span_lon, self.min_lat + self.span_lat]
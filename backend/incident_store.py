@@ -0,0 +1,173 @@
+"""
+incident_store.py
+Durable incident log in SQLite (WAL mode). Request threads only enqueue
+events; one writer thread commits them in groups, so nobody on the
+request path waits for an fsync. An `active` table is kept next to the
+append-only `events` table, so startup replays the current incidents
+without scanning the whole history.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# Event kinds. "reported" and "resolved" are the ones counted in the
+# dashboard histories; "auto" is a detector jam, "cleared" any other
+# edge cleared by an unblock (e.g. the inverse edge).
+INCIDENT_KINDS = ("reported", "auto")
+CLEAR_KINDS = ("resolved", "cleared")
+
+IncidentEvent = namedtuple("IncidentEvent", ["ts", "kind", "edge_id", "lat", "lon", "incident_type", "source"])
+ActiveIncident = namedtuple("ActiveIncident", ["edge_id", "lat", "lon", "incident_type", "source", "ts"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    edge_id TEXT NOT NULL,
+    lat REAL,
+    lon REAL,
+    incident_type TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS events_kind ON events (kind, id);
+CREATE TABLE IF NOT EXISTS active (
+    edge_id TEXT PRIMARY KEY,
+    lat REAL,
+    lon REAL,
+    incident_type TEXT,
+    source TEXT,
+    ts REAL NOT NULL
+);
+"""
+
+
+class IncidentStore:
+    """
+    Append-only incident event log with group commit.
+
+    record() never blocks on disk: events go to a queue, and the writer
+    thread commits everything that arrived within `commit_interval_s` of
+    the first pending event (up to `max_batch`) in one transaction.
+    """
+
+    def __init__(self, path, commit_interval_s=0.05, max_batch=1000, logger=None):
+        self.path = path
+        self.commit_interval_s = commit_interval_s
+        self.max_batch = max_batch
+        self.logger = logger
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL") # Cheap with group commit: one fsync per batch
+        self._conn.executescript(SCHEMA)
+        self._queue = queue.Queue()
+        self._closed = False
+        self.committed = 0
+        self.batches = 0
+        self.last_commit_ms = 0.0
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    # --- WRITES (any thread) ---
+    def record(self, kind, edge_id, lat=None, lon=None, incident_type=None, source=None, ts=None):
+        self._queue.put(IncidentEvent(time.time() if ts is None else ts, kind, edge_id, lat, lon, incident_type, source))
+
+    def flush(self, timeout=5.0):
+        """Waits until everything recorded so far is committed."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout=5.0)
+        self._conn.close()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, waiters = [], []
+            deadline = time.monotonic() + self.commit_interval_s
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    if self._queue.empty():
+                        break # A flush is waiting; don't hold it for the interval
+                elif item is None:
+                    self._queue.put(None) # Stop after this batch
+                    break
+                else:
+                    batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Incident store: Could not commit {len(batch)} event(s): {e}")
+            for done in waiters:
+                done.set()
+
+    def _commit(self, batch):
+        start_t = time.perf_counter()
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO events (ts, kind, edge_id, lat, lon, incident_type, source) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            for ev in batch:
+                if ev.kind in INCIDENT_KINDS:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO active (edge_id, lat, lon, incident_type, source, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                        (ev.edge_id, ev.lat, ev.lon, ev.incident_type, ev.source, ev.ts)
+                    )
+                else:
+                    conn.execute("DELETE FROM active WHERE edge_id = ?", (ev.edge_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.committed += len(batch)
+        self.batches += 1
+        self.last_commit_ms = (time.perf_counter() - start_t) * 1000
+
+    # --- REPLAY (startup, before any writes) ---
+    def active(self):
+        """Incidents that were still active when the log was last written."""
+        rows = self._conn.execute("SELECT edge_id, lat, lon, incident_type, source, ts FROM active").fetchall()
+        return [ActiveIncident(*row) for row in rows]
+
+    def history(self, kind, limit):
+        """Timestamps of the newest `limit` events of `kind`, oldest first."""
+        rows = self._conn.execute(
+            "SELECT ts FROM events WHERE kind = ? ORDER BY id DESC LIMIT ?", (kind, limit)
+        ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "committed": self.committed,
+            "batches": self.batches,
+            "pending": self._queue.qsize(),
+            "last_commit_ms": round(self.last_commit_ms, 2)
+        }
@@ -0,0 +1,66 @@
+"""
+jam_detector.py
+Per-edge congestion state in arrays aligned with the routing graph's edge
+indices, and the automatic incident detector ("AI 2") run on it with
+whole-array operations each heartbeat.
+"""
+import numpy as np
+
+
+def inverse_edge_id(edge_id):
+    """SUMO id of the opposite-direction edge ("-123" <-> "123")."""
+    return edge_id[1:] if edge_id.startswith("-") else "-" + edge_id
+
+
+class JamDetector:
+    """
+    Flags an edge (and its inverse) as an incident once more than
+    `halt_threshold` vehicles have been halting on it for `jam_seconds` of
+    consecutive heartbeats. Only normal edges are checked: internal
+    junction edges (":...") and split edges ("...#n") are not.
+    """
+
+    def __init__(self, edge_ids, edge_id_to_idx, halt_threshold=5, jam_seconds=10.0):
+        self.halt_threshold = halt_threshold
+        self.jam_seconds = jam_seconds
+        m = len(edge_ids)
+        self.normal = np.array([not e.startswith(":") and "#" not in e for e in edge_ids], dtype=bool)
+        self.inverse = np.array([edge_id_to_idx.get(inverse_edge_id(e), -1) for e in edge_ids], dtype=np.int64)
+        # Latest readings and jam accumulators, indexed like the graph's edges
+        self.halting = np.zeros(m, dtype=np.int32)
+        self.travel_time = np.full(m, np.nan)
+        self.jam_time = np.zeros(m)
+
+    def update(self, idx, halting, travel_time, is_incident, dt):
+        """
+        Takes one sweep of readings for edges `idx` and `dt` simulated seconds
+        since the last one. Edges already flagged in `is_incident` are skipped.
+        Returns (measured_time, auto_incidents, fired): per-edge travel times
+        (NaN = no reading or newly flagged), the edges to flag (detections plus
+        their inverses) and the detected edges alone.
+        """
+        self.halting[idx] = halting
+        self.travel_time[idx] = travel_time
+        open_ = ~is_incident[idx]
+        idx, halting, travel_time = idx[open_], halting[open_], travel_time[open_]
+
+        jammed = self.normal[idx] & (halting > self.halt_threshold)
+        jam_time = np.where(jammed, self.jam_time[idx] + dt, 0.0)
+        fired_mask = jam_time >= self.jam_seconds
+        jam_time[fired_mask] = 0.0 # Starts over if the edge is unblocked later
+        self.jam_time[idx] = jam_time
+
+        fired = idx[fired_mask]
+        inverse = self.inverse[fired]
+        auto_incidents = np.unique(np.concatenate((fired, inverse[inverse >= 0])))
+        measured_time = np.full(len(self.normal), np.nan)
+        measured_time[idx[~fired_mask]] = travel_time[~fired_mask]
+        return measured_time, auto_incidents, fired
+
+    def stats(self):
+        return {
+            "halt_threshold": self.halt_threshold,
+            "jam_seconds": self.jam_seconds,
+            "jam_candidates": int(np.count_nonzero(self.jam_time)),
+            "halting_vehicles": int(self.halting.sum())
+        }
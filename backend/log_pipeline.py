@@ -0,0 +1,192 @@
+"""
+log_pipeline.py
+Moves log formatting off the threads that log. QueueLogHandler only puts
+the LogRecord on a queue.SimpleQueue (no handler lock, nothing formatted),
+so the heartbeat can log while it holds g_lock. One consumer thread
+formats records in batches into structured entries and appends them to a
+LogRing, where every entry has a sequence number that doubles as the
+cursor for incremental reads.
+
+Records are formatted later than they were logged, so log f-strings (as
+this codebase does), not %-args that point at objects that may change.
+"""
+import itertools
+import logging
+import queue
+import threading
+from collections import deque
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+def component_of(record):
+    """`extra={"component": ...}` if given, else the logger name below the app logger ("app.engine" -> "engine")."""
+    component = getattr(record, "component", None)
+    if component:
+        return component
+    return record.name.split(".", 1)[1] if "." in record.name else record.name
+
+
+class LogRing:
+    """
+    The newest `capacity` log entries. Entry seq numbers start at 1 and never
+    repeat; a cursor is the last seq a reader has seen (0 for none), so
+    len() is the cursor for "everything so far".
+    """
+
+    def __init__(self, capacity=5000):
+        self.capacity = capacity
+        self._entries = deque(maxlen=capacity)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._total
+
+    def extend(self, entries):
+        """
+        Appends entries that already carry seq numbers (e.g. the engine's, in a
+        web worker). Entries at or below the last seq are skipped, so keep such
+        a ring for one source and never append_records() to it.
+        """
+        with self._lock:
+            for entry in entries:
+                if entry["seq"] > self._total:
+                    self._entries.append(entry)
+                    self._total = entry["seq"]
+
+    def clear(self):
+        """Forgets every entry and restarts seq numbers at 1 (a web worker following a new engine)."""
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+
+    def append_records(self, records, formatter):
+        """Formats LogRecords into entries, numbers them and appends them. Returns the new entries."""
+        entries = []
+        for record in records:
+            try:
+                line = formatter.format(record)
+            except Exception:
+                line = f"{record.levelname} - unformattable log record: {record.msg!r}"
+            entries.append({
+                "ts": record.created,
+                "level": record.levelname,
+                "levelno": record.levelno,
+                "component": component_of(record),
+                "line": line
+            })
+        with self._lock:
+            for entry in entries:
+                self._total += 1
+                entry["seq"] = self._total
+                self._entries.append(entry)
+        return entries
+
+    def since(self, cursor=None, min_level=None, components=None, limit=None):
+        """
+        Entries after `cursor`, oldest first, or the newest `limit` if cursor is
+        None. min_level (a levelno) and components (a set) filter them. Returns
+        (entries, next_cursor, truncated); truncated is True if entries after
+        the cursor already left the ring. When `limit` cuts a cursor read
+        short, next_cursor is the last entry returned, so nothing is skipped.
+        """
+        with self._lock:
+            total = self._total
+            oldest = total - len(self._entries) + 1 # seq of the first retained entry
+            if cursor is not None and cursor > total:
+                cursor = 0 # A cursor from before a restart: start over
+            if cursor is None:
+                start = 0
+            else:
+                start = min(max(cursor + 1 - oldest, 0), len(self._entries))
+            scanned = list(itertools.islice(self._entries, start, None))
+        truncated = cursor is not None and cursor + 1 < oldest and total > 0
+        if min_level is not None or components:
+            scanned = [
+                e for e in scanned
+                if (min_level is None or e["levelno"] >= min_level)
+                and (not components or e["component"] in components)
+            ]
+        next_cursor = total
+        if limit is not None and len(scanned) > limit:
+            if cursor is None:
+                scanned = scanned[-limit:]
+            else:
+                scanned = scanned[:limit]
+                next_cursor = scanned[-1]["seq"]
+        return scanned, next_cursor, truncated
+
+    def stats(self):
+        return {"total": self._total, "retained": len(self._entries), "capacity": self.capacity}
+
+
+class QueueLogHandler(logging.Handler):
+    """Hands records to a LogPipeline. Skips Handler's per-emit lock: SimpleQueue.put is already thread-safe."""
+
+    def __init__(self, pipeline, level=logging.NOTSET):
+        super().__init__(level)
+        self.pipeline = pipeline
+
+    def handle(self, record):
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        self.pipeline.put(record)
+
+
+class LogPipeline:
+    """
+    queue.SimpleQueue of LogRecords plus one daemon consumer that formats
+    them into `ring`. `on_entries(entries)` is called from the consumer
+    after each batch, e.g. to push the lines to dashboard clients.
+    """
+
+    def __init__(self, ring, formatter, on_entries=None, max_batch=500):
+        self.ring = ring
+        self.formatter = formatter
+        self.on_entries = on_entries
+        self.max_batch = max_batch
+        self.dropped_errors = 0
+        self._queue = queue.SimpleQueue()
+        self._consumer = threading.Thread(target=self._consume_loop, name="log-pipeline", daemon=True)
+        self._consumer.start()
+
+    def handler(self, level=logging.NOTSET):
+        return QueueLogHandler(self, level)
+
+    def put(self, record):
+        self._queue.put(record)
+
+    def backlog(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=1.0):
+        """Waits until every record put so far has been formatted (for shutdown)."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _consume_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            flushes = [item for item in batch if isinstance(item, threading.Event)]
+            records = [item for item in batch if not isinstance(item, threading.Event)] if flushes else batch
+            try:
+                if records:
+                    entries = self.ring.append_records(records, self.formatter)
+                    if self.on_entries is not None:
+                        self.on_entries(entries)
+            except Exception:
+                # Logging about a logging failure would feed this loop
+                self.dropped_errors += 1
+            for done in flushes:
+                done.set()
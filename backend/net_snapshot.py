@@ -0,0 +1,186 @@
+"""
+net_snapshot.py
+Compiled, memory-mappable copy of the routing data extracted from a SUMO
+.net.xml, keyed by a hash of the net file. Lets the backend skip
+sumolib.net.readNet and per-node coordinate conversion on restarts.
+
+Layout: <cache_dir>/<net hash>/
+    meta.json    format version, ids, street names, <location> parameters
+    <name>.npy   one array per GRAPH_ARRAYS / ADJACENCY_ARRAYS / SHAPE_ARRAYS entry
+"""
+import hashlib
+import json
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from routing_graph import ADJACENCY_ARRAYS, GRAPH_ARRAYS, RoutingGraph
+
+FORMAT_VERSION = 2
+
+# Edge shapes for snapping points to roads: the points of edge e are
+# shape_xy[shape_start[e]:shape_start[e + 1]] (network x/y, at least two)
+SHAPE_ARRAYS = ("shape_start", "shape_xy")
+
+
+def net_file_hash(path, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_net_location(path):
+    """Returns the attributes of the net's <location> element (it precedes all edges)."""
+    for _, elem in ET.iterparse(path, events=("start",)):
+        if elem.tag == "location":
+            return dict(elem.attrib)
+        if elem.tag in ("edge", "junction"):
+            break
+    return {}
+
+
+class NetProjection:
+    """
+    The lon/lat <-> net x/y conversion of sumolib.net.Net, rebuilt from the
+    stored <location> element so no full net parse is needed.
+    """
+
+    def __init__(self, location):
+        offset = location.get("netOffset", "0,0").split(",")
+        self.x_off, self.y_off = float(offset[0]), float(offset[1])
+        self.proj_parameter = location.get("projParameter", "!")
+        self._proj = None
+
+    def _geo_proj(self):
+        if self._proj is None:
+            import pyproj # Same dependency sumolib uses for these conversions
+            self._proj = pyproj.Proj(projparams=self.proj_parameter)
+        return self._proj
+
+    def convertLonLat2XY(self, lon, lat):
+        x, y = self._geo_proj()(lon, lat)
+        return x + self.x_off, y + self.y_off
+
+    def convertXY2LonLat(self, x, y):
+        return self._geo_proj()(x - self.x_off, y - self.y_off, inverse=True)
+
+
+class NetSnapshot:
+    """
+    A loaded snapshot: the routing graph, edge shapes, street names and the projection.
+    """
+
+    def __init__(self, graph, shapes, street_names, projection, net_hash, from_cache):
+        self.graph = graph
+        self.shapes = shapes # {name: array} for SHAPE_ARRAYS
+        self.street_names = street_names # [(name, from_idx, to_idx), ...]
+        self.projection = projection
+        self.net_hash = net_hash
+        self.from_cache = from_cache
+
+
+def snapshot_dir(cache_dir, net_hash):
+    return os.path.join(cache_dir, net_hash)
+
+
+def save_snapshot(path, graph, shapes, street_names, location, net_hash):
+    """Writes a snapshot directory atomically (temp dir + rename)."""
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name in GRAPH_ARRAYS + ADJACENCY_ARRAYS:
+        np.save(os.path.join(tmp_path, name + ".npy"), np.ascontiguousarray(getattr(graph, name)))
+    for name in SHAPE_ARRAYS:
+        np.save(os.path.join(tmp_path, name + ".npy"), np.ascontiguousarray(shapes[name]))
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "net_hash": net_hash,
+        "node_ids": graph.node_ids,
+        "edge_ids": graph.edge_ids,
+        "street_names": street_names,
+        "location": location
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, net_hash):
+    """Returns a NetSnapshot with memory-mapped arrays, or None if missing or outdated."""
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != FORMAT_VERSION or meta.get("net_hash") != net_hash:
+            return None
+        arrays = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+            for name in GRAPH_ARRAYS + ADJACENCY_ARRAYS + SHAPE_ARRAYS
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    graph = RoutingGraph.from_arrays(meta["node_ids"], meta["edge_ids"], arrays)
+    shapes = {name: arrays[name] for name in SHAPE_ARRAYS}
+    street_names = [tuple(row) for row in meta["street_names"]]
+    return NetSnapshot(graph, shapes, street_names, NetProjection(meta["location"]), net_hash, from_cache=True)
+
+
+def build_from_net(net):
+    """Builds the routing graph from a parsed sumolib net. Returns (graph, shapes, street_names)."""
+    graph = RoutingGraph()
+    for node in net.getNodes():
+        x, y = node.getCoord()
+        lon, lat = net.convertXY2LonLat(x, y)
+        graph.add_node(node.getID(), x, y, lon, lat)
+    street_names = []
+    shape_start, shape_xy = [0], []
+    for edge in net.getEdges():
+        from_node = edge.getFromNode().getID()
+        to_node = edge.getToNode().getID()
+        if from_node in graph.node_id_to_idx and to_node in graph.node_id_to_idx:
+            # travel_time / original_travel_time are derived as length / (speed + 0.001)
+            graph.add_edge(edge.getID(), from_node, to_node, edge.getLength(), edge.getSpeed())
+            shape = edge.getShape()
+            if len(shape) < 2:
+                shape = [edge.getFromNode().getCoord(), edge.getToNode().getCoord()]
+            shape_xy.extend(shape)
+            shape_start.append(len(shape_xy))
+            if edge.getName():
+                street_names.append((edge.getName(), graph.node_id_to_idx[from_node], graph.node_id_to_idx[to_node]))
+    graph.freeze()
+    shapes = {
+        "shape_start": np.array(shape_start, dtype=np.int64),
+        "shape_xy": np.array(shape_xy, dtype=np.float64).reshape(-1, 2)
+    }
+    return graph, shapes, street_names
+
+
+def load_or_build(net_file, cache_dir, read_net, logger=None):
+    """
+    Loads the snapshot for the current net file, or parses the net with
+    `read_net(net_file)` (sumolib.net.readNet), builds the graph and saves a
+    new snapshot. Snapshots of older net versions are removed.
+    """
+    net_hash = net_file_hash(net_file)
+    path = snapshot_dir(cache_dir, net_hash)
+    snapshot = load_snapshot(path, net_hash)
+    if snapshot is not None:
+        return snapshot
+
+    net = read_net(net_file)
+    graph, shapes, street_names = build_from_net(net)
+    location = read_net_location(net_file)
+    try:
+        save_snapshot(path, graph, shapes, street_names, location, net_hash)
+        for name in os.listdir(cache_dir):
+            old = os.path.join(cache_dir, name)
+            if name != net_hash and os.path.isfile(os.path.join(old, "meta.json")):
+                shutil.rmtree(old, ignore_errors=True)
+    except OSError as e:
+        if logger:
+            logger.warning(f"Could not write net snapshot to {path}: {e}")
+    return NetSnapshot(graph, shapes, street_names, NetProjection(location), net_hash, from_cache=False)
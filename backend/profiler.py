@@ -0,0 +1,93 @@
+"""
+profiler.py
+Low-overhead sampling profiler for a running backend: a daemon thread
+snapshots every thread's stack with sys._current_frames() at a fixed
+interval and counts identical stacks. Off by default; toggled through
+/admin/profiler.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval_s=0.005, max_depth=40):
+        self.interval_s = interval_s
+        self.max_depth = max_depth
+        self._stacks = Counter() # (thread name, frames...) -> samples
+        self._lock = threading.Lock()
+        self._stop = None
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+
+    @property
+    def running(self):
+        return self._stop is not None and not self._stop.is_set()
+
+    def start(self, interval_s=None):
+        if self.running:
+            return self
+        if interval_s:
+            self.interval_s = interval_s
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+        self.started_at, self.stopped_at = time.time(), None
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, args=(self._stop,), name="sampling-profiler", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self.stopped_at = time.time()
+
+    def _run(self, stop):
+        own_id = threading.get_ident()
+        while not stop.wait(self.interval_s):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            sampled = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                sampled.append((names.get(thread_id, str(thread_id)),) + tuple(stack))
+            with self._lock:
+                self._stacks.update(sampled)
+                self.samples += 1
+
+    def folded(self):
+        """Stacks in the "collapsed" format flame graph tools read: frame;frame;... count"""
+        with self._lock:
+            items = list(self._stacks.items())
+        return "\n".join(";".join(stack) + f" {count}" for stack, count in sorted(items, key=lambda kv: -kv[1])) + "\n"
+
+    def top(self, limit=20):
+        """Functions by samples in which they were running (self) or on the stack (total)."""
+        own, total = Counter(), Counter()
+        with self._lock:
+            items = list(self._stacks.items())
+        for stack, count in items:
+            frames = stack[1:]
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return {
+            "running": self.running,
+            "interval_ms": self.interval_s * 1000,
+            "samples": self.samples,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "self": own.most_common(limit),
+            "total": total.most_common(limit)
+        }
@@ -0,0 +1,140 @@
+"""
+route_cache.py
+Cache of computed routes keyed by snapped (start_node, end_node), with an
+edge -> keys index so incidents only evict the routes they touch.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+CachedRoute = namedtuple("CachedRoute", ["version", "sim_time", "edges", "payload"])
+
+
+class RouteCache:
+    """
+    Bounded LRU of route results.
+
+    An entry computed on snapshot version V is served while the current
+    snapshot is still V, or while it only differs by heartbeat updates no
+    older than `staleness_s` simulated seconds. Writers that block edges
+    call invalidate_edges(), and writers that reopen them call
+    invalidate_reopened(), with the version they are about to publish and
+    before publishing it, so no reader sees that version next to routes it
+    invalidates. A route computed on an older snapshot and put() afterwards
+    is not cached.
+    """
+
+    def __init__(self, max_entries=10000, staleness_s=30.0):
+        self.max_entries = max_entries
+        self.staleness_s = staleness_s
+        self._entries = OrderedDict() # (start, end) -> CachedRoute
+        self._by_edge = {} # edge idx -> set of keys whose route uses it
+        self._invalidated = {} # edge idx -> snapshot version of its last invalidation
+        self._reopened_at = -1 # Snapshot version of the last reopened edge
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.targeted_evictions = 0
+        self.capacity_evictions = 0
+        self.reopen_evictions = 0
+        self.rejected_puts = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, snap):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.version < self._reopened_at or (
+                    entry.version != snap.version and snap.sim_time - entry.sim_time > self.staleness_s):
+                self._remove(key)
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, snap, edges, payload):
+        """Caches a route computed on `snap`. Returns the entry, or None if one of its edges changed since `snap`."""
+        entry = CachedRoute(snap.version, snap.sim_time, tuple(edges), payload)
+        with self._lock:
+            if snap.version < self._reopened_at or any(self._invalidated.get(e, -1) > snap.version for e in entry.edges):
+                self.rejected_puts += 1
+                return None
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            for e in entry.edges:
+                self._by_edge.setdefault(e, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.capacity_evictions += 1
+        return entry
+
+    def invalidate_edges(self, edges, version):
+        """
+        Drops every cached route that uses any of `edges`, blocked in snapshot
+        `version`, and refuses later puts of routes on older snapshots over
+        them. Returns how many were dropped.
+        """
+        dropped = 0
+        with self._lock:
+            for e in edges:
+                e = int(e)
+                if version > self._invalidated.get(e, -1):
+                    self._invalidated[e] = version
+                for key in list(self._by_edge.get(e, ())):
+                    self._remove(key)
+                    dropped += 1
+            self.targeted_evictions += dropped
+        return dropped
+
+    def invalidate_reopened(self, edges, version):
+        """
+        `edges` reopen in snapshot `version`. Routes cached before it may
+        detour around them without using them, so every entry is dropped and
+        puts of routes on older snapshots are refused. Returns how many were dropped.
+        """
+        with self._lock:
+            self._reopened_at = max(self._reopened_at, version)
+            dropped = len(self._entries)
+            self._entries.clear()
+            self._by_edge.clear()
+            self.reopen_evictions += dropped
+        return dropped
+
+    def clear(self):
+        """Forgets everything, invalidations included: only for a new version sequence (a new engine)."""
+        with self._lock:
+            self._entries.clear()
+            self._by_edge.clear()
+            self._invalidated.clear()
+            self._reopened_at = -1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for e in entry.edges:
+            keys = self._by_edge.get(e)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_edge[e]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "stale_evictions": self.stale,
+            "targeted_evictions": self.targeted_evictions,
+            "capacity_evictions": self.capacity_evictions,
+            "reopen_evictions": self.reopen_evictions,
+            "rejected_puts": self.rejected_puts,
+            "staleness_s": self.staleness_s
+        }
@@ -0,0 +1,445 @@
+"""
+routing_graph.py
+Compact, array-backed routing graph (CSR adjacency) with A* search.
+Replaces the NetworkX MultiDiGraph for the /route hot path.
+"""
+import heapq
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Vehicles may drive faster than the posted limit (SUMO speedFactor), so live
+# travel times can drop below length / speed. The A* lower bound divides by
+# this much extra speed to stay admissible.
+HEURISTIC_SPEED_SLACK = 1.5
+
+# Static arrays a saved graph snapshot must provide, and the optional CSR ones
+GRAPH_ARRAYS = ("x", "y", "lon", "lat", "edge_from", "edge_to", "length", "speed")
+ADJACENCY_ARRAYS = ("out_start", "out_edges", "in_start", "in_edges")
+
+Route = namedtuple("Route", ["nodes", "edges", "travel_time", "length"])
+
+# Alternative routes: at most this much slower than the fastest (over the
+# detour), and sharing at most this fraction of length with a faster one
+DEFAULT_MAX_STRETCH = 1.3
+DEFAULT_MAX_OVERLAP = 0.7
+
+# One immutable, versioned view of the live edge weights. Readers grab
+# G.snapshot once and use it for the whole request without any lock.
+WeightSnapshot = namedtuple(
+    "WeightSnapshot",
+    ["version", "sim_time", "travel_time", "is_incident", "incident_lat", "incident_lon"]
+)
+
+
+class RoutingGraph:
+    """
+    Directed multigraph stored as NumPy arrays.
+
+    Nodes and edges get dense integer ids in insertion order. Static
+    per-edge attributes (length, speed, original_travel_time) live in aligned
+    arrays indexed by edge id, and outgoing edges of each node are stored
+    contiguously (CSR), so searches never touch dicts. Live attributes
+    (travel_time, incident flags) live in the current WeightSnapshot.
+    """
+
+    def __init__(self):
+        self.node_ids = []
+        self.node_id_to_idx = {}
+        self.edge_ids = []
+        self.edge_id_to_idx = {}
+        self._node_rows = []
+        self._edge_rows = []
+        self.frozen = False
+
+    # --- BUILDING ---
+    def add_node(self, node_id, x, y, lon, lat):
+        self.node_id_to_idx[node_id] = len(self.node_ids)
+        self.node_ids.append(node_id)
+        self._node_rows.append((x, y, lon, lat))
+
+    def add_edge(self, edge_id, from_node, to_node, length, speed):
+        self.edge_id_to_idx[edge_id] = len(self.edge_ids)
+        self.edge_ids.append(edge_id)
+        self._edge_rows.append((
+            self.node_id_to_idx[from_node],
+            self.node_id_to_idx[to_node],
+            length,
+            speed
+        ))
+
+    def freeze(self):
+        """Converts the collected rows into arrays and builds the CSR adjacency."""
+        nodes = np.array(self._node_rows, dtype=np.float64).reshape(-1, 4)
+        self.x, self.y = nodes[:, 0].copy(), nodes[:, 1].copy()
+        self.lon, self.lat = nodes[:, 2].copy(), nodes[:, 3].copy()
+
+        edges = np.array(self._edge_rows, dtype=np.float64).reshape(-1, 4)
+        self.edge_from = edges[:, 0].astype(np.int64)
+        self.edge_to = edges[:, 1].astype(np.int64)
+        self.length = edges[:, 2].copy()
+        self.speed = edges[:, 3].copy()
+        self._node_rows = []
+        self._edge_rows = []
+        return self._finish()
+
+    @classmethod
+    def from_arrays(cls, node_ids, edge_ids, arrays):
+        """
+        Builds a frozen graph directly from saved arrays (see net_snapshot.py):
+        x, y, lon, lat, edge_from, edge_to, length, speed and optionally the
+        CSR arrays out_start, out_edges, in_start, in_edges. Arrays may be
+        read-only memory maps; they are used as-is, not copied.
+        """
+        g = cls()
+        g.node_ids = list(node_ids)
+        g.node_id_to_idx = {node_id: i for i, node_id in enumerate(g.node_ids)}
+        g.edge_ids = list(edge_ids)
+        g.edge_id_to_idx = {edge_id: i for i, edge_id in enumerate(g.edge_ids)}
+        for name in GRAPH_ARRAYS:
+            setattr(g, name, arrays[name])
+        adjacency = {name: arrays[name] for name in ADJACENCY_ARRAYS if name in arrays}
+        return g._finish(adjacency if len(adjacency) == len(ADJACENCY_ARRAYS) else None)
+
+    def _finish(self, adjacency=None):
+        self.original_travel_time = self.length / (self.speed + 0.001)
+        self.original_travel_time.flags.writeable = False
+
+        m = len(self.edge_ids)
+        self.snapshot = None
+        self.publish(
+            sim_time=0.0,
+            travel_time=self.original_travel_time.copy(),
+            is_incident=np.zeros(m, dtype=bool),
+            incident_lat=np.full(m, np.nan),
+            incident_lon=np.full(m, np.nan)
+        )
+
+        self._build_adjacency(adjacency)
+        self.frozen = True
+        return self
+
+    def _build_adjacency(self, adjacency=None):
+        n = len(self.node_ids)
+        if adjacency is not None:
+            for name in ADJACENCY_ARRAYS:
+                setattr(self, name, adjacency[name])
+        else:
+            self.out_edges = np.argsort(self.edge_from, kind="stable")
+            self.out_start = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.edge_from, minlength=n), out=self.out_start[1:])
+            self.in_edges = np.argsort(self.edge_to, kind="stable")
+            self.in_start = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.edge_to, minlength=n), out=self.in_start[1:])
+
+        # Largest straight-line speed any edge allows; used for the A* bound
+        m = len(self.edge_ids)
+        if m:
+            chord = np.hypot(
+                self.x[self.edge_to] - self.x[self.edge_from],
+                self.y[self.edge_to] - self.y[self.edge_from]
+            )
+            max_speed = float(np.max(chord / self.original_travel_time))
+        else:
+            max_speed = 0.0
+        self.heuristic_speed = max(max_speed, 1.0) * HEURISTIC_SPEED_SLACK
+
+        # Plain-list mirrors of static topology for the search loops
+        self._out_start = self.out_start.tolist()
+        self._out_edges = self.out_edges.tolist()
+        self._in_start = self.in_start.tolist()
+        self._in_edges = self.in_edges.tolist()
+        self._edge_from = self.edge_from.tolist()
+        self._edge_to = self.edge_to.tolist()
+        self._x = self.x.tolist()
+        self._y = self.y.tolist()
+
+    def publish(self, sim_time=None, version=None, **arrays):
+        """
+        Publishes the next weight snapshot with a single reference swap.
+        Arrays not passed are shared with the current snapshot. Passed arrays
+        are frozen, so callers must hand over fresh copies. Writers must be
+        serialized by the caller (the app's g_lock); readers need no lock.
+        `version` overrides the local counter when mirroring another process.
+        """
+        cur = self.snapshot
+        fields = {}
+        for name in ("travel_time", "is_incident", "incident_lat", "incident_lon"):
+            arr = arrays.pop(name, None)
+            if arr is None:
+                arr = getattr(cur, name)
+            else:
+                arr.flags.writeable = False
+            fields[name] = arr
+        if arrays:
+            raise TypeError(f"Unknown snapshot fields: {sorted(arrays)}")
+        snap = WeightSnapshot(
+            version=version if version is not None else (0 if cur is None else cur.version + 1),
+            sim_time=cur.sim_time if sim_time is None else sim_time,
+            **fields
+        )
+        self.snapshot = snap
+        return snap
+
+    @property
+    def next_version(self):
+        """Version the next publish() gets unless overridden; stable while the caller holds the writer lock."""
+        return 0 if self.snapshot is None else self.snapshot.version + 1
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_ids)
+
+    # --- SEARCH ---
+    def shortest_path(self, source, target, weights=None):
+        """
+        A* from node index `source` to node index `target` over `weights`
+        (defaults to the current snapshot's travel_time). The heuristic is the
+        Euclidean distance to the target divided by `heuristic_speed`.
+
+        Returns a Route (node indices, edge indices, total weight, total
+        length), or None if the target is unreachable.
+        """
+        w = memoryview(self.snapshot.travel_time if weights is None else weights)
+        out_start, out_edges, edge_to = self._out_start, self._out_edges, self._edge_to
+        xs, ys = self._x, self._y
+        tx, ty = xs[target], ys[target]
+        inv_speed = 1.0 / self.heuristic_speed
+        hypot = math.hypot
+        push, pop = heapq.heappush, heapq.heappop
+
+        dist = {source: 0.0}
+        pred_edge = {}
+        settled = set()
+        heap = [(hypot(xs[source] - tx, ys[source] - ty) * inv_speed, 0.0, source)]
+        while heap:
+            _, g, u = pop(heap)
+            if u == target:
+                break
+            if u in settled:
+                continue
+            settled.add(u)
+            for k in range(out_start[u], out_start[u + 1]):
+                e = out_edges[k]
+                v = edge_to[e]
+                ng = g + w[e]
+                if ng < dist.get(v, math.inf):
+                    dist[v] = ng
+                    pred_edge[v] = e
+                    push(heap, (ng + hypot(xs[v] - tx, ys[v] - ty) * inv_speed, ng, v))
+        else:
+            return None
+
+        return self._build_route(source, target, pred_edge, dist.get(target, 0.0))
+
+    def one_to_many(self, source, targets, weights=None):
+        """
+        Plain Dijkstra from `source` that stops once every node in `targets`
+        is settled, so all destinations share one search tree.
+        Returns {target: Route}; unreachable targets are left out.
+        """
+        w = memoryview(self.snapshot.travel_time if weights is None else weights)
+        out_start, out_edges, edge_to = self._out_start, self._out_edges, self._edge_to
+        push, pop = heapq.heappush, heapq.heappop
+        remaining = set(targets)
+
+        dist = {source: 0.0}
+        pred_edge = {}
+        settled = set()
+        heap = [(0.0, source)]
+        while heap and remaining:
+            g, u = pop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            remaining.discard(u)
+            for k in range(out_start[u], out_start[u + 1]):
+                e = out_edges[k]
+                v = edge_to[e]
+                ng = g + w[e]
+                if ng < dist.get(v, math.inf):
+                    dist[v] = ng
+                    pred_edge[v] = e
+                    push(heap, (ng, v))
+
+        return {
+            t: self._build_route(source, t, pred_edge, dist[t])
+            for t in set(targets) if t in settled
+        }
+
+    def alternatives(self, source, target, k=3, weights=None,
+                     max_stretch=DEFAULT_MAX_STRETCH, max_overlap=DEFAULT_MAX_OVERLAP):
+        """
+        Up to `k` diverse routes by the via-node plateau method. One forward
+        tree from `source` and one backward tree to `target` are grown until
+        no node left could be on a route within `max_stretch` x the best; every
+        candidate is then read off those two trees, so no further searches
+        are run however many candidates are looked at. A plateau is a chain
+        of edges lying in both trees; every via node on it gives the same
+        path, so each plateau is tried once, best total first.
+
+        Returns [(Route, overlap), ...] as select_alternatives does; [] if
+        the target is unreachable.
+        """
+        w = memoryview(self.snapshot.travel_time if weights is None else weights)
+        out_start, out_edges, edge_to = self._out_start, self._out_edges, self._edge_to
+        in_start, in_edges, edge_from = self._in_start, self._in_edges, self._edge_from
+        push, pop = heapq.heappush, heapq.heappop
+
+        # Alternating bidirectional A* with the same lower bound as shortest_path.
+        # A node whose key exceeds max_stretch x `best` (the shortest s-t
+        # distance met so far) cannot be on an acceptable route, so each side
+        # stops there and the two trees only cover the ellipse around s and t.
+        xs, ys = self._x, self._y
+        sx, sy, tx, ty = xs[source], ys[source], xs[target], ys[target]
+        inv_speed = 1.0 / self.heuristic_speed
+        hypot = math.hypot
+        dist_f, dist_b = {source: 0.0}, {target: 0.0}
+        pred_f, pred_b = {}, {}
+        settled_f, settled_b = set(), set()
+        heap_f = [(hypot(sx - tx, sy - ty) * inv_speed, 0.0, source)]
+        heap_b = [(heap_f[0][0], 0.0, target)]
+        best = 0.0 if source == target else math.inf
+        while heap_f or heap_b:
+            forward = bool(heap_f) and (not heap_b or heap_f[0][0] <= heap_b[0][0])
+            heap = heap_f if forward else heap_b
+            if heap[0][0] > max_stretch * best:
+                heap.clear()
+                continue
+            _, g, u = pop(heap)
+            if forward:
+                if u in settled_f:
+                    continue
+                settled_f.add(u)
+                if u in dist_b:
+                    best = min(best, g + dist_b[u])
+                for i in range(out_start[u], out_start[u + 1]):
+                    e = out_edges[i]
+                    v = edge_to[e]
+                    ng = g + w[e]
+                    if ng < dist_f.get(v, math.inf):
+                        dist_f[v] = ng
+                        pred_f[v] = e
+                        push(heap_f, (ng + hypot(xs[v] - tx, ys[v] - ty) * inv_speed, ng, v))
+            else:
+                if u in settled_b:
+                    continue
+                settled_b.add(u)
+                if u in dist_f:
+                    best = min(best, g + dist_f[u])
+                for i in range(in_start[u], in_start[u + 1]):
+                    e = in_edges[i]
+                    v = edge_from[e]
+                    ng = g + w[e]
+                    if ng < dist_b.get(v, math.inf):
+                        dist_b[v] = ng
+                        pred_b[v] = e
+                        push(heap_b, (ng + hypot(xs[v] - sx, ys[v] - sy) * inv_speed, ng, v))
+        if best == math.inf:
+            return []
+
+        limit = max_stretch * best
+        vias = sorted(
+            (dist_f[v] + dist_b[v], v) for v in settled_f & settled_b
+            if dist_f[v] + dist_b[v] <= limit
+        )
+
+        def candidates():
+            covered = set()
+            for total, via in vias:
+                if via in covered:
+                    continue
+                # Every node on the plateau through `via` gives the same path
+                first = via
+                covered.add(via)
+                while first in pred_f and pred_b.get(edge_from[pred_f[first]]) == pred_f[first]:
+                    first = edge_from[pred_f[first]]
+                    covered.add(first)
+                last = via
+                while last in pred_b and pred_f.get(edge_to[pred_b[last]]) == pred_b[last]:
+                    last = edge_to[pred_b[last]]
+                    covered.add(last)
+
+                edges = self._build_route(source, first, pred_f, 0.0).edges
+                node = first
+                while node != target:
+                    e = pred_b[node]
+                    edges.append(e)
+                    node = edge_to[e]
+                yield edges, total
+
+        return select_alternatives(self, source, candidates(), k, w, max_stretch, max_overlap)
+
+    def _build_route(self, source, target, pred_edge, total_weight):
+        edges = []
+        node = target
+        edge_from = self._edge_from
+        while node != source:
+            e = pred_edge[node]
+            edges.append(e)
+            node = edge_from[e]
+        edges.reverse()
+        nodes = [source] + [self._edge_to[e] for e in edges]
+        total_length = float(self.length[edges].sum()) if edges else 0.0
+        return Route(nodes, edges, total_weight, total_length)
+
+    def path_coords(self, nodes):
+        """Returns [[lat, lon], ...] for a list of node indices."""
+        idx = np.asarray(nodes, dtype=np.int64)
+        return np.column_stack((self.lat[idx], self.lon[idx])).tolist()
+
+
+def select_alternatives(graph, source, candidates, k, weights, max_stretch=DEFAULT_MAX_STRETCH,
+                        max_overlap=DEFAULT_MAX_OVERLAP):
+    """
+    Picks up to `k` routes from `candidates`, an iterable of (edges, travel
+    time) out of `source` in increasing travel time whose first item is the
+    fastest route. Candidates are only materialized as far as needed.
+    A candidate is kept if it is loop-free, shares at most `max_overlap` of
+    its length with every route already kept, and its detour (the stretch
+    between where it leaves and rejoins the fastest route) takes at most
+    `max_stretch` x the fastest route's time over that stretch, which
+    rejects both slow and pointless zig-zag alternatives.
+
+    Returns [(Route, overlap), ...] fastest first, where overlap is the
+    largest fraction of that route's length shared with a faster one
+    (0.0 for the first).
+    """
+    edge_to, length = graph._edge_to, graph.length
+    chosen = []
+    best_edges = best_time = None
+    for edges, total in candidates:
+        nodes = [source] + [edge_to[e] for e in edges]
+        if len(set(nodes)) != len(nodes):
+            continue
+        if best_edges is None:
+            best_edges, best_time = edges, total
+        else:
+            # Common prefix and suffix with the fastest route; both are shortest paths
+            n = min(len(edges), len(best_edges))
+            i = 0
+            while i < n and edges[i] == best_edges[i]:
+                i += 1
+            j = 0
+            while j < n - i and edges[-1 - j] == best_edges[-1 - j]:
+                j += 1
+            shared_time = sum(weights[e] for e in edges[:i]) + sum(weights[e] for e in edges[len(edges) - j:])
+            if total - shared_time > max_stretch * (best_time - shared_time):
+                continue
+
+        route_length = float(length[edges].sum()) if edges else 0.0
+        overlap = 0.0
+        for other, _ in chosen:
+            shared = set(edges).intersection(other.edges)
+            shared_length = float(length[list(shared)].sum()) if shared else 0.0
+            overlap = max(overlap, shared_length / route_length if route_length else 1.0)
+        if overlap > max_overlap:
+            continue
+        chosen.append((Route(nodes, list(edges), total, route_length), overlap))
+        if len(chosen) >= k:
+            break
+    return chosen
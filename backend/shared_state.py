@@ -0,0 +1,297 @@
+"""
+shared_state.py
+Live engine state in POSIX shared memory, versioned with a seqlock, so one
+engine process (SUMO/TraCI) can feed any number of web worker processes.
+
+Segment layout (all little-endian, 8-byte aligned):
+    header          HEADER_DTYPE
+    travel_time     float64[num_edges]
+    incident_lat    float64[num_edges]
+    incident_lon    float64[num_edges]
+    heat            float64[num_edges]   live/original ratio, NaN = no reading (own heat_seq)
+    is_incident     uint8[num_edges]
+    signal_codes    uint8[max_signals]   SIGNAL_CODES, in static "signals" order
+    static          bytes[static_capacity]  JSON written rarely (signal ids/locations, heat epoch)
+
+The writer bumps `seq` to an odd value, writes, then bumps it to the next
+even value. Readers copy and retry if `seq` was odd or moved meanwhile.
+
+A restarted engine replaces the segment; readers keep the old one mapped,
+so they compare its random `instance` with the named segment's to notice.
+"""
+import json
+import secrets
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+HEADER_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("instance", "<u8"), # Random per create(), i.e. per engine run
+    ("version", "<u8"), # Weight snapshot version; unchanged for signal-only writes
+    ("heat_seq", "<u8"), # Bumped by every heat write (the heatmap has its own cadence)
+    ("sim_time", "<f8"),
+    ("traci_latency_ms", "<f8"),
+    ("num_edges", "<u8"),
+    ("max_signals", "<u8"),
+    ("num_signals", "<u8"),
+    ("static_capacity", "<u8"),
+    ("static_len", "<u8"),
+    ("static_seq", "<u8"),
+    ("reported_count", "<u8"), # Lengths of the engine's incident/resolved histories
+    ("resolved_count", "<u8"),
+    ("log_count", "<u8"), # Total log lines the engine has produced
+    ("trip_event_count", "<u8"), # Total active-trip events, so workers know when to fetch theirs
+])
+
+SIGNAL_CODES = {"red": 0, "yellow": 1, "green": 2}
+SIGNAL_STATES = {code: state for state, code in SIGNAL_CODES.items()}
+
+EngineView = namedtuple("EngineView", [
+    "seq", "version", "sim_time", "traci_latency_ms",
+    "travel_time", "is_incident", "incident_lat", "incident_lon", "heat_seq", "heat",
+    "signal_codes", "reported_count", "resolved_count", "log_count", "trip_event_count"
+])
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+class SharedEngineState:
+    """
+    One shared-memory segment. Use create() in the engine (the writer; its
+    threads take turns) and attach() in web workers (readers).
+    """
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self.owner = owner
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        m = int(self.header["num_edges"])
+        max_signals = int(self.header["max_signals"])
+        offset = _align(HEADER_DTYPE.itemsize)
+
+        def take(dtype, count):
+            nonlocal offset
+            arr = np.ndarray((count,), dtype=dtype, buffer=shm.buf, offset=offset)
+            offset = _align(offset + arr.nbytes)
+            return arr
+
+        self.travel_time = take(np.float64, m)
+        self.incident_lat = take(np.float64, m)
+        self.incident_lon = take(np.float64, m)
+        self.heat = take(np.float64, m)
+        self.is_incident = take(np.uint8, m)
+        self.signal_codes = take(np.uint8, max_signals)
+        self.static = take(np.uint8, int(self.header["static_capacity"]))
+        self._static_cache = (None, None) # (static_seq, parsed)
+        self._static_parts = {} # Writer side: the object update_static() last wrote
+        self._write_lock = threading.Lock() # Engine threads (loop, RPC, trip re-routing) all publish
+
+    @staticmethod
+    def segment_size(num_edges, max_signals, static_capacity):
+        size = _align(HEADER_DTYPE.itemsize)
+        for itemsize, count in ((8, num_edges),) * 4 + ((1, num_edges), (1, max_signals), (1, static_capacity)):
+            size = _align(size + itemsize * count)
+        return size
+
+    @classmethod
+    def create(cls, name, num_edges, max_signals=4096, static_capacity=1 << 20):
+        """Creates (or replaces a stale) segment. Only the engine calls this."""
+        size = cls.segment_size(num_edges, max_signals, static_capacity)
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header[()] = 0
+        header["num_edges"] = num_edges
+        header["max_signals"] = max_signals
+        header["static_capacity"] = static_capacity
+        header["instance"] = secrets.randbits(63)
+        del header
+        state = cls(shm, owner=True)
+        state.heat[:] = np.nan
+        state.incident_lat[:] = np.nan
+        state.incident_lon[:] = np.nan
+        return state
+
+    @staticmethod
+    def _open(name):
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # Python < 3.13 registers attached segments with the resource
+            # tracker, which would unlink the engine's segment on worker exit
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to the engine's segment. Raises FileNotFoundError until it exists."""
+        return cls(cls._open(name), owner=False)
+
+    @classmethod
+    def instance_of(cls, name):
+        """The `instance` of the segment currently named `name`, or None if there is none."""
+        try:
+            shm = cls._open(name)
+        except FileNotFoundError:
+            return None
+        try:
+            header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+            instance = int(header["instance"])
+            del header
+            return instance
+        finally:
+            shm.close()
+
+    # --- WRITER (engine only) ---
+    def _begin(self):
+        self._write_lock.acquire()
+        self.header["seq"] += 1
+
+    def _end(self):
+        self.header["seq"] += 1
+        self._write_lock.release()
+
+    def publish(self, snap=None, heat=None, signal_codes=None, traci_latency_ms=None, counts=None):
+        """
+        Writes the given parts under one seqlock section. `snap` is a
+        WeightSnapshot, `heat` a per-edge float array, `signal_codes` uint8
+        codes in static "signals" order, `counts` a (reported, resolved, logs,
+        trip events) tuple.
+        """
+        self._begin()
+        try:
+            if snap is not None:
+                self.travel_time[:] = snap.travel_time
+                self.is_incident[:] = snap.is_incident
+                self.incident_lat[:] = snap.incident_lat
+                self.incident_lon[:] = snap.incident_lon
+                self.header["version"] = snap.version
+                self.header["sim_time"] = snap.sim_time
+            if heat is not None:
+                self.heat[:] = heat
+                self.header["heat_seq"] += 1
+            if signal_codes is not None:
+                n = min(len(signal_codes), len(self.signal_codes))
+                self.signal_codes[:n] = signal_codes[:n]
+                self.header["num_signals"] = n
+            if traci_latency_ms is not None:
+                self.header["traci_latency_ms"] = traci_latency_ms
+            if counts is not None:
+                (self.header["reported_count"], self.header["resolved_count"], self.header["log_count"],
+                 self.header["trip_event_count"]) = counts
+        finally:
+            self._end()
+
+    def update_static(self, **parts):
+        """Rewrites the static JSON with `parts` replacing those keys; the other keys keep their values."""
+        self._begin()
+        try:
+            self._write_static({**self._static_parts, **parts})
+        finally:
+            self._end()
+
+    def set_static(self, obj):
+        self._begin()
+        try:
+            self._write_static(obj)
+        finally:
+            self._end()
+
+    def _write_static(self, obj):
+        """Caller holds the seqlock section (_begin)."""
+        data = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+        if len(data) > len(self.static):
+            raise ValueError(f"Static engine data is {len(data)} bytes, capacity is {len(self.static)}")
+        self.static[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self.header["static_len"] = len(data)
+        self.header["static_seq"] += 1
+        self._static_parts = dict(obj)
+
+    # --- READERS ---
+    @property
+    def seq(self):
+        return int(self.header["seq"])
+
+    @property
+    def instance(self):
+        return int(self.header["instance"])
+
+    def read(self, last_seq=None, last_version=None, last_heat_seq=None, max_spins=1000):
+        """
+        Returns a consistent EngineView copy, or None if `seq` still equals
+        `last_seq`. Weight arrays are only copied when the version differs
+        from `last_version`, and heat when heat_seq differs from
+        `last_heat_seq` (else those fields are None).
+        """
+        for spin in range(max_spins):
+            start = int(self.header["seq"])
+            if start == last_seq:
+                return None
+            if start & 1:
+                time.sleep(0 if spin < 100 else 0.001)
+                continue
+            header = self.header.copy()
+            weights_changed = int(header["version"]) != last_version
+            heat_changed = int(header["heat_seq"]) != last_heat_seq
+            n = int(header["num_signals"])
+            view = EngineView(
+                seq=start,
+                version=int(header["version"]),
+                sim_time=float(header["sim_time"]),
+                traci_latency_ms=float(header["traci_latency_ms"]),
+                travel_time=self.travel_time.copy() if weights_changed else None,
+                is_incident=self.is_incident.astype(bool) if weights_changed else None,
+                incident_lat=self.incident_lat.copy() if weights_changed else None,
+                incident_lon=self.incident_lon.copy() if weights_changed else None,
+                heat_seq=int(header["heat_seq"]),
+                heat=self.heat.copy() if heat_changed else None,
+                signal_codes=self.signal_codes[:n].copy(),
+                reported_count=int(header["reported_count"]),
+                resolved_count=int(header["resolved_count"]),
+                log_count=int(header["log_count"]),
+                trip_event_count=int(header["trip_event_count"])
+            )
+            if int(self.header["seq"]) == start:
+                return view
+        raise TimeoutError("Engine state kept changing while being read")
+
+    def read_static(self):
+        """Returns the parsed static JSON (cached until the engine rewrites it)."""
+        for _ in range(1000):
+            start = int(self.header["seq"])
+            if start & 1:
+                time.sleep(0)
+                continue
+            static_seq = int(self.header["static_seq"])
+            if self._static_cache[0] == static_seq:
+                return self._static_cache[1]
+            raw = self.static[:int(self.header["static_len"])].tobytes()
+            if int(self.header["seq"]) == start:
+                parsed = json.loads(raw) if raw else {}
+                self._static_cache = (static_seq, parsed)
+                return parsed
+        raise TimeoutError("Engine static data kept changing while being read")
+
+    def close(self):
+        # Drop the numpy views first so the buffer can be released
+        self.header = self.travel_time = self.incident_lat = self.incident_lon = None
+        self.heat = self.is_incident = self.signal_codes = self.static = None
+        self._shm.close()
+        if self.owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,41 @@
+"""
+sim_backend.py
+Selects how the engine talks to SUMO. Both backends expose the TraCI API
+(start, simulationStep, edge/junction/trafficlight domains, constants):
+
+    traci    SUMO as a separate process, driven over a socket (default)
+    libsumo  SUMO linked into this process: no socket round trips, but one
+             simulation per process, no GUI, and steps hold the GIL
+"""
+SIM_BACKENDS = ("traci", "libsumo")
+
+
+def load(name):
+    """Returns (module, constants) for one of SIM_BACKENDS."""
+    if name == "libsumo":
+        import libsumo as module
+    elif name == "traci":
+        import traci as module
+    else:
+        raise ValueError(f"Unknown simulation backend '{name}', expected one of {SIM_BACKENDS}")
+    try:
+        constants = module.constants
+    except AttributeError:
+        import traci.constants as constants # Older libsumo builds only ship the functions
+    return module, constants
+
+
+def start(module, name, cmd, port=0):
+    """
+    Starts SUMO with `cmd`. The socket backend listens on `port`, or on a
+    free port if 0, so several instances can share a host. Returns the
+    port, or None for libsumo.
+    """
+    if name == "libsumo":
+        module.start(cmd)
+        return None
+    if not port:
+        from sumolib.miscutils import getFreeSocketPort
+        port = getFreeSocketPort()
+    module.start(cmd, port=port)
+    return port
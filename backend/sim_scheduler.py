@@ -0,0 +1,152 @@
+"""
+sim_scheduler.py
+Runs the engine loop's periodic work on simulated time. Each task has its
+own cadence (simulated seconds) and wall-time budget; a task is due on the
+first step at or after its next slot on the grid start + n * cadence, so
+the same tasks run at the same simulated times whatever the step length.
+Slots passed over by a long step (or a multi-step simulationStep) are
+merged into one run that is told the simulated time it covers.
+
+Backpressure: once a tick has overrun (a high-priority task went over its
+budget, or the tick went over `tick_budget_s`), due low-priority tasks are
+deferred to their next slot and that run covers the skipped time too. A
+task is deferred at most `max_deferrals` times in a row so it never starves.
+"""
+import math
+import time
+
+HIGH = 0
+LOW = 1
+EPSILON = 1e-9 # Absorbs float error in SUMO times like 0.1 * n
+
+
+class SimTask:
+
+    def __init__(self, name, fn, cadence_s, budget_s, priority=HIGH, start=0.0):
+        self.name = name
+        self.fn = fn # fn(sim_time, dt): dt = simulated seconds since this task last ran
+        self.cadence_s = cadence_s
+        self.budget_s = budget_s
+        self.priority = priority
+        self.start = start
+        self.next_due = start
+        self.last_run = None
+        self.runs = 0
+        self.merged = 0 # Slots folded into a later run by long steps
+        self.deferred = 0 # Slots skipped by backpressure
+        self.consecutive_deferrals = 0
+        self.overruns = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+
+    def advance(self, sim_time):
+        """Moves next_due to the first slot after `sim_time`; returns how many slots were due."""
+        slots = int(math.floor((sim_time - self.start) / self.cadence_s + EPSILON)) + 1
+        due = slots - int(round((self.next_due - self.start) / self.cadence_s))
+        self.next_due = self.start + slots * self.cadence_s
+        return due
+
+    def stats(self):
+        return {
+            "cadence_s": self.cadence_s,
+            "budget_ms": self.budget_s * 1000,
+            "priority": "high" if self.priority == HIGH else "low",
+            "runs": self.runs,
+            "merged": self.merged,
+            "deferred": self.deferred,
+            "overruns": self.overruns,
+            "last_ms": round(self.last_ms, 3),
+            "max_ms": round(self.max_ms, 3),
+            "last_run": self.last_run
+        }
+
+
+class SimScheduler:
+
+    def __init__(self, tick_budget_s=None, max_deferrals=5, on_run=None):
+        self.tick_budget_s = tick_budget_s
+        self.max_deferrals = max_deferrals
+        self.on_run = on_run # on_run(name, seconds) after every task, e.g. for metrics
+        self.tasks = []
+        self.ticks = 0
+        self.overrun_ticks = 0
+
+    def add(self, name, fn, cadence_s, budget_s, priority=HIGH, start=0.0):
+        task = SimTask(name, fn, cadence_s, budget_s, priority, start)
+        self.tasks.append(task)
+        # High priority first, then registration order
+        self.tasks.sort(key=lambda t: t.priority)
+        return task
+
+    def run_due(self, sim_time):
+        """Runs every task due at `sim_time`. Returns the names of the tasks that ran."""
+        self.ticks += 1
+        tick_start_t = time.perf_counter()
+        overrun = False
+        ran = []
+        for task in self.tasks:
+            if sim_time + EPSILON < task.next_due:
+                continue
+            due = task.advance(sim_time)
+            if overrun and task.priority != HIGH and task.consecutive_deferrals < self.max_deferrals:
+                task.deferred += due
+                task.consecutive_deferrals += 1
+                continue
+            if task.last_run is not None:
+                task.merged += due - 1
+            task.consecutive_deferrals = 0
+
+            dt = task.cadence_s if task.last_run is None else sim_time - task.last_run
+            start_t = time.perf_counter()
+            try:
+                task.fn(sim_time, dt)
+            finally:
+                elapsed = time.perf_counter() - start_t
+                task.last_run = sim_time
+                task.runs += 1
+                task.last_ms = elapsed * 1000
+                task.max_ms = max(task.max_ms, task.last_ms)
+                if elapsed > task.budget_s:
+                    task.overruns += 1
+                    if task.priority == HIGH:
+                        overrun = True
+                if self.on_run is not None:
+                    self.on_run(task.name, elapsed)
+            ran.append(task.name)
+            if self.tick_budget_s is not None and time.perf_counter() - tick_start_t > self.tick_budget_s:
+                overrun = True
+        if overrun:
+            self.overrun_ticks += 1
+        return ran
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "overrun_ticks": self.overrun_ticks,
+            "tasks": {task.name: task.stats() for task in self.tasks}
+        }
+
+
+class RateLimiter:
+    """
+    Paces simulated time against the wall clock: wait(sim_time) sleeps until
+    `speedup` simulated seconds per wall second have elapsed. speedup <= 0
+    means run as fast as possible.
+    """
+
+    def __init__(self, speedup):
+        self.speedup = speedup
+        self._origin = None # (wall time, sim time) of the first call
+
+    def wait(self, sim_time):
+        if self.speedup <= 0:
+            return 0.0
+        now = time.perf_counter()
+        if self._origin is None:
+            self._origin = (now, sim_time)
+            return 0.0
+        delay = self._origin[0] + (sim_time - self._origin[1]) / self.speedup - now
+        if delay > 0:
+            time.sleep(delay)
+            return delay
+        return 0.0
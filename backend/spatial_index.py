@@ -0,0 +1,281 @@
+"""
+spatial_index.py
+Grid-bucket spatial indexes: graph nodes and edge shapes for snapping
+coordinates, and the live incident set for listing incidents by area.
+"""
+import math
+import threading
+
+import numpy as np
+
+
+class NodeSpatialIndex:
+    """
+    A uniform grid over node x/y coordinates (SUMO network metres).
+    Built once when the graph loads; answers nearest and k-nearest
+    queries by searching rings of cells outward from the query point.
+    """
+
+    def __init__(self, node_ids, xs, ys, nodes_per_cell=4):
+        self.node_ids = list(node_ids)
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        n = len(self.node_ids)
+
+        if n == 0:
+            self.min_x = self.min_y = 0.0
+            self.cell_size = 1.0
+            self.nx = self.ny = 1
+            self.cell_start = np.zeros(2, dtype=np.int64)
+            self.order = np.zeros(0, dtype=np.int64)
+            return
+
+        self.min_x, self.min_y = float(self.xs.min()), float(self.ys.min())
+        width = max(float(self.xs.max()) - self.min_x, 1.0)
+        height = max(float(self.ys.max()) - self.min_y, 1.0)
+
+        # Pick a cell size that puts roughly `nodes_per_cell` nodes in each cell
+        self.cell_size = max(math.sqrt(width * height * nodes_per_cell / n), 1.0)
+        self.nx = int(width // self.cell_size) + 1
+        self.ny = int(height // self.cell_size) + 1
+
+        cx = ((self.xs - self.min_x) // self.cell_size).astype(np.int64)
+        cy = ((self.ys - self.min_y) // self.cell_size).astype(np.int64)
+        cell_ids = cy * self.nx + cx
+
+        # CSR layout: nodes sorted by cell, cell_start[c]..cell_start[c+1] is cell c
+        self.order = np.argsort(cell_ids, kind="stable")
+        counts = np.bincount(cell_ids, minlength=self.nx * self.ny)
+        self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.cell_start[1:])
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def _cell_of(self, x, y):
+        cx = int((x - self.min_x) // self.cell_size)
+        cy = int((y - self.min_y) // self.cell_size)
+        return min(max(cx, 0), self.nx - 1), min(max(cy, 0), self.ny - 1)
+
+    def _ring_members(self, cx, cy, r):
+        """Returns the node positions (into self.xs/ys) in the square ring at radius r."""
+        x0, x1 = max(cx - r, 0), min(cx + r, self.nx - 1)
+        y0, y1 = max(cy - r, 0), min(cy + r, self.ny - 1)
+        chunks = []
+        for gy in range(y0, y1 + 1):
+            on_edge_row = (gy == cy - r or gy == cy + r)
+            if on_edge_row:
+                # Whole row of the ring is contiguous in the CSR layout
+                start = self.cell_start[gy * self.nx + x0]
+                end = self.cell_start[gy * self.nx + x1 + 1]
+                if end > start:
+                    chunks.append(self.order[start:end])
+            else:
+                for gx in (cx - r, cx + r):
+                    if x0 <= gx <= x1:
+                        c = gy * self.nx + gx
+                        start, end = self.cell_start[c], self.cell_start[c + 1]
+                        if end > start:
+                            chunks.append(self.order[start:end])
+        return chunks
+
+    def _searched_radius(self, x, y, cx, cy, r):
+        """
+        Distance from (x, y) to the nearest cell NOT yet searched after ring r.
+        Returns inf once the searched block covers the whole grid.
+        """
+        bound = math.inf
+        if cx - r > 0:
+            bound = min(bound, x - (self.min_x + (cx - r) * self.cell_size))
+        if cx + r < self.nx - 1:
+            bound = min(bound, (self.min_x + (cx + r + 1) * self.cell_size) - x)
+        if cy - r > 0:
+            bound = min(bound, y - (self.min_y + (cy - r) * self.cell_size))
+        if cy + r < self.ny - 1:
+            bound = min(bound, (self.min_y + (cy + r + 1) * self.cell_size) - y)
+        return max(bound, 0.0)
+
+    def k_nearest(self, x, y, k=1):
+        """
+        Returns up to k (node_id, distance) tuples, closest first.
+        """
+        if not self.node_ids or k <= 0:
+            return []
+        k = min(k, len(self.node_ids))
+        cx, cy = self._cell_of(x, y)
+
+        cand_idx = np.zeros(0, dtype=np.int64)
+        cand_d2 = np.zeros(0, dtype=np.float64)
+        r = 0
+        while True:
+            chunks = self._ring_members(cx, cy, r)
+            if chunks:
+                idx = np.concatenate(chunks)
+                d2 = (self.xs[idx] - x) ** 2 + (self.ys[idx] - y) ** 2
+                cand_idx = np.concatenate((cand_idx, idx))
+                cand_d2 = np.concatenate((cand_d2, d2))
+                if len(cand_idx) > k:
+                    keep = np.argpartition(cand_d2, k - 1)[:k]
+                    cand_idx, cand_d2 = cand_idx[keep], cand_d2[keep]
+
+            bound = self._searched_radius(x, y, cx, cy, r)
+            if len(cand_idx) >= k and (bound == math.inf or cand_d2.max() <= bound * bound):
+                break
+            if bound == math.inf:
+                break
+            r += 1
+
+        ranked = np.argsort(cand_d2)
+        return [(self.node_ids[cand_idx[i]], math.sqrt(cand_d2[i])) for i in ranked]
+
+    def nearest(self, x, y):
+        """Returns the id of the node closest to (x, y), or None for an empty index."""
+        result = self.k_nearest(x, y, 1)
+        return result[0][0] if result else None
+
+
+class EdgeSpatialIndex:
+    """
+    A uniform grid over the shape segments of routable edges (SUMO network
+    metres). Each segment is filed under every cell its bounding box
+    touches, so a point query only measures the segments of the cells
+    within the search radius. Built once when the graph loads.
+    """
+
+    def __init__(self, shape_start, shape_xy, segments_per_cell=4):
+        shape_start = np.asarray(shape_start, dtype=np.int64)
+        points = np.asarray(shape_xy, dtype=np.float64).reshape(-1, 2)
+        self.num_edges = len(shape_start) - 1
+
+        # Segment i joins points i and i + 1 of the same edge
+        point_edge = np.repeat(np.arange(self.num_edges), np.diff(shape_start))
+        first = np.flatnonzero(point_edge[:-1] == point_edge[1:]) if len(points) > 1 else np.zeros(0, dtype=np.int64)
+        self.seg_edge = point_edge[first]
+        self.ax, self.ay = points[first, 0], points[first, 1]
+        self.bx, self.by = points[first + 1, 0], points[first + 1, 1]
+        s = len(first)
+
+        if s == 0:
+            self.min_x = self.min_y = 0.0
+            self.cell_size = 1.0
+            self.nx = self.ny = 1
+            self.cell_start = np.zeros(2, dtype=np.int64)
+            self.order = np.zeros(0, dtype=np.int64)
+            return
+
+        self.min_x = float(min(self.ax.min(), self.bx.min()))
+        self.min_y = float(min(self.ay.min(), self.by.min()))
+        width = max(float(max(self.ax.max(), self.bx.max())) - self.min_x, 1.0)
+        height = max(float(max(self.ay.max(), self.by.max())) - self.min_y, 1.0)
+        self.cell_size = max(math.sqrt(width * height * segments_per_cell / s), 1.0)
+        self.nx = int(width // self.cell_size) + 1
+        self.ny = int(height // self.cell_size) + 1
+
+        # Cell range of each segment's bounding box, expanded to one row per (segment, cell)
+        cx0 = ((np.minimum(self.ax, self.bx) - self.min_x) // self.cell_size).astype(np.int64)
+        cx1 = ((np.maximum(self.ax, self.bx) - self.min_x) // self.cell_size).astype(np.int64)
+        cy0 = ((np.minimum(self.ay, self.by) - self.min_y) // self.cell_size).astype(np.int64)
+        cy1 = ((np.maximum(self.ay, self.by) - self.min_y) // self.cell_size).astype(np.int64)
+        span_x = cx1 - cx0 + 1
+        counts = span_x * (cy1 - cy0 + 1)
+        seg = np.repeat(np.arange(s), counts)
+        offset = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_ids = (cy0[seg] + offset // span_x[seg]) * self.nx + cx0[seg] + offset % span_x[seg]
+
+        # CSR layout: segments sorted by cell, like NodeSpatialIndex
+        self.order = seg[np.argsort(cell_ids, kind="stable")]
+        self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell_ids, minlength=self.nx * self.ny), out=self.cell_start[1:])
+
+    def __len__(self):
+        return len(self.seg_edge)
+
+    def _segments_near(self, x, y, radius):
+        """Segment ids (possibly repeated) filed in the cells within `radius` of (x, y)."""
+        cx0 = max(int((x - radius - self.min_x) // self.cell_size), 0)
+        cx1 = min(int((x + radius - self.min_x) // self.cell_size), self.nx - 1)
+        cy0 = max(int((y - radius - self.min_y) // self.cell_size), 0)
+        cy1 = min(int((y + radius - self.min_y) // self.cell_size), self.ny - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.zeros(0, dtype=np.int64)
+        # Each row of the block is contiguous in the CSR layout
+        chunks = [
+            self.order[self.cell_start[gy * self.nx + cx0]:self.cell_start[gy * self.nx + cx1 + 1]]
+            for gy in range(cy0, cy1 + 1)
+        ]
+        return np.concatenate(chunks)
+
+    def nearest(self, x, y, max_dist):
+        """
+        Returns (edge index, distance) of the edge whose shape passes
+        closest to (x, y), or None if none is within `max_dist` metres.
+        """
+        seg = self._segments_near(x, y, max_dist)
+        if len(seg) == 0:
+            return None
+        ax, ay = self.ax[seg], self.ay[seg]
+        dx, dy = self.bx[seg] - ax, self.by[seg] - ay
+        len2 = dx * dx + dy * dy
+        t = np.clip(((x - ax) * dx + (y - ay) * dy) / np.where(len2 > 0, len2, 1.0), 0.0, 1.0)
+        d2 = (ax + t * dx - x) ** 2 + (ay + t * dy - y) ** 2
+        i = int(np.argmin(d2))
+        if d2[i] > max_dist * max_dist:
+            return None
+        return int(self.seg_edge[seg[i]]), math.sqrt(d2[i])
+
+
+class IncidentIndex:
+    """
+    The active incidents, kept up to date by the writers as edges are
+    flagged and cleared, with a lat/lon grid of buckets over them. Listing
+    all incidents, or those in a bounding box, costs time proportional to
+    the number of incidents rather than to the size of the network.
+    """
+
+    def __init__(self, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self._incidents = {} # edge idx -> {"edge_id", "lat", "lon"}
+        self._cells = {} # (cell x, cell y) -> set of edge idx
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._incidents)
+
+    def _cell_of(self, lat, lon):
+        return int(lon // self.cell_deg), int(lat // self.cell_deg)
+
+    def _discard(self, e):
+        incident = self._incidents.pop(e, None)
+        if incident is not None:
+            cell = self._cell_of(incident["lat"], incident["lon"])
+            members = self._cells[cell]
+            members.discard(e)
+            if not members:
+                del self._cells[cell]
+
+    def set(self, e, edge_id, lat, lon):
+        with self._lock:
+            self._discard(e)
+            self._incidents[e] = {"edge_id": edge_id, "lat": lat, "lon": lon}
+            self._cells.setdefault(self._cell_of(lat, lon), set()).add(e)
+
+    def discard(self, e):
+        with self._lock:
+            self._discard(e)
+
+    def list(self, bbox=None):
+        """[{"edge_id", "lat", "lon"}, ...], optionally within bbox = (min_lon, min_lat, max_lon, max_lat)."""
+        with self._lock:
+            if bbox is None:
+                return [dict(incident) for incident in self._incidents.values()]
+            min_lon, min_lat, max_lon, max_lat = bbox
+            x0, y0 = self._cell_of(min_lat, min_lon)
+            x1, y1 = self._cell_of(max_lat, max_lon)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) < len(self._cells):
+                cells = [self._cells.get((cx, cy), ()) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+            else:
+                cells = [members for (cx, cy), members in self._cells.items() if x0 <= cx <= x1 and y0 <= cy <= y1]
+            return [
+                dict(self._incidents[e]) for members in cells for e in members
+                if min_lat <= self._incidents[e]["lat"] <= max_lat and min_lon <= self._incidents[e]["lon"] <= max_lon
+            ]
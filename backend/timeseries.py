@@ -0,0 +1,98 @@
+"""
+timeseries.py
+Bounded, array-backed event time series (incident / resolution history).
+"""
+import threading
+
+import numpy as np
+
+BUCKET_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+
+
+class EventSeries:
+    """
+    Ring buffer of event timestamps (seconds since the epoch), appended in
+    time order. Keeps the newest `capacity` events; len() is the all-time
+    count and doubles as the cursor for incremental reads.
+    """
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self._ts = np.zeros(capacity, dtype=np.float64)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._total
+
+    @property
+    def retained(self):
+        return min(self._total, self.capacity)
+
+    def append(self, ts):
+        with self._lock:
+            self._ts[self._total % self.capacity] = ts
+            self._total += 1
+
+    def clear(self):
+        """Forgets every event and restarts the cursor at 0 (a web worker following a new engine)."""
+        with self._lock:
+            self._total = 0
+
+    def extend(self, timestamps):
+        ts = np.asarray(timestamps, dtype=np.float64)[-self.capacity:] # Older ones would be overwritten anyway
+        skipped = len(timestamps) - len(ts)
+        with self._lock:
+            self._total += skipped
+            slots = (self._total + np.arange(len(ts))) % self.capacity
+            self._ts[slots] = ts
+            self._total += len(ts)
+
+    def _ordered(self):
+        """Retained timestamps, oldest first (a copy). Caller holds the lock."""
+        if self._total <= self.capacity:
+            return self._ts[:self._total].copy()
+        head = self._total % self.capacity
+        return np.concatenate((self._ts[head:], self._ts[:head]))
+
+    def since(self, cursor):
+        """
+        Events after `cursor` (a previous len()). Returns (timestamps, next_cursor,
+        truncated); truncated is True if some of them already left the buffer.
+        """
+        with self._lock:
+            total = self._total
+            oldest = total - self.retained
+            start = max(cursor, oldest)
+            ts = self._ordered()[start - oldest:] if start < total else np.zeros(0)
+        return ts.tolist(), total, cursor < oldest
+
+    def range(self, start=None, end=None):
+        """Timestamps in [start, end)."""
+        with self._lock:
+            ts = self._ordered()
+        lo = 0 if start is None else np.searchsorted(ts, start, side="left")
+        hi = len(ts) if end is None else np.searchsorted(ts, end, side="left")
+        return ts[lo:hi].tolist()
+
+    def buckets(self, bucket_s, start=None, end=None):
+        """
+        Event counts per `bucket_s`-second bucket in [start, end), aligned to
+        multiples of bucket_s. Returns {"buckets": [[bucket_start, count], ...]
+        (non-empty only), "count_before": events before the first bucket}.
+        """
+        with self._lock:
+            ts = self._ordered()
+            dropped = self._total - len(ts)
+        lo = 0 if start is None else np.searchsorted(ts, start, side="left")
+        hi = len(ts) if end is None else np.searchsorted(ts, end, side="left")
+        keys = np.floor(ts[lo:hi] / bucket_s) * bucket_s
+        starts, counts = np.unique(keys, return_counts=True)
+        return {
+            "buckets": [[t, c] for t, c in zip(starts.tolist(), counts.tolist())],
+            "count_before": int(dropped + lo),
+            "bucket_s": bucket_s
+        }
+
+    def stats(self):
+        return {"total": self._total, "retained": self.retained, "capacity": self.capacity}
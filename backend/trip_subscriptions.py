@@ -0,0 +1,550 @@
+"""
+trip_subscriptions.py
+Active trips that the server re-routes when the weights change, so clients
+subscribe once instead of re-POSTing /route. Each trip keeps the edges of
+its current route in an edge -> trips index (plus a per-edge trip count,
+so the first filter over the changed edges is one array lookup):
+
+  - an edge counts as changed once its weight moved more than
+    `change_ratio` away from the weight it had when it last counted, so
+    heartbeat jitter is ignored but slow drift still adds up
+  - a trip whose changed route edges all got faster keeps its route:
+    every other route gained at most the same saving, so the old search
+    result is still the best one and only its ETA is re-priced
+  - a trip with a slower or blocked edge on its route is searched again
+    (once per (source, target) pair) and switches only if the new route
+    is faster by more than `min_gain`, or the old one is blocked
+
+Trips that went around an incident are also indexed by the blocked
+edges, so they are searched again when it clears. Other edges no trip
+uses are not looked at, so a road that just got faster off a trip's route
+goes unnoticed until the trip's next search; every trip is searched
+again at least every `recheck_s` simulated seconds for that.
+Updates go to the trip's subscribers as SSE frames. A subscriber that
+falls behind has its stream closed (it reconnects for a fresh snapshot),
+and removing or expiring a trip ends its streams with a "closed" event.
+
+Trips live in the engine process. Each trip also keeps its last few
+frames, numbered from one registry-wide sequence, so web workers can
+stream them through TripFollower: the engine publishes the sequence in
+shared memory, and a worker fetches new frames over RPC only when it
+moved.
+"""
+import queue
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from dashboard_stream import close_client, sse_frame
+import wire_format
+
+
+EVENT_LOG_SIZE = 32 # Frames each trip keeps for web workers that fetch them
+ENDED_TRIPS_KEPT = 1000 # Why recently ended trips ended, for workers that still stream them
+
+
+class TripError(Exception):
+    pass
+
+
+class Trip:
+    """One active trip; only the registry changes it, under its lock."""
+
+    def __init__(self, trip_id, source, target, geometry):
+        self.id = trip_id
+        self.source = source
+        self.target = target
+        self.geometry = geometry
+        self.nodes = []
+        self.edges = np.zeros(0, dtype=np.int64)
+        self.travel_time = 0.0 # As of the last search or re-price
+        self.length = 0.0
+        self.version = None # Snapshot of the last search
+        self.sim_time = None
+        self.revision = 0 # Bumped on every route change, to drop stale search results
+        self.reroutes = 0
+        self.unreachable = False
+        self.avoided = set() # Blocked edges this trip was re-routed around
+        self.queues = []
+        self.events = deque(maxlen=EVENT_LOG_SIZE) # (seq, frame)
+        self.evicted_seq = 0 # seq of the newest frame that fell out of `events`
+        self.last_seen = time.time()
+
+
+class TripRegistry:
+    """
+    Active trips and the thread that re-routes them. `search_fn(source,
+    target, snap)` returns a Route or None for one weight snapshot;
+    `ready_fn(version)` may block until searches on that version are fast
+    (e.g. the CCH customization) and is only called when a pass has
+    something to search. Call request() after every weight change.
+    `on_pass(stats)` gets each pass's counts and timings.
+    """
+
+    def __init__(self, graph, search_fn, ready_fn=None, on_pass=None, max_trips=10000, change_ratio=0.05,
+                 min_gain=0.05, recheck_s=120.0, idle_ttl_s=1800.0, client_queue_size=64, logger=None):
+        self.graph = graph
+        self.search_fn = search_fn
+        self.ready_fn = ready_fn
+        self.on_pass = on_pass
+        self.max_trips = max_trips
+        self.change_ratio = change_ratio
+        self.min_gain = min_gain
+        self.recheck_s = recheck_s
+        self.idle_ttl_s = idle_ttl_s
+        self.client_queue_size = client_queue_size
+        self.logger = logger
+        self._trips = {} # trip id -> Trip
+        self._by_edge = {} # edge idx -> set of trip ids whose route uses it
+        self._count = np.zeros(graph.edge_count, dtype=np.int32) # len(_by_edge[e]), as an array
+        self._by_avoided = {} # blocked edge idx -> set of trip ids that detoured around it
+        self._avoided_count = np.zeros(graph.edge_count, dtype=np.int32)
+        self._reference = None # Weights as of each edge's last counted change
+        self._version = None # Last snapshot a pass looked at
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._requested_t = None
+        self._event_seq = 0
+        self._ended = OrderedDict() # trip id -> reason, for the last ENDED_TRIPS_KEPT trips
+        self._thread = threading.Thread(target=self._run, name="trip-reroute", daemon=True)
+        self.passes = 0
+        self.searches = 0
+        self.reroutes = 0
+        self.eta_updates = 0
+        self.frames_sent = 0
+        self.clients_dropped = 0
+        self.expired = 0
+        self.last_pass = None
+
+    def __len__(self):
+        return len(self._trips)
+
+    @property
+    def event_count(self):
+        return self._event_seq
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def request(self):
+        """Wakes the re-route thread for the newest snapshot."""
+        if self._requested_t is None:
+            self._requested_t = time.perf_counter()
+        self._wake.set()
+
+    # --- CLIENT SIDE ---
+    def register(self, source, target, route, snap, geometry="coords"):
+        """Adds a trip on `route` (searched by the caller on `snap`). Returns its payload."""
+        with self._lock:
+            if len(self._trips) >= self.max_trips:
+                raise TripError(f"Too many active trips (at most {self.max_trips}).")
+            trip = Trip(secrets.token_hex(8), source, target, geometry)
+            self._trips[trip.id] = trip
+            self._set_route(trip, route, snap)
+            return self._payload(trip)
+
+    def get(self, trip_id):
+        with self._lock:
+            trip = self._trips.get(trip_id)
+            if trip is None:
+                return None
+            trip.last_seen = time.time()
+            return self._payload(trip)
+
+    def endpoints(self, trip_id):
+        """(source, target) node indices of a trip, or None."""
+        trip = self._trips.get(trip_id)
+        return (trip.source, trip.target) if trip is not None else None
+
+    def move(self, trip_id, source, route, snap):
+        """The client moved: new origin node and the route from there. Pushes a "route" event."""
+        with self._lock:
+            trip = self._trips.get(trip_id)
+            if trip is None:
+                return None
+            trip.source = source
+            trip.last_seen = time.time()
+            previous = trip.travel_time
+            self._set_route(trip, route, snap)
+            self._emit(trip, "route", {**self._payload(trip), "reason": "moved", "previous_time_seconds": previous})
+            return self._payload(trip)
+
+    def remove(self, trip_id):
+        with self._lock:
+            trip = self._trips.get(trip_id)
+            if trip is None:
+                return False
+            self._drop(trip, "removed")
+            return True
+
+    def subscribe(self, trip_id):
+        """Registers a client queue for a trip. Returns (queue, snapshot frame), or None for an unknown trip."""
+        q = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            trip = self._trips.get(trip_id)
+            if trip is None:
+                return None
+            trip.queues.append(q)
+            trip.last_seen = time.time()
+            return q, sse_frame("snapshot", self._payload(trip))
+
+    def snapshot(self, trip_id):
+        """{"frame": snapshot frame, "cursor": seq of its newest event} for a remote subscriber, or None."""
+        with self._lock:
+            trip = self._trips.get(trip_id)
+            if trip is None:
+                return None
+            trip.last_seen = time.time()
+            return {"frame": sse_frame("snapshot", self._payload(trip)),
+                    "cursor": trip.events[-1][0] if trip.events else 0}
+
+    def events_since(self, cursors):
+        """
+        For {trip id: cursor}: {trip id: {"frames": [...], "cursor": n}}, or
+        {"ended": reason} for trips that are gone. A cursor older than the
+        trip's kept frames gets a fresh snapshot frame first. Counts as
+        activity, so streamed trips do not expire.
+        """
+        result = {}
+        with self._lock:
+            now = time.time()
+            for trip_id, cursor in cursors.items():
+                trip = self._trips.get(trip_id)
+                if trip is None:
+                    result[trip_id] = {"ended": self._ended.get(trip_id, "removed")}
+                    continue
+                trip.last_seen = now
+                frames = [frame for seq, frame in trip.events if seq > cursor]
+                if trip.evicted_seq > cursor:
+                    frames.insert(0, sse_frame("snapshot", self._payload(trip)))
+                result[trip_id] = {"frames": frames, "cursor": trip.events[-1][0] if trip.events else cursor}
+        return result
+
+    def unsubscribe(self, trip_id, q):
+        with self._lock:
+            trip = self._trips.get(trip_id)
+            if trip is not None:
+                if q in trip.queues:
+                    trip.queues.remove(q)
+                trip.last_seen = time.time()
+
+    # --- RE-ROUTING ---
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.update(self.graph.snapshot)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Trips: Re-route pass failed: {e}")
+
+    def update(self, snap):
+        """One pass for `snap`: finds the affected trips, re-prices or re-searches them and pushes changes."""
+        requested_t, self._requested_t = self._requested_t, None
+        if snap.version == self._version:
+            return None
+        start_t = time.perf_counter()
+        weights = snap.travel_time
+        if self._reference is None:
+            self._reference = weights.copy()
+        delta = weights - self._reference
+        changed = np.flatnonzero(np.abs(delta) > self.change_ratio * self._reference)
+        self._reference[changed] = weights[changed]
+        self._version = snap.version
+
+        with self._lock:
+            self._expire()
+            # Only edges some trip uses; one dict lookup per such edge, not per changed edge
+            hit = changed[self._count[changed] > 0]
+            slower = hit[delta[hit] > 0]
+            search, reprice = set(), set()
+            for e in slower.tolist():
+                search.update(self._by_edge[e])
+            for e in hit[delta[hit] <= 0].tolist():
+                reprice.update(self._by_edge[e])
+            # A cleared incident is off the route of the trips that went around it: search those again
+            faster = changed[delta[changed] < 0]
+            for e in faster[self._avoided_count[faster] > 0].tolist():
+                search.update(self._by_avoided[e])
+            for trip in self._trips.values():
+                if trip.sim_time is not None and snap.sim_time is not None and snap.sim_time - trip.sim_time > self.recheck_s:
+                    search.add(trip.id)
+            reprice -= search
+            pending = {} # (source, target) -> [(trip id, revision)]
+            for trip_id in search:
+                trip = self._trips[trip_id]
+                pending.setdefault((trip.source, trip.target), []).append((trip_id, trip.revision))
+            eta_updates = sum(self._reprice(self._trips[trip_id], snap) for trip_id in reprice)
+
+        routes = {}
+        if pending:
+            if self.ready_fn is not None:
+                self.ready_fn(snap.version)
+            for key in pending:
+                routes[key] = self.search_fn(key[0], key[1], snap)
+            self.searches += len(pending)
+
+        rerouted = 0
+        with self._lock:
+            for key, trips in pending.items():
+                for trip_id, revision in trips:
+                    trip = self._trips.get(trip_id)
+                    if trip is None or trip.revision != revision or trip.source != key[0]:
+                        continue # Removed or moved while searching
+                    if self._apply(trip, routes[key], snap):
+                        rerouted += 1
+                    elif self._reprice(trip, snap):
+                        eta_updates += 1
+                    trip.version, trip.sim_time = snap.version, snap.sim_time
+                    self._avoid(trip, [e for e in trip.avoided if snap.is_incident[e]])
+
+        end_t = time.perf_counter()
+        self.passes += 1
+        self.reroutes += rerouted
+        self.eta_updates += eta_updates
+        self.last_pass = {
+            "snapshot_version": snap.version,
+            "changed_edges": len(changed),
+            "trip_edges_changed": len(hit),
+            "affected": len(search) + len(reprice),
+            "searched": len(pending),
+            "rerouted": rerouted,
+            "eta_updates": eta_updates,
+            "pass_ms": round((end_t - start_t) * 1000, 2),
+            "latency_ms": round((end_t - (requested_t or start_t)) * 1000, 2)
+        }
+        if self.on_pass is not None:
+            self.on_pass(self.last_pass)
+        if rerouted and self.logger:
+            self.logger.info(f"Trips: Re-routed {rerouted} trip(s) for snapshot {snap.version} "
+                             f"({len(pending)} search(es), {self.last_pass['latency_ms']:.0f} ms after the update).")
+        return self.last_pass
+
+    def _apply(self, trip, route, snap):
+        """Switches `trip` to a searched route if it is worth it. Caller holds the lock. Returns True if it switched."""
+        blocked = bool(len(trip.edges)) and bool(snap.is_incident[trip.edges].any())
+        current = float(snap.travel_time[trip.edges].sum())
+        if route is None or np.array_equal(np.asarray(route.edges, dtype=np.int64), trip.edges):
+            # Blocked with no way around it: tell the client once
+            if blocked and not trip.unreachable:
+                trip.unreachable = True
+                self._emit(trip, "unreachable", {"trip_id": trip.id, "snapshot_version": snap.version,
+                                                 "sim_time": snap.sim_time})
+            return False
+        if not blocked and route.travel_time >= current * (1 - self.min_gain):
+            return False
+        avoided = trip.edges[snap.is_incident[trip.edges]].tolist()
+        self._set_route(trip, route, snap)
+        self._avoid(trip, trip.avoided.union(avoided))
+        trip.reroutes += 1
+        self._emit(trip, "route", {**self._payload(trip), "reason": "blocked" if blocked else "faster",
+                                   "previous_time_seconds": current})
+        return True
+
+    def _reprice(self, trip, snap):
+        """Current route's ETA on `snap`; pushes an "eta" event if it moved more than change_ratio. Caller holds the lock."""
+        travel_time = float(snap.travel_time[trip.edges].sum())
+        if abs(travel_time - trip.travel_time) <= self.change_ratio * trip.travel_time:
+            return False
+        trip.travel_time = travel_time
+        self._emit(trip, "eta", {"trip_id": trip.id, "total_time_seconds": travel_time,
+                                 "snapshot_version": snap.version, "sim_time": snap.sim_time})
+        return True
+
+    # --- BOOKKEEPING (caller holds the lock) ---
+    def _set_route(self, trip, route, snap):
+        self._unindex(trip)
+        trip.nodes = list(route.nodes)
+        trip.edges = np.asarray(route.edges, dtype=np.int64)
+        trip.travel_time = float(route.travel_time)
+        trip.length = float(route.length)
+        trip.version, trip.sim_time = snap.version, snap.sim_time
+        trip.revision += 1
+        trip.unreachable = False
+        edges = np.unique(trip.edges)
+        for e in edges.tolist():
+            self._by_edge.setdefault(e, set()).add(trip.id)
+        self._count[edges] += 1
+
+    def _unindex(self, trip):
+        edges = np.unique(trip.edges)
+        for e in edges.tolist():
+            ids = self._by_edge.get(e)
+            if ids is not None:
+                ids.discard(trip.id)
+                if not ids:
+                    del self._by_edge[e]
+        self._count[edges] -= 1
+
+    def _avoid(self, trip, edges):
+        """Replaces the set of blocked edges `trip` is waiting on to clear."""
+        edges = set(edges)
+        for e in trip.avoided - edges:
+            ids = self._by_avoided[e]
+            ids.discard(trip.id)
+            if not ids:
+                del self._by_avoided[e]
+            self._avoided_count[e] -= 1
+        for e in edges - trip.avoided:
+            self._by_avoided.setdefault(e, set()).add(trip.id)
+            self._avoided_count[e] += 1
+        trip.avoided = edges
+
+    def _drop(self, trip, reason):
+        """Forgets `trip` and ends its streams with a final "closed" event."""
+        self._unindex(trip)
+        self._avoid(trip, ())
+        del self._trips[trip.id]
+        self._event_seq += 1 # So followers notice the end without waiting for another event
+        self._ended[trip.id] = reason
+        while len(self._ended) > ENDED_TRIPS_KEPT:
+            self._ended.popitem(last=False)
+        final = sse_frame("closed", {"trip_id": trip.id, "reason": reason})
+        for q in trip.queues:
+            close_client(q, final)
+        trip.queues = []
+
+    def _expire(self):
+        """Drops trips nobody has streamed or fetched for idle_ttl_s (wall) seconds."""
+        cutoff = time.time() - self.idle_ttl_s
+        for trip in [t for t in self._trips.values() if not t.queues and t.last_seen < cutoff]:
+            self._drop(trip, "expired")
+            self.expired += 1
+
+    def _payload(self, trip):
+        payload = {
+            "trip_id": trip.id,
+            "route_coords": self.graph.path_coords(trip.nodes),
+            "total_time_seconds": trip.travel_time,
+            "total_distance_meters": trip.length,
+            "snapshot_version": trip.version,
+            "sim_time": trip.sim_time,
+            "reroutes": trip.reroutes
+        }
+        return wire_format.encode_route_geometry(payload, trip.geometry)
+
+    def _emit(self, trip, event, data):
+        frame = sse_frame(event, data)
+        self._event_seq += 1
+        if len(trip.events) == trip.events.maxlen:
+            trip.evicted_seq = trip.events[0][0]
+        trip.events.append((self._event_seq, frame))
+        for q in list(trip.queues):
+            try:
+                q.put_nowait(frame)
+                self.frames_sent += 1
+            except queue.Full:
+                # Slow client: end its stream; EventSource reconnects and gets a fresh snapshot
+                trip.queues.remove(q)
+                close_client(q)
+                self.clients_dropped += 1
+
+    def stats(self):
+        return {
+            "active": len(self._trips),
+            "streaming": sum(1 for t in list(self._trips.values()) if t.queues),
+            "indexed_edges": len(self._by_edge),
+            "passes": self.passes,
+            "searches": self.searches,
+            "reroutes": self.reroutes,
+            "eta_updates": self.eta_updates,
+            "frames_sent": self.frames_sent,
+            "clients_dropped": self.clients_dropped,
+            "expired": self.expired,
+            "last_pass": self.last_pass
+        }
+
+
+class TripFollower:
+    """
+    Web-worker side of the engine's TripRegistry: the streams this worker
+    serves for trips that live in the engine. Each stream keeps the
+    engine's event cursor for its trip; poll() fetches what is new for all
+    of them in one call and closes the streams of trips that ended.
+    """
+
+    def __init__(self, client_queue_size=64, touch_s=60.0):
+        self.client_queue_size = client_queue_size
+        self.touch_s = touch_s # Poll at least this often, which also keeps the trips from expiring
+        self._streams = {} # trip id -> {"cursor": n, "queues": [...]}
+        self._lock = threading.Lock()
+        self._last_count = None
+        self._last_poll = 0.0
+        self.polls = 0
+        self.frames_sent = 0
+        self.clients_dropped = 0
+
+    def subscribe(self, trip_id, snapshot):
+        """Registers a client queue given the engine's snapshot() of the trip. Returns (queue, snapshot frame)."""
+        q = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            stream = self._streams.setdefault(trip_id, {"cursor": snapshot["cursor"], "queues": []})
+            stream["queues"].append(q)
+        return q, snapshot["frame"]
+
+    def unsubscribe(self, trip_id, q):
+        with self._lock:
+            stream = self._streams.get(trip_id)
+            if stream is not None and q in stream["queues"]:
+                stream["queues"].remove(q)
+                if not stream["queues"]:
+                    del self._streams[trip_id]
+
+    def poll(self, event_count, fetch_fn):
+        """Fetches new frames through `fetch_fn({trip id: cursor})` if the engine's event count moved (or touch_s passed)."""
+        with self._lock:
+            if not self._streams:
+                return
+            if event_count == self._last_count and time.monotonic() - self._last_poll < self.touch_s:
+                return
+            cursors = {trip_id: stream["cursor"] for trip_id, stream in self._streams.items()}
+        result = fetch_fn(cursors)
+        with self._lock:
+            self._last_count, self._last_poll = event_count, time.monotonic()
+            self.polls += 1
+            for trip_id, update in result.items():
+                stream = self._streams.get(trip_id)
+                if stream is None:
+                    continue
+                if "ended" in update:
+                    final = sse_frame("closed", {"trip_id": trip_id, "reason": update["ended"]})
+                    for q in stream["queues"]:
+                        close_client(q, final)
+                    del self._streams[trip_id]
+                    continue
+                stream["cursor"] = update["cursor"]
+                for q in list(stream["queues"]):
+                    try:
+                        for frame in update["frames"]:
+                            q.put_nowait(frame)
+                            self.frames_sent += 1
+                    except queue.Full:
+                        stream["queues"].remove(q)
+                        close_client(q)
+                        self.clients_dropped += 1
+                if not stream["queues"]:
+                    del self._streams[trip_id]
+
+    def reset(self, reason):
+        """The engine restarted and its trips are gone: closes every stream with `reason`."""
+        with self._lock:
+            for trip_id, stream in self._streams.items():
+                final = sse_frame("closed", {"trip_id": trip_id, "reason": reason})
+                for q in stream["queues"]:
+                    close_client(q, final)
+            self._streams.clear()
+            self._last_count = None
+
+    def stats(self):
+        return {
+            "streamed_trips": len(self._streams),
+            "streaming": sum(len(s["queues"]) for s in list(self._streams.values())),
+            "polls": self.polls,
+            "frames_sent": self.frames_sent,
+            "clients_dropped": self.clients_dropped
+        }
@@ -0,0 +1,464 @@
+"""
+whatif.py
+What-if evaluation of road closures and reopenings on copies of the live
+simulation. The engine loop saves the SUMO state (saveState) when a job
+asks for one; a pool of worker processes, each with its own SUMO on its
+own port, loads it, applies a scenario's blocked edges and runs N
+simulated minutes as fast as it can. Every job also runs a baseline (the
+live incidents only), and scenarios are reported as changes against it.
+
+Workers are separate `python whatif.py --worker` processes at a lower
+CPU priority, so the live loop keeps its core; each listens on a free
+port (multiprocessing.connection, like engine_rpc) that the pool connects
+to.
+"""
+import itertools
+import os
+import secrets
+import select
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+BLOCKED_SPEED = 0.1 # Same as the live incident speed sync
+
+
+class WhatIfError(Exception):
+    pass
+
+
+# --- STATE HAND-OFF FROM THE LIVE LOOP ---
+class StateSnapshots:
+    """
+    Lets request threads ask the live loop for a saved SUMO state. The loop
+    calls serve() once per tick; it only saves when someone is waiting and
+    the newest file is older than `max_age_s` simulated seconds.
+    """
+
+    def __init__(self, directory, max_age_s=5.0, keep=4):
+        self.directory = directory
+        self.max_age_s = max_age_s
+        self.keep = keep
+        self.saves = 0
+        self.last_save_ms = 0.0
+        self._latest = None # (path, sim_time)
+        self._waiting = 0
+        self._cond = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+
+    def request(self, timeout=30.0):
+        """Blocks until the loop has saved a fresh state. Returns (path, sim_time)."""
+        with self._cond:
+            self._waiting += 1
+            requested = self.saves
+            try:
+                if not self._cond.wait_for(lambda: self.saves > requested, timeout):
+                    raise WhatIfError("The simulation loop did not save a state in time (is SUMO running?)")
+                return self._latest
+            finally:
+                self._waiting -= 1
+
+    def serve(self, simulation, sim_time):
+        """Called from the loop thread with the TraCI simulation domain (for saveState)."""
+        if not self._waiting:
+            return False
+        with self._cond:
+            if self._latest is None or sim_time - self._latest[1] > self.max_age_s:
+                path = os.path.join(self.directory, f"state_{sim_time:.2f}.xml")
+                start_t = time.perf_counter()
+                simulation.saveState(path)
+                self.last_save_ms = (time.perf_counter() - start_t) * 1000
+                self._latest = (path, sim_time)
+                self._prune()
+            self.saves += 1
+            self._cond.notify_all()
+        return True
+
+    def _prune(self):
+        states = sorted((os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.startswith("state_")),
+                        key=os.path.getmtime)
+        for path in states[:-self.keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"saves": self.saves, "last_save_ms": round(self.last_save_ms, 1),
+                "latest_sim_time": self._latest[1] if self._latest else None}
+
+
+# --- WORKER SIDE (runs in its own process) ---
+class ScenarioRunner:
+    """One SUMO per worker process, started on the first job and reused."""
+
+    def __init__(self, backend_name, cmd, edge_ids, free_speed):
+        self.backend_name = backend_name
+        self.cmd = cmd
+        self.edge_ids = edge_ids
+        self.free_speed = dict(zip(edge_ids, free_speed))
+        self.module = self.tc = None
+        self.known_edges = None
+        self.modified = set() # Edges whose max speed this worker changed
+
+    def _start(self):
+        if "SUMO_HOME" in os.environ:
+            sys.path.append(os.path.join(os.environ["SUMO_HOME"], "tools"))
+        import sim_backend
+        module, tc = sim_backend.load(self.backend_name)
+        sim_backend.start(module, self.backend_name, self.cmd) # A free port per worker
+        known = set(module.edge.getIDList())
+        self.known_edges = [e for e in self.edge_ids if e in known]
+        self.module, self.tc = module, tc
+
+    def run(self, state_path, blocked, minutes, sample_s):
+        if self.module is None:
+            self._start()
+        try:
+            return self._run(state_path, blocked, minutes, sample_s)
+        except Exception as e:
+            if self._is_fatal(e):
+                self.reset() # SUMO is gone; the next job starts a new one
+            raise
+
+    def _is_fatal(self, e):
+        """True if SUMO itself died (fatal TraCI error or lost connection), not just this job."""
+        fatal = getattr(self.module, "FatalTraCIError", None)
+        return (fatal is not None and isinstance(e, fatal)) or isinstance(e, (ConnectionError, EOFError))
+
+    def _run(self, state_path, blocked, minutes, sample_s):
+        sim, tc = self.module, self.tc
+        sim.simulation.loadState(state_path)
+        # setMaxSpeed changes live in the network, not the state: reset the previous job's and apply this one's
+        blocked = set(blocked)
+        for edge_id in self.modified - blocked:
+            sim.edge.setMaxSpeed(edge_id, self.free_speed[edge_id])
+        for edge_id in blocked:
+            sim.edge.setMaxSpeed(edge_id, BLOCKED_SPEED)
+        self.modified = blocked
+        variables = [tc.LAST_STEP_VEHICLE_NUMBER, tc.LAST_STEP_MEAN_SPEED, tc.LAST_STEP_VEHICLE_HALTING_NUMBER]
+        for edge_id in self.known_edges:
+            sim.edge.subscribe(edge_id, variables)
+
+        index = {edge_id: i for i, edge_id in enumerate(self.known_edges)}
+        free = np.array([self.free_speed[e] for e in self.known_edges])
+        delay = np.zeros(len(free))
+        halting = np.zeros(len(free))
+        start_time = t = sim.simulation.getTime()
+        end_time = start_time + minutes * 60
+        wall_t = time.perf_counter()
+        while t < end_time:
+            target = min(t + sample_s, end_time)
+            sim.simulationStep(target) # Every step up to target, in SUMO
+            dt, t = target - t, target
+            results = sim.edge.getAllSubscriptionResults()
+            idx = np.fromiter(map(index.__getitem__, results), dtype=np.int64, count=len(results))
+            values = list(results.values())
+            count = np.fromiter((v[tc.LAST_STEP_VEHICLE_NUMBER] for v in values), dtype=np.float64, count=len(values))
+            speed = np.fromiter((v[tc.LAST_STEP_MEAN_SPEED] for v in values), dtype=np.float64, count=len(values))
+            halt = np.fromiter((v[tc.LAST_STEP_VEHICLE_HALTING_NUMBER] for v in values), dtype=np.float64, count=len(values))
+            # Time loss: each vehicle loses (1 - v / v_free) seconds per second, as in SUMO's timeLoss
+            delay[idx] += count * np.clip(1 - speed / free[idx], 0, 1) * dt
+            halting[idx] += halt * dt
+            if sim.simulation.getMinExpectedNumber() == 0:
+                break
+        return {
+            "start_time": start_time,
+            "end_time": t,
+            "wall_ms": (time.perf_counter() - wall_t) * 1000,
+            "edge_ids": self.known_edges,
+            "edge_delay_s": delay.astype(np.float32),
+            "edge_halting_s": halting.astype(np.float32),
+            "vehicles_left": sim.simulation.getMinExpectedNumber()
+        }
+
+    def close(self):
+        if self.module is not None:
+            try:
+                self.module.close()
+            except Exception:
+                pass
+
+    def reset(self):
+        """Closes SUMO and forgets it, so the next run() calls _start() again."""
+        self.close()
+        self.module = self.tc = None
+        self.known_edges = None
+        self.modified = set() # A new SUMO starts with the network's own speeds
+
+
+def worker_main(authkey, nice):
+    """
+    Entry point of `python whatif.py --worker`: listens on a free port,
+    prints it, and serves ("init" | "run", kwargs) until the pool goes away.
+    """
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+    runner = None
+    with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+        print(listener.address[1], flush=True)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), 1) # Nobody reads the pipe after this; neither may SUMO
+        conn = listener.accept()
+    with conn:
+        while True:
+            try:
+                command, kwargs = conn.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                if command == "init":
+                    runner = ScenarioRunner(**kwargs)
+                    conn.send(("ok", os.getpid()))
+                elif command == "run":
+                    conn.send(("ok", runner.run(**kwargs)))
+                else:
+                    raise WhatIfError(f"Unknown worker command: {command}")
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+    if runner is not None:
+        runner.close()
+
+
+# --- ENGINE SIDE ---
+class WorkerPool:
+    """
+    `size` worker processes, started on first use. run() takes an idle
+    worker, so up to `size` scenarios run at once; a worker that dies is
+    reaped and replaced on the next run. A worker that does not come up
+    within `start_timeout_s` is killed.
+    """
+
+    def __init__(self, size, init_kwargs, nice=10, logger=None, start_timeout_s=30.0):
+        self.size = size
+        self.init_kwargs = init_kwargs
+        self.nice = nice
+        self.logger = logger
+        self.start_timeout_s = start_timeout_s
+        self._authkey = secrets.token_bytes(16)
+        self._idle = [] # (conn, proc) of workers waiting for a job
+        self._cond = threading.Condition() # Guards _idle, _started and processes
+        self._started = 0 # Workers running or starting
+        self.processes = []
+
+    def _spawn(self):
+        """Starts one worker and connects to it, without holding the lock. Returns (conn, proc)."""
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(self.nice)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        conn = None
+        try:
+            proc.stdin.write(self._authkey.hex().encode() + b"\n") # Not on the command line, where ps shows it
+            proc.stdin.close()
+            deadline = time.monotonic() + self.start_timeout_s
+            # The worker prints its port once it listens; stop waiting if it exits or takes too long
+            while not select.select([proc.stdout], [], [], 0.1)[0]:
+                if proc.poll() is not None:
+                    raise WhatIfError(f"What-if worker exited with code {proc.returncode} before it started")
+                if time.monotonic() > deadline:
+                    raise WhatIfError(f"What-if worker did not start within {self.start_timeout_s:g}s")
+            port = int(proc.stdout.readline() or 0)
+            proc.stdout.close()
+            if not port:
+                raise WhatIfError("What-if worker exited before it started")
+            conn = Client(("127.0.0.1", port), authkey=self._authkey)
+            conn.send(("init", self.init_kwargs))
+            if not conn.poll(max(deadline - time.monotonic(), 1.0)):
+                raise WhatIfError("What-if worker did not answer init")
+            status, pid = conn.recv()
+            if status != "ok":
+                raise WhatIfError(f"What-if worker failed to start: {pid}")
+        except Exception:
+            if conn is not None:
+                conn.close()
+            proc.kill()
+            proc.wait()
+            raise
+        with self._cond:
+            self.processes.append(proc)
+        if self.logger:
+            self.logger.info(f"What-if: Worker {pid} started ({len(self.processes)}/{self.size}).")
+        return conn, proc
+
+    def _acquire(self):
+        """
+        Takes an idle worker, or spawns one if a slot is free. Otherwise waits
+        until a worker is released or a slot frees up (a worker died or
+        failed to start), and then re-checks both.
+        """
+        with self._cond:
+            while not self._idle and self._started >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1 # Reserve the slot; the slow part runs outside the lock
+        try:
+            return self._spawn()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _release(self, conn, proc):
+        with self._cond:
+            self._idle.append((conn, proc))
+            self._cond.notify()
+
+    def _free_slot(self, proc=None):
+        with self._cond:
+            if proc in self.processes:
+                self.processes.remove(proc)
+            self._started -= 1
+            self._cond.notify() # A waiter may spawn the replacement
+
+    def _discard(self, conn, proc):
+        """A worker died: closes its connection, reaps it and frees its slot."""
+        conn.close()
+        proc.kill()
+        proc.wait()
+        self._free_slot(proc)
+
+    def run(self, **kwargs):
+        conn, proc = self._acquire()
+        try:
+            conn.send(("run", kwargs))
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            self._discard(conn, proc) # Spawn a new one next time
+            raise WhatIfError("What-if worker exited")
+        self._release(conn, proc)
+        if status != "ok":
+            raise WhatIfError(result)
+        return result
+
+    def stats(self):
+        with self._cond:
+            processes = list(self.processes)
+            started = self._started
+        return {"size": self.size, "started": started,
+                "alive": sum(1 for p in processes if p.poll() is None)}
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            processes = list(self.processes)
+        for conn, _ in idle:
+            conn.close()
+        for proc in processes:
+            proc.terminate()
+
+
+class WhatIfService:
+    """
+    Runs what-if jobs in the background. A job is a list of scenarios
+    ({"name", "close": [edge ids], "reopen": [edge ids]}); it is evaluated
+    from one saved state, with the baseline and all scenarios in parallel
+    on the worker pool.
+    """
+
+    def __init__(self, pool, snapshots, live_blocked_fn, edge_info_fn, sample_s=5.0, max_jobs=20, logger=None):
+        self.pool = pool
+        self.snapshots = snapshots
+        self.live_blocked_fn = live_blocked_fn # () -> edge ids blocked in the live simulation
+        self.edge_info_fn = edge_info_fn # edge id -> {"lat", "lon"} for the report
+        self.sample_s = sample_s
+        self.max_jobs = max_jobs
+        self.logger = logger
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool.size + 1, thread_name_prefix="whatif")
+        self._job_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whatif-job") # One job at a time
+
+    def submit(self, scenarios, minutes, top):
+        with self._lock:
+            job_id = str(next(self._ids))
+            self._jobs[job_id] = {"id": job_id, "status": "queued", "minutes": minutes,
+                                  "scenarios": [s["name"] for s in scenarios], "created": time.time()}
+            for old in list(self._jobs)[:-self.max_jobs]:
+                del self._jobs[old]
+        self._job_runner.submit(self._run_job, job_id, scenarios, minutes, top)
+        return self.job(job_id)
+
+    def job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _run_job(self, job_id, scenarios, minutes, top):
+        start_t = time.perf_counter()
+        self._update(job_id, status="running")
+        try:
+            state_path, sim_time = self.snapshots.request()
+            live = set(self.live_blocked_fn())
+            variants = [live] + [(live | set(s.get("close", []))) - set(s.get("reopen", [])) for s in scenarios]
+            futures = [
+                self._executor.submit(self.pool.run, state_path=state_path, blocked=sorted(blocked),
+                                      minutes=minutes, sample_s=self.sample_s)
+                for blocked in variants
+            ]
+            baseline, *runs = [f.result() for f in futures]
+            results = [self._compare(s, run, baseline, top) for s, run in zip(scenarios, runs)]
+            self._update(job_id, status="done", sim_time=sim_time, baseline=self._summary(baseline),
+                         results=results, wall_ms=round((time.perf_counter() - start_t) * 1000, 1))
+            if self.logger:
+                self.logger.info(f"What-if: Job {job_id} evaluated {len(scenarios)} scenario(s) over {minutes} min "
+                                 f"in {(time.perf_counter() - start_t):.1f}s.")
+        except Exception as e:
+            self._update(job_id, status="error", message=str(e))
+            if self.logger:
+                self.logger.warning(f"What-if: Job {job_id} failed: {e}")
+
+    @staticmethod
+    def _summary(run):
+        return {
+            "delay_s": round(float(run["edge_delay_s"].sum()), 1),
+            "halting_vehicle_s": round(float(run["edge_halting_s"].sum()), 1),
+            "mean_halting": round(float(run["edge_halting_s"].sum()) / max(run["end_time"] - run["start_time"], 1e-9), 2),
+            "simulated_s": run["end_time"] - run["start_time"],
+            "vehicles_left": run["vehicles_left"],
+            "wall_ms": round(run["wall_ms"], 1)
+        }
+
+    def _compare(self, scenario, run, baseline, top):
+        summary = self._summary(run)
+        base = self._summary(baseline)
+        # Both runs list the same edges in the same order (one edge list per pool)
+        change = run["edge_delay_s"].astype(np.float64) - baseline["edge_delay_s"]
+        worst = np.argsort(-np.abs(change))[:top]
+        return {
+            "name": scenario["name"],
+            "close": scenario.get("close", []),
+            "reopen": scenario.get("reopen", []),
+            **summary,
+            "delay_change_s": round(summary["delay_s"] - base["delay_s"], 1),
+            "delay_change_pct": round((summary["delay_s"] - base["delay_s"]) / base["delay_s"] * 100, 1) if base["delay_s"] else None,
+            "halting_change_vehicle_s": round(summary["halting_vehicle_s"] - base["halting_vehicle_s"], 1),
+            "most_affected": [
+                {"edge_id": run["edge_ids"][i], "delay_change_s": round(float(change[i]), 1),
+                 "halting_s": round(float(run["edge_halting_s"][i]), 1), **self.edge_info_fn(run["edge_ids"][i])}
+                for i in worst.tolist() if change[i] != 0
+            ]
+        }
+
+    def stats(self):
+        with self._lock:
+            statuses = [job["status"] for job in self._jobs.values()]
+        return {
+            "jobs": {status: statuses.count(status) for status in set(statuses)},
+            "pool": self.pool.stats(),
+            "state": self.snapshots.stats()
+        }
+
+
+if __name__ == "__main__" and len(sys.argv) == 3 and sys.argv[1] == "--worker":
+    worker_main(bytes.fromhex(sys.stdin.readline().strip()), int(sys.argv[2]))
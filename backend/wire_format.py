@@ -0,0 +1,141 @@
+"""
+wire_format.py
+Compact encodings a client can ask for instead of the default JSON:
+
+    polyline     route geometry as an encoded polyline (Google's format:
+                 zigzag + base64-ish varints of lat/lon deltas), precision 5 or 6
+    columnar     dashboard arrays as one list per field instead of one dict
+                 per row; static lat/lon tables are sent only when the
+                 client's ?static= key is out of date
+    msgpack      the same payloads as MessagePack (needs the msgpack package)
+    gzip / br    response compression by Accept-Encoding above a size
+                 threshold (br needs the brotli package)
+
+msgpack and brotli are optional: without them those encodings are simply
+not offered.
+"""
+import gzip
+import zlib
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GEOMETRY_FORMATS = {"coords": None, "polyline": 5, "polyline6": 6}
+MSGPACK_MIMETYPE = "application/msgpack"
+COMPRESSIBLE_MIMETYPES = ("application/json", MSGPACK_MIMETYPE, "text/plain", "text/html", "text/css",
+                          "application/javascript", "text/javascript")
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4 # Brotli's fast range; 11 is several times slower for a few % more
+
+
+# --- ROUTE GEOMETRY ---
+def encode_polyline(coords, precision=5):
+    """[[lat, lon], ...] -> encoded polyline string (vectorized over all points)."""
+    points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if not len(points):
+        return ""
+    scaled = np.round(points * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64) # Zigzag: small magnitudes -> small values
+    # 5-bit chunks, least significant first; every chunk but the last has 0x20 set
+    shifts = np.arange(13, dtype=np.uint64) * np.uint64(5)
+    shifted = values[:, None] >> shifts
+    n_chunks = 1 + (shifted[:, 1:] > 0).sum(axis=1)
+    chunks = shifted & np.uint64(31)
+    position = np.arange(13)
+    chunks = chunks + np.where(position < (n_chunks - 1)[:, None], 0x20, 0).astype(np.uint64) + np.uint64(63)
+    return chunks[position < n_chunks[:, None]].astype(np.uint8).tobytes().decode("ascii")
+
+
+def decode_polyline(encoded, precision=5):
+    """Encoded polyline -> [[lat, lon], ...]."""
+    values = []
+    value = shift = 0
+    for ch in encoded.encode("ascii"):
+        chunk = ch - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append((value >> 1) ^ -(value & 1))
+            value = shift = 0
+    points = np.cumsum(np.asarray(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return points.tolist()
+
+
+def encode_route_geometry(payload, geometry):
+    """
+    Copy of a /route payload with every "route_coords" (the route's and its
+    alternatives') replaced by "route_polyline" in the requested format.
+    """
+    precision = GEOMETRY_FORMATS[geometry]
+    if precision is None:
+        return payload
+
+    def encode(route):
+        route = dict(route)
+        route["route_polyline"] = encode_polyline(route.pop("route_coords"), precision)
+        return route
+
+    encoded = encode(payload)
+    if "alternatives" in encoded:
+        encoded["alternatives"] = [encode(alt) for alt in encoded["alternatives"]]
+    encoded["geometry"] = geometry
+    return encoded
+
+
+# --- COLUMNAR TABLES ---
+def columns(rows, fields):
+    """[{field: value}, ...] -> {field: [values]} for the given fields."""
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+
+def table_key(*arrays):
+    """Short content hash of static tables, e.g. to tell clients whether theirs is current."""
+    crc = 0
+    for arr in arrays:
+        crc = zlib.crc32(np.ascontiguousarray(arr).tobytes() if isinstance(arr, np.ndarray) else repr(arr).encode(), crc)
+    return f"{crc:08x}"
+
+
+# --- BODY ENCODING + COMPRESSION ---
+def wants_msgpack(accept_mimetypes, format_arg=None):
+    """True if the client asked for MessagePack (?format=msgpack or Accept) and msgpack is installed."""
+    if msgpack is None:
+        return False
+    if format_arg is not None:
+        return format_arg == "msgpack"
+    return accept_mimetypes.quality(MSGPACK_MIMETYPE) > accept_mimetypes.quality("application/json")
+
+
+def pack(payload):
+    # Lat/lon and intensities fit float32 (well under a metre at city scale)
+    return msgpack.packb(payload, use_single_float=True)
+
+
+def unpack(body):
+    return msgpack.unpackb(body)
+
+
+def choose_encoding(accept_encodings):
+    """Best supported Content-Encoding for an Accept-Encoding header, or None."""
+    candidates = [("br", brotli is not None), ("gzip", True)]
+    best, best_q = None, 0
+    for name, available in candidates:
+        q = accept_encodings[name] if available else 0
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)